@@ -0,0 +1,116 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batching of controller requests that can be sent as one.
+
+Items added under the same key, normally the resource they are sent to,
+within window seconds of the first one are handed to a single flush
+call. The first caller of a key leads the batch: it waits for the window
+to pass, or for the batch to reach size items, and then flushes it.
+Every caller blocks until its batch is flushed and gets the result of
+the flush, or its exception. Batches of a key are flushed one at a time,
+in the order they were opened, so a later change never overtakes an
+earlier one.
+
+A batch stays open while the batch ahead of it is flushed, so items
+added meanwhile are sent together even with a window of 0: an item
+arriving while nothing of its key is in flight is flushed right away,
+and batches only grow when the controller is the bottleneck.
+"""
+
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class _Batch(object):
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class BatchCollector(object):
+    """Collects concurrent items that share a key into batches."""
+
+    def __init__(self, window=0, size=100):
+        self.window = window
+        self.size = size
+        self._cond = threading.Condition()
+        self._open = {}
+        # batches of each key waiting to flush or flushing, oldest first
+        self._queued = {}
+
+    def add(self, key, item, flush):
+        """Return flush(key, items) of the batch item was added to.
+
+        Exceptions raised by flush are re-raised in every caller of the
+        failed batch.
+        """
+        with self._cond:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+                self._queued.setdefault(key, []).append(batch)
+            batch.items.append(item)
+            if len(batch.items) >= self.size:
+                # full, the next item of key starts a new batch
+                del self._open[key]
+                self._cond.notify_all()
+
+            if leader:
+                deadline = time.time() + self.window
+                while self._open.get(key) is batch:
+                    if self._queued[key][0] is not batch:
+                        # collect while the batch ahead is flushed
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        del self._open[key]
+                        break
+                    self._cond.wait(remaining)
+                while self._queued[key][0] is not batch:
+                    self._cond.wait()
+            else:
+                while not batch.done:
+                    self._cond.wait()
+                if batch.error is not None:
+                    raise batch.error
+                return batch.result
+
+        if len(batch.items) > 1:
+            LOG.debug(_("BatchCollector: sending %(count)d items for "
+                        "%(key)s"), {'count': len(batch.items), 'key': key})
+        try:
+            batch.result = flush(key, batch.items)
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            with self._cond:
+                batch.done = True
+                queued = self._queued[key]
+                queued.pop(0)
+                if not queued:
+                    del self._queued[key]
+                self._cond.notify_all()
+        return batch.result
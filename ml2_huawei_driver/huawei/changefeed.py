@@ -0,0 +1,125 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Consumption of the sdn controller change feed.
+
+The controller reports the resources that changed on its side through a
+long polled GET /changes?cursor=<cursor>&wait=<seconds>, answered with
+
+    {"cursor": "<next cursor>", "reset": false,
+     "changes": [{"type": "network", "id": ..., "tenant_id": ...}, ...]}
+
+One poller per feed group (one per cluster when sharded) hands the
+changes to SyncService.reconcile and then has the service checkpoint its
+cursor along with the reconciled networks, so a restart resumes where it
+stopped. "reset" means the cursor is too old to
+resume from and triggers a full sync. While a feed keeps failing it is
+reported unhealthy, and the driver falls back to its periodic full sync.
+"""
+
+import threading
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei.clients import RemoteRestError
+
+
+LOG = logging.getLogger(__name__)
+
+
+class ChangeFeed(object):
+    """Pollers of the controller change feeds."""
+
+    def __init__(self, client, sync_service, full_sync, lock, wait=30,
+                 failure_limit=3, retry_interval=5):
+        self.client = client
+        self.sync_service = sync_service
+        self.full_sync = full_sync
+        self.lock = lock
+        self.wait = wait
+        self.failure_limit = failure_limit
+        self.retry_interval = retry_interval
+        self.groups = client.feed_groups()
+        self.cursors = dict(sync_service.cursors)
+        self.failures = dict.fromkeys(self.groups, 0)
+        self._cursor_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for name in sorted(self.groups):
+            thread = threading.Thread(target=self._run, args=(name,),
+                                      name='huawei-changefeed-%s' % name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def healthy(self):
+        """True while every feed is running and delivering."""
+        return (bool(self._threads) and not self._stop.is_set() and
+                all(count < self.failure_limit
+                    for count in self.failures.values()))
+
+    def _run(self, name):
+        LOG.info(_("ChangeFeed: following feed %(name)s from cursor "
+                   "%(cursor)s"),
+                 {'name': name, 'cursor': self.cursors.get(name)})
+        while not self._stop.is_set():
+            try:
+                self.poll(name)
+            except Exception:
+                LOG.exception(_("ChangeFeed: feed %s failed"), name)
+                self._failed(name)
+            if self.failures[name]:
+                self._stop.wait(self.retry_interval)
+
+    def _failed(self, name):
+        self.failures[name] += 1
+        if self.failures[name] == self.failure_limit:
+            LOG.warning(_("ChangeFeed: feed %s lost, falling back to "
+                          "periodic sync"), name)
+
+    def poll(self, name):
+        """Poll feed name once and reconcile what it reports."""
+        try:
+            reply = self.client.rest_get_changes(
+                self.groups[name], self.cursors.get(name), self.wait)
+        except RemoteRestError:
+            self._failed(name)
+            return
+        if reply.get('reset'):
+            LOG.warning(_("ChangeFeed: cursor of feed %s expired, running "
+                          "a full sync"), name)
+            self.full_sync()
+            failed = 0
+        else:
+            changes = reply.get('changes') or []
+            if not changes:
+                failed = 0
+            else:
+                with self.lock:
+                    failed = self.sync_service.reconcile(changes)
+        if failed:
+            # keep the cursor, the same changes are polled again
+            self._failed(name)
+            return
+        if self.failures[name] >= self.failure_limit:
+            LOG.info(_("ChangeFeed: feed %s recovered"), name)
+        self.failures[name] = 0
+        with self._cursor_lock:
+            self.cursors[name] = reply.get('cursor')
+            self.sync_service.save_cursor(name, self.cursors[name])
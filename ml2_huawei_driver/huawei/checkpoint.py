@@ -0,0 +1,154 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local checkpoint of what was last pushed to the sdn controller.
+
+The checkpoint is a small SQLite file holding one NetworkRecord row per
+network, fingerprint included, and the time of the last successful sync.
+It is rewritten in a single transaction, so a crash leaves the previous
+checkpoint in place. The change feed cursors are kept alongside, written
+in the same transaction as the networks reconciled up to them, so a
+cursor never gets ahead of the fingerprints. A missing, unreadable or
+outdated checkpoint loads as empty, which only costs a full
+reconciliation.
+"""
+
+import sqlite3
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import records
+
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA_VERSION = '1'
+_CURSOR = 'cursor:'
+
+_SCHEMA = ("CREATE TABLE IF NOT EXISTS meta "
+           "(name TEXT PRIMARY KEY, value TEXT)",
+           "CREATE TABLE IF NOT EXISTS networks "
+           "(id TEXT PRIMARY KEY, tenant_id TEXT, up INTEGER, "
+           "external INTEGER, fingerprint BLOB)")
+
+
+class Checkpoint(object):
+    """SQLite backed checkpoint of network sync state."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    def load(self):
+        """Return (last_sync, RecordTable of NetworkRecord)."""
+        networks = records.RecordTable()
+        try:
+            conn = self._connect()
+            try:
+                meta = dict(conn.execute("SELECT name, value FROM meta"))
+                if meta.get('version') != SCHEMA_VERSION:
+                    return None, networks
+                for row in conn.execute("SELECT id, tenant_id, up, external, "
+                                        "fingerprint FROM networks"):
+                    networks.add(records.NetworkRecord(
+                        records.uuid_key(row[0]), records.intern_str(row[1]),
+                        bool(row[2]), bool(row[3]), bytes(row[4])))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            LOG.warning(_("Checkpoint: unable to load %(path)s: %(e)s"),
+                        {'path': self.path, 'e': e})
+            return None, records.RecordTable()
+        last_sync = meta.get('last_sync')
+        return (float(last_sync) if last_sync else None), networks
+
+    def load_cursors(self):
+        """Return the saved change feed cursors, {feed name: cursor}."""
+        try:
+            conn = self._connect()
+            try:
+                meta = dict(conn.execute("SELECT name, value FROM meta"))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            LOG.warning(_("Checkpoint: unable to load %(path)s: %(e)s"),
+                        {'path': self.path, 'e': e})
+            return {}
+        if meta.get('version') != SCHEMA_VERSION:
+            return {}
+        return dict((name[len(_CURSOR):], value)
+                    for name, value in meta.items()
+                    if name.startswith(_CURSOR))
+
+    def save(self, networks, last_sync, cursors=None):
+        """Replace the checkpoint with networks, a table of NetworkRecord."""
+        rows = [_network_row(r) for r in networks]
+        meta = [('version', SCHEMA_VERSION), ('last_sync', repr(last_sync))]
+        meta.extend(_cursor_rows(cursors))
+        return self._write(rows, meta, replace=True)
+
+    def update(self, networks, network_ids, cursors):
+        """Save network_ids as in networks and cursors, in one transaction.
+
+        The networks of network_ids missing from networks are removed.
+        """
+        rows = []
+        deleted = []
+        for network_id in network_ids:
+            record = networks.get(network_id)
+            if record is None:
+                deleted.append((network_id,))
+            else:
+                rows.append(_network_row(record))
+        meta = [('version', SCHEMA_VERSION)]
+        meta.extend(_cursor_rows(cursors))
+        return self._write(rows, meta, deleted)
+
+    def _write(self, rows, meta, deleted=(), replace=False):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    if replace:
+                        conn.execute("DELETE FROM networks")
+                    conn.executemany("DELETE FROM networks WHERE id = ?",
+                                     deleted)
+                    conn.executemany("INSERT OR REPLACE INTO networks "
+                                     "VALUES (?, ?, ?, ?, ?)", rows)
+                    conn.executemany("INSERT OR REPLACE INTO meta VALUES "
+                                     "(?, ?)", meta)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            LOG.warning(_("Checkpoint: unable to save %(path)s: %(e)s"),
+                        {'path': self.path, 'e': e})
+            return False
+        return True
+
+
+def _network_row(record):
+    return (records.key_to_id(record.key), record.tenant_id,
+            int(record.up), int(record.external),
+            sqlite3.Binary(record.fingerprint))
+
+
+def _cursor_rows(cursors):
+    return [(_CURSOR + name, cursor)
+            for name, cursor in (cursors or {}).items()
+            if cursor is not None]
@@ -21,14 +21,27 @@ A client for Huawei sdn controller.
 """
 
 import base64
+import collections
+import contextlib
+import errno
+import heapq
 import httplib
-import json
+import itertools
+import os
 import socket
+import ssl
+import threading
+import time
+import urllib
 
 from oslo.config import cfg
 
-from neutron.common import exceptions, utils
+from neutron.common import exceptions
 from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import codec
+from neutron.plugins.ml2.drivers.huawei import recorder
+from neutron.plugins.ml2.drivers.huawei import singleflight
+from neutron.plugins.ml2.drivers.huawei import tracing
 
 
 LOG = logging.getLogger(__name__)
@@ -45,8 +58,74 @@ restproxy_opts = [
     cfg.BoolOpt('sync_data', default=False,
                 help=_("Sync data on connection")),
     cfg.IntOpt('server_timeout', default=10,
-               help=_("Maximum number of seconds to wait for"
-                      " proxy request to connect and complete.")),
+               help=_("Maximum number of seconds to wait for the "
+                      "response to a proxy request once connected.")),
+    cfg.IntOpt('server_connect_timeout', default=5,
+               help=_("Maximum number of seconds to wait for the "
+                      "connection to the controller to be established.")),
+    cfg.BoolOpt('adaptive_timeouts', default=False,
+                help=_("If True, derive the read timeout of each "
+                       "operation type from its observed latency, bounded "
+                       "by server_timeout.")),
+    cfg.IntOpt('adaptive_timeout_percentile', default=99,
+               help=_("Latency percentile the adaptive read timeout is "
+                      "based on.")),
+    cfg.FloatOpt('adaptive_timeout_multiplier', default=3.0,
+                 help=_("Multiplier applied to the observed latency "
+                        "percentile to obtain the adaptive read timeout.")),
+    cfg.FloatOpt('adaptive_timeout_min', default=1.0,
+                 help=_("Lower bound in seconds for adaptive read "
+                        "timeouts.")),
+    cfg.StrOpt('server_ca_file', default=None,
+               help=_("CA bundle used to verify the certificate of the "
+                      "Huawei sdn controller. The system CAs are used if "
+                      "not set.")),
+    cfg.StrOpt('server_cert_file', default=None,
+               help=_("Client certificate presented to the Huawei sdn "
+                      "controller.")),
+    cfg.StrOpt('server_key_file', default=None,
+               help=_("Private key of the client certificate.")),
+    cfg.BoolOpt('server_ssl_verify', default=True,
+                help=_("If True, verify the certificate and host name of "
+                       "the Huawei sdn controller.")),
+    cfg.IntOpt('server_pool_size', default=4,
+               help=_("Number of idle keep-alive connections kept per "
+                      "controller. 0 opens a new connection per request.")),
+    cfg.ListOpt('server_clusters', default=[],
+                help=_("Controller clusters to shard tenants across, as "
+                       "name=host:port|host:port entries. If set, it "
+                       "replaces the single nos_host controller.")),
+    cfg.IntOpt('shard_virtual_nodes', default=128,
+               help=_("Number of points each cluster gets on the tenant "
+                      "hash ring.")),
+    cfg.StrOpt('traffic_record_file', default=None,
+               help=_("If set, record method, resource, payload size, "
+                      "timing and status of every controller request to "
+                      "this file for later replay.")),
+    cfg.IntOpt('traffic_record_max_bytes', default=10 * 1024 * 1024,
+               help=_("Size at which the traffic recording is rotated.")),
+    cfg.IntOpt('traffic_record_backups', default=5,
+               help=_("Number of rotated traffic recordings to keep.")),
+    cfg.IntOpt('slow_call_log_size', default=20,
+               help=_("Number of slowest controller calls kept with their "
+                      "phase timings, 0 disables the slow call log.")),
+    cfg.FloatOpt('slow_call_threshold', default=0.5,
+                 help=_("Seconds a controller call must take to be "
+                        "considered for the slow call log.")),
+    cfg.BoolOpt('resource_generations', default=False,
+                help=_("Stamp every write to the controller with a "
+                       "generation number, so that the controller can "
+                       "reject writes overtaken by a newer one. Only for "
+                       "controllers that accept the generation field.")),
+    cfg.StrOpt('wire_codec', default='json',
+               help=_("Encoding of controller requests, json or msgpack. "
+                      "msgpack needs the msgpack package, controllers "
+                      "that do not accept it are sent json.")),
+    cfg.IntOpt('capabilities_ttl', default=600,
+               help=_("Seconds the capabilities reported by a controller "
+                      "are trusted before it is probed again. It is also "
+                      "probed again on failing over to it. 0 probes every "
+                      "controller only once and on failover.")),
 ]
 
 cfg.CONF.register_opts(restproxy_opts, "RESTCLIENT")
@@ -61,34 +140,315 @@ PORTS_PATH = "/tenants/%s/networks/%s/ports/%s"
 ATTACHMENT_PATH = "/tenants/%s/networks/%s/ports/%s/attachment"
 ROUTERS_PATH = "/tenants/%s/routers/%s"
 ROUTER_INTF_PATH = "/tenants/%s/routers/%s/interfaces/%s"
+FLOATINGIPS_PATH = "/tenants/%s/networks/%s/floatingips"
+FLOATINGIP_PATH = "/tenants/%s/networks/%s/floatingips/%s"
+CHANGES_PATH = "/changes"
+CAPABILITIES_PATH = "/capabilities"
+# capability of controllers taking lists of resources on collection
+# resources, such as {"networks": [...]} on NET_RESOURCE_PATH
+BULK_CAPABILITY = 'bulk'
+# Seconds before a controller that could not be probed is probed again
+PROBE_RETRY_INTERVAL = 30
 SUCCESS_CODES = range(200, 207)
+UNSUPPORTED_MEDIA_TYPE = 415
 FAILURE_CODES = [0, 301, 302, 303, 400, 401, 403, 404, 500, 501, 502, 503,
                  504, 505]
 SYNTAX_ERROR_MESSAGE = _('Syntax error in server config file, aborting plugin')
 BASE_URI = '/networkService/v1.1'
 ORCHESTRATION_SERVICE_ID = 'Neutron v2.0'
 METADATA_SERVER_IP = '169.254.169.254'
+# Generation of a write, in the resource documents of POST, PUT and
+# PATCH bodies and in this header of DELETE requests
+GENERATION_KEY = 'generation'
+GENERATION_HEADER = 'Resource-Generation'
+# Returned for a write older than the last one applied to its resource
+STALE_GENERATION = 409
+# How concurrent requests for the same resource share the wire
+SINGLE_FLIGHT_MODES = {
+    'PUT': singleflight.MODE_MERGE,
+    'GET': singleflight.MODE_JOIN,
+    'DELETE': singleflight.MODE_JOIN,
+}
+
+_call_state = threading.local()
+
+
+@contextlib.contextmanager
+def call_deadline(seconds):
+    """Bound all controller calls made by this thread in the block.
+
+    The deadline covers queueing, failover across servers and the HTTP
+    exchanges themselves. Nested blocks can only shorten it.
+    """
+    previous = getattr(_call_state, 'deadline', None)
+    deadline = time.time() + seconds if seconds else None
+    if previous is not None and (deadline is None or previous < deadline):
+        deadline = previous
+    _call_state.deadline = deadline
+    try:
+        yield
+    finally:
+        _call_state.deadline = previous
+
+
+def current_deadline():
+    """Return the absolute deadline of the current thread, if any."""
+    return getattr(_call_state, 'deadline', None)
+
+
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+
+def get_ssl_context(ca_file=None, cert_file=None, key_file=None,
+                    verify=True):
+    """Return the process wide SSL context for the given options.
+
+    Loading CAs and certificates is expensive, so a context is built once
+    and shared by every connection to the controllers.
+    """
+    key = (ca_file, cert_file, key_file, verify)
+    with _ssl_contexts_lock:
+        context = _ssl_contexts.get(key)
+        if context is None:
+            context = ssl.create_default_context(cafile=ca_file)
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            if cert_file:
+                context.load_cert_chain(cert_file, key_file)
+            _ssl_contexts[key] = context
+    return context
+
+
+class TLSConnection(httplib.HTTPSConnection):
+    """HTTPS connection on a shared SSL context.
+
+    Every new connection makes a full handshake, the ssl module of
+    Python 2.7 cannot resume sessions. Handshakes are saved by keeping
+    connections alive in the pool of their ServerProxy.
+    """
+
+    def __init__(self, host, port, context, timeout=None):
+        httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout,
+                                         context=context)
+        self.ssl_context = context
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock = self.ssl_context.wrap_socket(sock,
+                                                 server_hostname=self.host)
+
+
+def _dropped_before_response(e):
+    """True if e shows a connection closed before any response byte.
+
+    That is how a controller closing an idle keep-alive connection shows,
+    the request was not processed and can be sent again. Timeouts, and
+    failures once a response started, are never taken for it.
+    """
+    if isinstance(e, socket.timeout):
+        return False
+    if isinstance(e, httplib.BadStatusLine):
+        # no status line at all, rather than a malformed one
+        return e.line in ('', "''")
+    if isinstance(e, socket.error):
+        return e.errno in (errno.ECONNRESET, errno.EPIPE,
+                           errno.ECONNABORTED)
+    return False
 
 
 class RemoteRestError(exceptions.NeutronException):
-    def __init__(self, message):
+    def __init__(self, message, status=None):
         if message is None:
             message = "None"
         self.message = _("Error in REST call to remote network "
                          "controller") + ": " + message
+        # HTTP status of the failed call, 0 when no server answered
+        self.status = status
         super(RemoteRestError, self).__init__()
 
 
+def operation_kind(action, resource):
+    """Return the latency class of action on resource.
+
+    Requests on a collection and on its members are told apart, e.g.
+    'PUT networks/*' for a full network update and 'PUT ports/*' for a
+    port update, whatever the tenant and ids in the path.
+    """
+    path = resource.split('?', 1)[0].strip('/').split('/')
+    if len(path) % 2:
+        return '%s %s' % (action, path[-1])
+    return '%s %s/*' % (action, path[-2])
+
+
+class LatencyTracker(object):
+    """Sliding window of observed latencies per operation kind."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, latency):
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = collections.deque(maxlen=self.window)
+                self._samples[operation] = samples
+            samples.append(latency)
+
+    def percentile(self, operation, percent):
+        """Return the latency percentile, or None without enough data."""
+        with self._lock:
+            samples = sorted(self._samples.get(operation, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1,
+                    int(round(percent / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+SlowCall = collections.namedtuple('SlowCall', [
+    'start', 'duration', 'method', 'resource', 'payload_bytes', 'server',
+    'status', 'retries', 'phases', 'request_id'])
+
+
+class SlowCallLog(object):
+    """The size slowest controller calls over threshold seconds."""
+
+    def __init__(self, size=20, threshold=0.0):
+        self.size = size
+        self.threshold = threshold
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        if call.duration < self.threshold:
+            return
+        item = (call.duration, next(self._seq), call)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def calls(self):
+        """Return the recorded calls, slowest first."""
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [item[2] for item in items]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+class ResourceLocks(object):
+    """Locks by resource, created on demand and dropped once unused."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @contextlib.contextmanager
+    def hold(self, resource):
+        with self._lock:
+            entry = self._locks.get(resource)
+            if entry is None:
+                entry = self._locks[resource] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[resource]
+
+
+class GenerationClock(object):
+    """Hybrid clock issuing strictly increasing write generations.
+
+    Generations are wall clock microseconds, bumped past the last one
+    issued when the clock stalls or steps back. They thus keep increasing
+    across a restart, and order writes of the API workers of a host, or
+    of hosts with synchronized clocks, the way they were issued.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            self._last = max(int(self._clock() * 1000000), self._last + 1)
+            return self._last
+
+
+def with_generation(document, generation):
+    """Return document carrying generation, unchanged for None."""
+    if generation is None:
+        return document
+    return dict(document, **{GENERATION_KEY: generation})
+
+
+def _generation_of(request):
+    """Return the highest generation of a (data, headers) request."""
+    data = request[0]
+    docs = data.values() if isinstance(data, dict) else []
+    generations = [doc[GENERATION_KEY] for doc in docs
+                   if isinstance(doc, dict) and GENERATION_KEY in doc]
+    return max(generations) if generations else None
+
+
+def _newest_request(trailing, request):
+    """Pick the request built from the newest state of two merged PUTs."""
+    old, new = _generation_of(trailing), _generation_of(request)
+    if old is not None and new is not None and new < old:
+        return trailing
+    return request
+
+
 class ServerProxy(object):
     """REST server proxy to a network controller."""
 
     def __init__(self, server, port, ssl, auth, neutron_id, timeout,
-                 base_uri, name):
+                 base_uri, name, connect_timeout=None, latencies=None,
+                 adaptive_percentile=99, adaptive_multiplier=3.0,
+                 adaptive_min=1.0, ssl_context=None, pool_size=0,
+                 recorder=None, wire_codec=None, capabilities_ttl=0):
         self.server = server
         self.port = port
         self.ssl = ssl
         self.base_uri = base_uri
         self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.latencies = latencies
+        self.adaptive_percentile = adaptive_percentile
+        self.adaptive_multiplier = adaptive_multiplier
+        self.adaptive_min = adaptive_min
+        self.ssl_context = ssl_context
+        if ssl and ssl_context is None:
+            self.ssl_context = get_ssl_context()
+        self.tls_handshakes = 0
+        self.pool_size = pool_size
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._pool_pid = os.getpid()
+        self.capabilities = None
+        self.capabilities_ttl = capabilities_ttl
+        self.capabilities_checked = None
+        self._probe_interval = 0
+        self._probe_lock = threading.Lock()
+        self.wire_codec = wire_codec or codec.get_codec(codec.JSON)
+        # the codec to return to once the server accepts it again
+        self.preferred_codec = self.wire_codec
+        self.recorder = recorder
         self.name = name
         self.success_codes = SUCCESS_CODES
         self.auth = None
@@ -97,84 +457,381 @@ class ServerProxy(object):
         if auth:
             self.auth = 'Basic ' + base64.encodestring(auth).strip()
 
-    def rest_call(self, action, resource, data, headers):
+    def read_timeout(self, action, resource):
+        """Return the read timeout to use for action on resource.
+
+        With a latency tracker the timeout follows the observed latency
+        percentile of the operation kind, bounded by adaptive_min and
+        timeout.
+        """
+        if self.latencies is None:
+            return self.timeout
+        observed = self.latencies.percentile(
+            operation_kind(action, resource), self.adaptive_percentile)
+        if observed is None:
+            return self.timeout
+        return min(self.timeout,
+                   max(self.adaptive_min,
+                       observed * self.adaptive_multiplier))
+
+    def _new_connection(self, timeout):
+        if self.ssl:
+            conn = TLSConnection(self.server, self.port, self.ssl_context,
+                                 timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(self.server, self.port,
+                                          timeout=timeout)
+        conn.connect()
+        # requests are small, don't let Nagle delay reused connections
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ssl:
+            with self._pool_lock:
+                self.tls_handshakes += 1
+        return conn
+
+    def _get_connection(self, timeout):
+        """Return (connection, reused), preferring an idle connection."""
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                # forked, the parent keeps using these connections
+                self._idle = []
+                self._pool_pid = os.getpid()
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(timeout), False
+
+    def _put_connection(self, conn):
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def prewarm(self, connections):
+        """Open up to connections idle connections ahead of first use.
+
+        The first one carries a capability handshake. Returns the number
+        of idle connections.
+        """
+        if not self.refresh_capabilities(force=True):
+            LOG.warning(_("ServerProxy: unable to prewarm connections to "
+                          "%(server)s:%(port)d"),
+                        {'server': self.server, 'port': self.port})
+            return 0
+        with self._pool_lock:
+            missing = min(connections, self.pool_size) - len(self._idle)
+        conns = []
+        try:
+            for i in range(missing):
+                conns.append(self._new_connection(self.connect_timeout))
+        except (socket.error, httplib.HTTPException) as e:
+            LOG.warning(_("ServerProxy: prewarming %(server)s:%(port)d "
+                          "stopped, %(e)r"),
+                        {'server': self.server, 'port': self.port, 'e': e})
+        for conn in conns:
+            self._put_connection(conn)
+        with self._pool_lock:
+            return len(self._idle)
+
+    def refresh_capabilities(self, deadline=None, force=False):
+        """Probe the server if forced or its capabilities expired.
+
+        Returns False if the server could not be reached to probe it.
+        """
+        with self._probe_lock:
+            checked = self.capabilities_checked
+            if (force or checked is None or
+                    (self._probe_interval and
+                     time.time() - checked >= self._probe_interval)):
+                return self.probe(deadline)
+        return True
+
+    def probe(self, deadline=None):
+        """Fetch the capabilities of the server and adapt to them.
+
+        Servers without the capabilities resource get an empty profile,
+        with every optional request form disabled. A profile that lists
+        no codecs is taken for a server that only speaks JSON. Returns
+        False if the server could not be reached, the previous profile
+        is kept then.
+        """
+        ret = self.rest_call('GET', CAPABILITIES_PATH, '', None, deadline)
+        self.capabilities_checked = time.time()
+        if ret[0] in self.success_codes and isinstance(ret[3], dict):
+            self.capabilities = ret[3]
+        elif ret[0] == 404:
+            self.capabilities = {}
+        else:
+            # not answered, try again soon rather than once the ttl expired
+            self._probe_interval = min(self.capabilities_ttl or
+                                       PROBE_RETRY_INTERVAL,
+                                       PROBE_RETRY_INTERVAL)
+            return bool(ret[0])
+        self._probe_interval = self.capabilities_ttl
+        LOG.debug(_("ServerProxy: %(server)s:%(port)d version %(version)s, "
+                    "capabilities %(caps)s"),
+                  {'server': self.server, 'port': self.port,
+                   'version': self.capabilities.get('version'),
+                   'caps': self.capabilities})
+        codecs = self.capabilities.get('codecs', [codec.JSON])
+        if self.preferred_codec.name in codecs:
+            self.wire_codec = self.preferred_codec
+        elif self.wire_codec.name not in codecs:
+            self._fall_back_to_json()
+        return True
+
+    def _fall_back_to_json(self):
+        LOG.warning(_("ServerProxy: %(server)s:%(port)d does not accept "
+                      "%(codec)s, sending json"),
+                    {'server': self.server, 'port': self.port,
+                     'codec': self.wire_codec.name})
+        self.wire_codec = codec.get_codec(codec.JSON)
+
+    def close(self):
+        """Close all idle connections to this server."""
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _send(self, conn, read_timeout, action, uri, body, headers):
+        conn.sock.settimeout(read_timeout)
+        conn.request(action, uri, body, headers)
+        return conn.getresponse()
+
+    def rest_call(self, action, resource, data, headers, deadline=None,
+                  read_timeout=None, timings=None):
+        """Send one request, read_timeout overrides the adaptive one.
+
+        timings, when given, is filled with the phase durations (connect,
+        response, read), stale connection retries and payload bytes.
+        """
+        if timings is None:
+            timings = {}
+        connect_timeout = self.connect_timeout
+        track_latency = read_timeout is None and self.latencies is not None
+        if read_timeout is None:
+            read_timeout = self.read_timeout(action, resource)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                LOG.error(_('ServerProxy: %(action)s %(resource)s not sent, '
+                            'call deadline exceeded'),
+                          {'action': action, 'resource': resource})
+                return 0, None, None, None
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+
         uri = self.base_uri + resource
-        body = json.dumps(data)
+        wire_codec = self.wire_codec
+        body = wire_codec.encode(data)
         if not headers:
             headers = {}
-        headers['Content-type'] = 'application/json'
-        headers['Accept'] = 'application/json'
+        headers['Content-type'] = wire_codec.content_type
+        headers['Accept'] = wire_codec.accept
         headers['NeutronProxy-Agent'] = self.name
         headers['Instance-ID'] = self.neutron_id
         headers['Orchestration-Service-ID'] = ORCHESTRATION_SERVICE_ID
+        request_id = tracing.current_request_id()
+        if request_id:
+            headers[tracing.REQUEST_ID_HEADER] = request_id
         if self.auth:
             headers['Authorization'] = self.auth
 
         LOG.debug(_("ServerProxy: server=%(server)s, port=%(port)d, "
-                    "ssl=%(ssl)r, action=%(action)s"),
+                    "ssl=%(ssl)r, action=%(action)s, "
+                    "timeouts=%(connect).1f/%(read).1f"),
                   {'server': self.server, 'port': self.port, 'ssl': self.ssl,
-                   'action': action})
+                   'action': action, 'connect': connect_timeout,
+                   'read': read_timeout})
         LOG.debug(_("ServerProxy: resource=%(resource)s, data=%(data)r, "
                     "headers=%(headers)r"),
                   {'resource': resource, 'data': data, 'headers': headers})
 
         conn = None
-        if self.ssl:
-            conn = httplib.HTTPSConnection(
-                self.server, self.port, timeout=self.timeout)
-            if conn is None:
-                LOG.error(_('ServerProxy: Could not establish HTTPS '
-                            'connection'))
-                return 0, None, None, None
-        else:
-            conn = httplib.HTTPConnection(
-                self.server, self.port, timeout=self.timeout)
-            if conn is None:
-                LOG.error(_('ServerProxy: Could not establish HTTP '
-                            'connection'))
-                return 0, None, None, None
-
+        call_start = time.time()
+        timings['payload_bytes'] = len(body)
         try:
-            conn.request(action, uri, body, headers)
-            response = conn.getresponse()
+            conn, reused = self._get_connection(connect_timeout)
+            start = time.time()
+            timings['connect'] = start - call_start
+            try:
+                response = self._send(conn, read_timeout, action, uri, body,
+                                      headers)
+            except (socket.error, httplib.HTTPException) as e:
+                if not reused or not _dropped_before_response(e):
+                    raise
+                # the controller dropped an idle keep-alive connection
+                timings['stale_retries'] = 1
+                conn.close()
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise
+                    connect_timeout = min(connect_timeout, remaining)
+                    read_timeout = min(read_timeout, remaining)
+                conn = self._new_connection(connect_timeout)
+                start = time.time()
+                response = self._send(conn, read_timeout, action, uri, body,
+                                      headers)
+            read_start = time.time()
+            timings['response'] = read_start - start
             respstr = response.read()
+            timings['read'] = time.time() - read_start
+            if track_latency:
+                self.latencies.record(operation_kind(action, resource),
+                                      time.time() - start)
             respdata = respstr
             if response.status in self.success_codes:
+                reply_codec = codec.for_content_type(
+                    response.getheader('content-type'))
                 try:
-                    respdata = json.loads(respstr)
+                    respdata = reply_codec.decode(respstr)
                 except ValueError:
-                    # response was not JSON, ignore the exception
+                    # response was not a document, ignore the exception
                     pass
             ret = (response.status, response.reason, respstr, respdata)
-        except (socket.timeout, socket.error) as e:
+            if response.will_close:
+                conn.close()
+            else:
+                self._put_connection(conn)
+        except (socket.timeout, socket.error, httplib.HTTPException) as e:
             LOG.error(_('ServerProxy: %(action)s failure, %(e)r'),
                       {'action': action, 'e': e})
             ret = 0, None, None, None
-        conn.close()
+            if (track_latency and conn is not None and
+                    isinstance(e, socket.timeout)):
+                # count timeouts, or a timeout too short is never raised
+                self.latencies.record(operation_kind(action, resource),
+                                      read_timeout)
+            if conn is not None:
+                conn.close()
+            else:
+                # the connection could not be established
+                timings['connect'] = time.time() - call_start
+        elapsed = time.time() - call_start
+        if self.recorder is not None:
+            self.recorder.record(call_start, elapsed, action, resource,
+                                 len(body), ret[0],
+                                 '%s:%s' % (self.server, self.port))
+        tracing.add_span('http', call_start, elapsed, method=action,
+                         resource=resource, status=ret[0],
+                         server='%s:%s' % (self.server, self.port))
         LOG.debug(_("ServerProxy: status=%(status)d, reason=%(reason)r, "
                     "ret=%(ret)s, data=%(data)r"), {'status': ret[0],
                                                     'reason': ret[1],
                                                     'ret': ret[2],
                                                     'data': ret[3]})
+        if (ret[0] == UNSUPPORTED_MEDIA_TYPE and
+                wire_codec.name != codec.JSON):
+            self._fall_back_to_json()
+            return self.rest_call(action, resource, data, headers, deadline,
+                                  read_timeout, timings)
         return ret
 
 
 class SdnClient(object):
     def __init__(self, server, port, ssl=None, auth=None, neutron_id=None,
                  timeout=10, base_uri='/networkService/v1.1',
-                 name='NeutronRestProxy'):
+                 name='NeutronRestProxy', single_flight=True,
+                 connect_timeout=None, adaptive_timeouts=False,
+                 adaptive_percentile=99, adaptive_multiplier=3.0,
+                 adaptive_min=1.0, ssl_ca_file=None, ssl_cert_file=None,
+                 ssl_key_file=None, ssl_verify=True, pool_size=0,
+                 record_file=None, record_max_bytes=10 * 1024 * 1024,
+                 record_backups=5, slow_call_log_size=0,
+                 slow_call_threshold=0.0, generations=False,
+                 wire_codec=codec.JSON, capabilities_ttl=None,
+                 dispatcher=None):
         self.base_uri = base_uri
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.latencies = None
+        if adaptive_timeouts:
+            # shared by all servers, latency is a property of the operation
+            self.latencies = LatencyTracker()
+        self.adaptive_percentile = adaptive_percentile
+        self.adaptive_multiplier = adaptive_multiplier
+        self.adaptive_min = adaptive_min
         self.name = name
         self.auth = auth
         self.ssl = ssl
+        self.ssl_context = None
+        if ssl:
+            self.ssl_context = get_ssl_context(ssl_ca_file, ssl_cert_file,
+                                               ssl_key_file, ssl_verify)
+        self.pool_size = pool_size
+        self.recorder = None
+        if record_file:
+            self.recorder = recorder.TrafficRecorder(
+                record_file, record_max_bytes, record_backups)
         self.neutron_id = neutron_id
+        self.slow_calls = None
+        if slow_call_log_size:
+            self.slow_calls = SlowCallLog(slow_call_log_size,
+                                          slow_call_threshold)
+        self.wire_codec = wire_codec
+        # None only takes the capabilities reported on prewarm
+        self.capabilities_ttl = capabilities_ttl
+        self.generations = None
+        if generations:
+            self.generations = GenerationClock()
+        self.resource_locks = ResourceLocks()
+        self.single_flight = None
+        if single_flight:
+            self.single_flight = singleflight.SingleFlight()
+        # admits requests that made it through single-flight, see
+        # dispatcher
+        self.dispatcher = dispatcher
         self.servers = []
-        self.servers.append(self.server_proxy_for(server, port))
+        if server is not None:
+            self.servers.append(self.server_proxy_for(server, port))
 
     def server_proxy_for(self, server, port):
         return ServerProxy(server, port, self.ssl, self.auth, self.neutron_id,
-                           self.timeout, self.base_uri, self.name)
+                           self.timeout, self.base_uri, self.name,
+                           connect_timeout=self.connect_timeout,
+                           latencies=self.latencies,
+                           adaptive_percentile=self.adaptive_percentile,
+                           adaptive_multiplier=self.adaptive_multiplier,
+                           adaptive_min=self.adaptive_min,
+                           ssl_context=self.ssl_context,
+                           pool_size=self.pool_size,
+                           recorder=self.recorder,
+                           wire_codec=codec.get_codec(self.wire_codec),
+                           capabilities_ttl=self.capabilities_ttl or 0)
+
+    def servers_for(self, resource):
+        """Return the servers able to serve resource."""
+        return self.servers
+
+    def prewarm(self, connections):
+        """Prewarm connections to every server, see ServerProxy.prewarm."""
+        for server in self.servers:
+            idle = server.prewarm(connections)
+            LOG.info(_("ServerProxy: %(idle)d connections to %(server)s:"
+                       "%(port)d ready, capabilities %(caps)s"),
+                     {'idle': idle, 'server': server.server,
+                      'port': server.port, 'caps': server.capabilities})
+
+    def supports(self, capability, resource=''):
+        """True if every server of resource reported having capability.
+
+        Servers that did not report their capabilities, never probed or
+        not reachable so far, are taken as lacking it: callers fall back
+        to the request form every controller accepts.
+        """
+        servers = self.servers_for(resource)
+        if self.capabilities_ttl is not None:
+            for server in servers:
+                server.refresh_capabilities(current_deadline())
+        return all(server.capabilities is not None and
+                   bool(server.capabilities.get(capability))
+                   for server in servers)
+
+    def feed_groups(self):
+        """Return {name: servers} of the servers sharing a change feed."""
+        return {'default': self.servers}
 
     def server_failure(self, resp, ignore_codes=[]):
         """Define failure codes as required.
@@ -191,11 +848,42 @@ class SdnClient(object):
         """
         return resp[0] in SUCCESS_CODES
 
-    @utils.synchronized('bsn-rest-call', external=True)
-    def rest_call(self, action, resource, data, headers, ignore_codes):
-        good_first = sorted(self.servers, key=lambda x: x.failed)
-        for active_server in good_first:
-            ret = active_server.rest_call(action, resource, data, headers)
+    def rest_call(self, action, resource, data, headers, ignore_codes,
+                  attempts=None):
+        """Call the servers of resource in turn until one succeeds.
+
+        attempts, when given, receives a (server, status, timings) entry
+        per server tried. Calls for the same resource are sent one at a
+        time, in the order they got here, calls for other resources go
+        out concurrently.
+        """
+        with self.resource_locks.hold(resource):
+            return self._rest_call(action, resource, data, headers,
+                                   ignore_codes, attempts)
+
+    def _rest_call(self, action, resource, data, headers, ignore_codes,
+                   attempts):
+        if attempts is None:
+            attempts = []
+        deadline = current_deadline()
+        servers = self.servers_for(resource)
+        good_first = sorted(servers, key=lambda x: x.failed)
+        for index, active_server in enumerate(good_first):
+            if deadline is not None and time.time() >= deadline:
+                LOG.error(_('ServerProxy: %(action)s deadline exceeded, '
+                            'not failing over to remaining servers'),
+                          {'action': action})
+                break
+            timings = {'entered': time.time()}
+            if self._reachable(active_server, index > 0, deadline):
+                ret = active_server.rest_call(action, resource, data,
+                                              headers, deadline,
+                                              timings=timings)
+            else:
+                ret = (0, None, None, None)
+            attempts.append(('%s:%s' % (active_server.server,
+                                        active_server.port),
+                             ret[0], timings))
             if not self.server_failure(ret, ignore_codes):
                 active_server.failed = False
                 return ret
@@ -216,9 +904,20 @@ class SdnClient(object):
         LOG.error(_('ServerProxy: %(action)s failure for all servers: '
                     '%(server)r'),
                   {'action': action,
-                   'server': tuple((s.server, s.port) for s in self.servers)})
+                   'server': tuple((s.server, s.port) for s in servers)})
         return (0, None, None, None)
 
+    def _reachable(self, server, failover, deadline):
+        """Probe server if due, False if the probe could not reach it.
+
+        With capabilities_ttl set, a server is probed before its first
+        request, once its capabilities expired and on failing over to
+        it, as it may run another controller version.
+        """
+        if self.capabilities_ttl is None:
+            return True
+        return server.refresh_capabilities(deadline, force=failover)
+
     def rest_action(self, action, resource, data='', errstr='%s',
                     ignore_codes=[], headers=None):
         """
@@ -226,14 +925,43 @@ class SdnClient(object):
         RemoteRestError on failure with a provided error string
         By default, 404 errors on DELETE calls are ignored because
         they already do not exist on the backend.
+        Concurrent calls for the same action and resource are coalesced,
+        see SINGLE_FLIGHT_MODES. A request that is sent then waits for a
+        slot of the dispatcher of the client, if any.
         """
         if not ignore_codes and action == 'DELETE':
             ignore_codes = [404]
-        resp = self.rest_call(action, resource, data, headers, ignore_codes)
+        if self.generations is not None:
+            data, headers = self._stamp_generation(action, data, headers)
+        start = time.time()
+        attempts = []
+        # includes the resource lock wait and coalescing, unlike 'http'
+        with tracing.span('rest_action', method=action, resource=resource):
+            if self.single_flight:
+                mode = SINGLE_FLIGHT_MODES.get(action,
+                                               singleflight.MODE_SERIAL)
+                # headers travel with the data, merged callers replace both
+                resp = self.single_flight.call(
+                    (action, resource),
+                    lambda request: self._admitted_call(
+                        action, resource, request[0], request[1],
+                        ignore_codes, attempts),
+                    (data, headers), mode,
+                    _newest_request if self.generations else None)
+            else:
+                resp = self._admitted_call(action, resource, data, headers,
+                                           ignore_codes, attempts)
+        if self.slow_calls is not None:
+            self._record_slow_call(start, action, resource, resp, attempts)
         if self.server_failure(resp, ignore_codes):
             LOG.error(_("NeutronRestProxyV2: ") + errstr, resp[2])
-            raise RemoteRestError(resp[2])
-        if resp[0] in ignore_codes:
+            raise RemoteRestError(resp[2], resp[0])
+        if resp[0] == STALE_GENERATION and self.generations is not None:
+            # a newer write of the resource got there first
+            LOG.info(_("NeutronRestProxyV2: %(action)s of %(resource)s "
+                       "superseded by a newer write"),
+                     {'action': action, 'resource': resource})
+        elif resp[0] in ignore_codes:
             LOG.warning(_("NeutronRestProxyV2: Received and ignored error "
                           "code %(code)s on %(action)s action to resource "
                           "%(resource)s"),
@@ -241,17 +969,164 @@ class SdnClient(object):
                          'resource': resource})
         return resp
 
+    def _admitted_call(self, *args):
+        if self.dispatcher is None:
+            return self.rest_call(*args)
+        return self.dispatcher.admit(self.rest_call, *args)
+
+    def read_generation(self):
+        """Return the generation of a document about to be read, or None.
+
+        Taken before the Neutron state a document is built from is read,
+        and carried in the document with with_generation, so that a
+        document built from newer state has a higher generation in
+        whatever order the documents are sent.
+        """
+        if self.generations is None:
+            return None
+        return self.generations.next()
+
+    def _stamp_generation(self, action, data, headers):
+        """Return data and headers carrying a write generation.
+
+        Resource documents that carry no generation from their read are
+        copied, as callers may keep them, and given a new one.
+        """
+        if action == 'DELETE':
+            headers = dict(headers or {})
+            headers[GENERATION_HEADER] = str(self.generations.next())
+        elif action in ('POST', 'PUT', 'PATCH') and isinstance(data, dict):
+            generation = self.generations.next()
+
+            def stamp(doc):
+                if isinstance(doc, dict) and GENERATION_KEY not in doc:
+                    return with_generation(doc, generation)
+                return doc
+            stamped = {}
+            for kind, doc in data.items():
+                if isinstance(doc, list):
+                    doc = [stamp(d) for d in doc]
+                stamped[kind] = stamp(doc)
+            data = stamped
+        return data, headers
+
+    def rest_get_changes(self, servers, cursor, wait):
+        """Long poll the change feed of servers for changes after cursor.
+
+        Returns the feed reply, {'cursor': ..., 'changes': [...]} with
+        'reset' set when cursor is too old to resume from. Polls may be
+        outstanding for wait seconds, so they go to the servers directly
+        rather than through rest_call and its resource locks.
+        """
+        params = {'wait': wait}
+        if cursor is not None:
+            params['cursor'] = cursor
+        resource = '%s?%s' % (CHANGES_PATH, urllib.urlencode(params))
+        for server in sorted(servers, key=lambda x: x.failed):
+            ret = server.rest_call('GET', resource, '', None,
+                                   read_timeout=wait + self.timeout)
+            if self.action_success(ret) and isinstance(ret[3], dict):
+                server.failed = False
+                return ret[3]
+            LOG.warning(_("ServerProxy: change feed of %(server)r failed, "
+                          "status=%(status)d"),
+                        {'server': (server.server, server.port),
+                         'status': ret[0]})
+            server.failed = True
+        raise RemoteRestError(_("Unable to poll the change feed"))
+
+    def _record_slow_call(self, start, action, resource, resp, attempts):
+        duration = time.time() - start
+        if duration < self.slow_calls.threshold:
+            return
+        phases = {}
+        if attempts:
+            # time to get past the resource lock, or a coalesced call
+            phases['lock_wait'] = attempts[0][2]['entered'] - start
+        else:
+            phases['coalesced'] = duration
+        retries = max(0, len(attempts) - 1)
+        for server, status, timings in attempts:
+            retries += timings.get('stale_retries', 0)
+            for phase in ('connect', 'response', 'read'):
+                if phase in timings:
+                    phases[phase] = phases.get(phase, 0) + timings[phase]
+        self.slow_calls.record(SlowCall(
+            start, duration, action, resource,
+            attempts[-1][2].get('payload_bytes', 0) if attempts else 0,
+            attempts[-1][0] if attempts else None, resp[0], retries,
+            phases, tracing.current_request_id()))
+
     def rest_create_network(self, tenant_id, network):
         resource = NET_RESOURCE_PATH % tenant_id
         data = {"network": network}
         errstr = _("Unable to create remote network: %s")
-        self.rest_action('POST', resource, data, errstr)
+        return self.rest_action('POST', resource, data, errstr)
 
-    def rest_update_network(self, tenant_id, net_id, network):
+    def rest_update_network(self, tenant_id, net_id, network,
+                            ignore_codes=[]):
         resource = NETWORKS_PATH % (tenant_id, net_id)
         data = {"network": network}
         errstr = _("Unable to update remote network: %s")
-        self.rest_action('PUT', resource, data, errstr)
+        return self.rest_action('PUT', resource, data, errstr, ignore_codes)
+
+    def rest_create_networks(self, tenant_id, networks):
+        """Create several networks, in one request where supported.
+
+        Returns {network id: error or None}, a network the controller
+        rejected does not fail the others.
+        """
+        resource = NET_RESOURCE_PATH % tenant_id
+        if not self.supports(BULK_CAPABILITY, resource):
+            return self._each(
+                lambda network: self.rest_create_network(tenant_id, network),
+                networks)
+        data = {"networks": networks}
+        errstr = _("Unable to create remote networks: %s")
+        resp = self.rest_action('POST', resource, data, errstr)
+        return self._bulk_results(resp, 'networks', networks)
+
+    def rest_update_networks(self, tenant_id, networks):
+        """Update several networks, in one request where supported.
+
+        Returns {network id: error or None} like rest_create_networks.
+        """
+        resource = NET_RESOURCE_PATH % tenant_id
+        if not self.supports(BULK_CAPABILITY, resource):
+            return self._each(
+                lambda network: self.rest_update_network(
+                    tenant_id, network['id'], network),
+                networks)
+        data = {"networks": networks}
+        errstr = _("Unable to update remote networks: %s")
+        resp = self.rest_action('PATCH', resource, data, errstr)
+        return self._bulk_results(resp, 'networks', networks)
+
+    @staticmethod
+    def _each(func, docs):
+        results = {}
+        for doc in docs:
+            try:
+                func(doc)
+                results[doc['id']] = None
+            except RemoteRestError as e:
+                results[doc['id']] = e
+        return results
+
+    def _bulk_results(self, resp, kind, docs):
+        """Return {id: error or None} of the per item results of resp."""
+        results = dict((doc['id'], None) for doc in docs)
+        reply = resp[3]
+        if not isinstance(reply, dict):
+            return results
+        for item in reply.get(kind) or ():
+            status = item.get('status')
+            if (item.get('id') in results and status is not None and
+                    status not in SUCCESS_CODES and
+                    not (status == STALE_GENERATION and
+                         self.generations is not None)):
+                results[item['id']] = item.get('error') or status
+        return results
 
     def rest_delete_network(self, tenant_id, net_id):
         resource = NETWORKS_PATH % (tenant_id, net_id)
@@ -275,6 +1150,70 @@ class SdnClient(object):
         errstr = _("Unable to delete remote port: %s")
         self.rest_action('DELETE', resource, errstr)
 
+    def rest_create_router(self, tenant_id, router):
+        resource = ROUTER_RESOURCE_PATH % tenant_id
+        data = {"router": router}
+        errstr = _("Unable to create remote router: %s")
+        self.rest_action('POST', resource, data, errstr)
+
+    def rest_update_router(self, tenant_id, router, router_id):
+        resource = ROUTERS_PATH % (tenant_id, router_id)
+        data = {"router": router}
+        errstr = _("Unable to update remote router: %s")
+        self.rest_action('PUT', resource, data, errstr)
+
+    def rest_delete_router(self, tenant_id, router_id):
+        resource = ROUTERS_PATH % (tenant_id, router_id)
+        errstr = _("Unable to delete remote router: %s")
+        self.rest_action('DELETE', resource, errstr=errstr)
+
+    def rest_add_router_interface(self, tenant_id, router_id, intf_details):
+        resource = ROUTER_INTF_OP_PATH % (tenant_id, router_id)
+        data = {"interface": intf_details}
+        errstr = _("Unable to add router interface: %s")
+        self.rest_action('POST', resource, data, errstr)
+
+    def rest_add_router_interfaces(self, tenant_id, router_id, interfaces):
+        """Add several interfaces to a router, batched if supported."""
+        resource = ROUTER_INTF_OP_PATH % (tenant_id, router_id)
+        if not self.supports(BULK_CAPABILITY, resource):
+            for interface in interfaces:
+                self.rest_add_router_interface(tenant_id, router_id,
+                                               interface)
+            return
+        data = {"interfaces": interfaces}
+        errstr = _("Unable to add router interfaces: %s")
+        self.rest_action('POST', resource, data, errstr)
+
+    def rest_remove_router_interface(self, tenant_id, router_id,
+                                     interface_id):
+        resource = ROUTER_INTF_PATH % (tenant_id, router_id, interface_id)
+        errstr = _("Unable to delete remote intf: %s")
+        self.rest_action('DELETE', resource, errstr=errstr)
+
+    def rest_update_floatingip(self, tenant_id, net_id, floatingip):
+        """Create or replace floatingip on external network net_id."""
+        resource = FLOATINGIP_PATH % (tenant_id, net_id, floatingip['id'])
+        data = {"floatingip": floatingip}
+        errstr = _("Unable to update remote floating IP: %s")
+        self.rest_action('PUT', resource, data, errstr)
+
+    def rest_update_floatingips(self, tenant_id, net_id, floatingips):
+        """Create or replace several floating IPs, batched if supported."""
+        resource = FLOATINGIPS_PATH % (tenant_id, net_id)
+        if not self.supports(BULK_CAPABILITY, resource):
+            for floatingip in floatingips:
+                self.rest_update_floatingip(tenant_id, net_id, floatingip)
+            return
+        data = {"floatingips": floatingips}
+        errstr = _("Unable to update remote floating IPs: %s")
+        self.rest_action('POST', resource, data, errstr)
+
+    def rest_delete_floatingip(self, tenant_id, net_id, floatingip_id):
+        resource = FLOATINGIP_PATH % (tenant_id, net_id, floatingip_id)
+        errstr = _("Unable to delete remote floating IP: %s")
+        self.rest_action('DELETE', resource, errstr=errstr)
+
     def rest_plug_interface(self, tenant_id, net_id, port,
                             remote_interface_id):
         if port["mac_address"] is not None:
@@ -0,0 +1,112 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Wire encodings of controller requests and replies.
+
+JSON is what every controller speaks. MessagePack is a compact binary
+encoding of the same documents, cheaper to encode and decode, used when
+the msgpack package is installed and the controller accepts it. Requests
+are sent in the encoding of the codec of their server, which Accepts
+both, and replies are decoded according to their Content-Type.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+# msgpack before 0.5.2 decodes strings with encoding rather than raw
+if msgpack is not None and msgpack.version < (0, 5, 2):
+    _UNPACK_ARGS = {'encoding': 'utf-8'}
+else:
+    _UNPACK_ARGS = {'raw': False}
+
+
+class JsonCodec(object):
+    name = JSON
+    content_type = 'application/json'
+    accept = 'application/json'
+
+    def encode(self, data):
+        return json.dumps(data)
+
+    def decode(self, body):
+        return json.loads(body)
+
+
+class MsgpackCodec(object):
+    name = MSGPACK
+    content_type = 'application/x-msgpack'
+    accept = 'application/x-msgpack, application/json;q=0.5'
+
+    def encode(self, data):
+        # strings are str under Python 2, which the bin type would send
+        # as bytes; documents hold no binary data, so all are raw strings
+        return msgpack.packb(data, use_bin_type=False)
+
+    def decode(self, body):
+        """Return the document of body, ValueError if it is malformed."""
+        if not body:
+            raise ValueError(_("Empty msgpack body"))
+        try:
+            return msgpack.unpackb(body, **_UNPACK_ARGS)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(str(e))
+
+
+# codecs are stateless, these instances are shared
+CODECS = {JSON: JsonCodec(), MSGPACK: MsgpackCodec()}
+
+
+def available():
+    """Return the names of the codecs usable in this process."""
+    return [name for name in sorted(CODECS)
+            if name != MSGPACK or msgpack is not None]
+
+
+def get_codec(name=JSON):
+    """Return a codec of name, the JSON codec if it is not usable."""
+    if name not in CODECS:
+        raise ValueError(_("Unknown wire codec %s") % name)
+    if name not in available():
+        LOG.warning(_("Wire codec %s is not available, using json"), name)
+        name = JSON
+    return CODECS[name]
+
+
+def for_content_type(content_type):
+    """Return the codec of content_type.
+
+    Replies without a Content-Type, or with one no codec decodes, are
+    taken for JSON as before encodings were negotiated.
+    """
+    if content_type:
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        for name in available():
+            if CODECS[name].content_type == media_type:
+                return CODECS[name]
+    return CODECS[JSON]
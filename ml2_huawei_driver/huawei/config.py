@@ -55,7 +55,130 @@ Huawei_DRIVER_OPTS = [
                help=_('Sync interval in seconds between Neutron plugin and'
                       'sdn controller. This interval defines how often the'
                       'synchronization is performed. This is an optional'
-                      'field. If not set, a value of 180 seconds is assumed'))
+                      'field. If not set, a value of 180 seconds is assumed')),
+    cfg.StrOpt('sync_checkpoint_file',
+               default=None,
+               help=_('Local file where the sync state (a fingerprint per '
+                      'network and the last sync time) is checkpointed, so '
+                      'that the first sync after a restart only pushes the '
+                      'networks that changed. Not set disables it.')),
+    cfg.IntOpt('sync_checkpoint_interval',
+               default=300,
+               help=_('Minimum seconds between two checkpoint writes. The '
+                      'checkpoint is also written on shutdown.')),
+    cfg.IntOpt('sync_workers',
+               default=0,
+               help=_('Threads reading and diffing tenants in parallel '
+                      'during sync. 0 syncs in the sync thread, one network '
+                      'at a time, holding off API operations meanwhile.')),
+    cfg.IntOpt('sync_max_inflight',
+               default=8,
+               help=_('Maximum controller requests in flight for a sync '
+                      'with sync_workers. They also count against '
+                      'dispatch_concurrency.')),
+    cfg.BoolOpt('changefeed',
+                default=False,
+                help=_('Follow the change feed of the sdn controller and '
+                       'reconcile only the resources it reports, instead '
+                       'of the periodic full sync. The periodic sync is '
+                       'resumed while the feed is lost. Requires '
+                       'RESTCLIENT sync_data.')),
+    cfg.IntOpt('changefeed_wait',
+               default=30,
+               help=_('Seconds a change feed poll is held open by the '
+                      'controller when there is nothing to report.')),
+    cfg.IntOpt('changefeed_failure_limit',
+               default=3,
+               help=_('Consecutive failed polls after which the change '
+                      'feed is considered lost.')),
+    cfg.IntOpt('dispatch_concurrency',
+               default=1,
+               help=_('Maximum number of calls issued to the sdn controller '
+                      'at the same time, by the mechanism driver and by the '
+                      'L3 router plugin each. Calls beyond this limit are '
+                      'queued and admitted by priority.')),
+    cfg.FloatOpt('dispatch_aging_interval',
+                 default=2.0,
+                 help=_('Seconds a queued controller call waits before it is '
+                        'promoted by one priority class. Protects background '
+                        'work from starvation. 0 disables promotion.')),
+    cfg.IntOpt('call_deadline',
+               default=30,
+               help=_('Overall time budget in seconds for the controller '
+                      'calls made by one Neutron API operation, including '
+                      'queueing and failover. 0 disables the deadline.')),
+    cfg.IntOpt('trace_buffer_size',
+               default=0,
+               help=_('Number of recent operation traces (lock, dispatch, '
+                      'database and HTTP spans) kept in memory for '
+                      'inspection. 0 disables tracing, the request ID is '
+                      'still sent to the controller as X-Request-ID.')),
+    cfg.FloatOpt('profile_threshold',
+                 default=0,
+                 help=_('Seconds after which the stack of a running driver '
+                        'operation is sampled, to profile slow operations. '
+                        '0 disables the profiler.')),
+    cfg.FloatOpt('profile_interval',
+                 default=0.01,
+                 help=_('Seconds between two stack samples of a slow '
+                        'operation.')),
+    cfg.StrOpt('diagnostics_signal',
+               default=None,
+               help=_('Name of a signal, e.g. SIGUSR2, on which the slow '
+                      'call log and the slow operation profiles are '
+                      'logged.')),
+    cfg.FloatOpt('router_batch_window',
+                 default=0,
+                 help=_('Seconds during which interfaces added to the same '
+                        'router are collected into one controller request. '
+                        'With 0 an interface is sent right away, interfaces '
+                        'added while an earlier request of the router is in '
+                        'flight are still sent together.')),
+    cfg.IntOpt('router_batch_size',
+               default=100,
+               help=_('Maximum number of router interfaces sent in one '
+                      'controller request.')),
+    cfg.FloatOpt('create_batch_window',
+                 default=0,
+                 help=_('Seconds during which the networks, or subnets, '
+                        'created in the same tenant are collected into one '
+                        'controller request. ML2 runs the postcommit of '
+                        'every network of a bulk create before creating the '
+                        'next one, so only networks of concurrent requests '
+                        'are collected. With 0 a network is sent right away, '
+                        'networks created while an earlier request of the '
+                        'tenant is in flight are still sent together.')),
+    cfg.IntOpt('create_batch_size',
+               default=100,
+               help=_('Maximum number of networks, or subnets, created in '
+                      'one controller request.')),
+    cfg.StrOpt('shared_cache_file',
+               default=None,
+               help=_('File memory mapped by all neutron-server workers of '
+                      'the host to share their cache of network tenants and '
+                      'external flags, e.g. in /dev/shm. Each worker keeps '
+                      'its own cache if not set or not usable.')),
+    cfg.IntOpt('shared_cache_slots',
+               default=65536,
+               help=_('Number of networks the cache can hold, each slot '
+                      'takes 96 bytes.')),
+    cfg.IntOpt('prewarm_connections',
+               default=2,
+               help=_('Connections opened to each controller when the '
+                      'driver starts, after a capability handshake, so the '
+                      'first requests do not pay for connection setup. '
+                      'Bounded by server_pool_size, 0 disables prewarming.')),
+    cfg.FloatOpt('floatingip_batch_window',
+                 default=0,
+                 help=_('Seconds during which floating IP changes on the '
+                        'same external network are collected into one '
+                        'controller request. With 0 a change is sent right '
+                        'away, changes made while an earlier request of the '
+                        'network is in flight are still sent together.')),
+    cfg.IntOpt('floatingip_batch_size',
+               default=500,
+               help=_('Maximum number of floating IP changes sent in one '
+                      'controller request.'))
 ]
 
 cfg.CONF.register_opts(Huawei_DRIVER_OPTS, "ml2_Huawei")
@@ -0,0 +1,174 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Priority-aware admission of calls to the Huawei sdn controller.
+
+Interactive operations (VM boot port create/plug) are admitted ahead of
+ordinary provisioning, which in turn goes ahead of background work such
+as subnet-driven full network updates and synchronization.
+
+Callers give the controller requests of a block a priority with the
+priority context manager. A client bound to a dispatcher queues each
+request for a slot once single-flight coalescing let it through, so
+callers merged into or joining another request never hold a slot.
+"""
+
+import contextlib
+import itertools
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import tracing
+
+
+LOG = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+_priority_state = threading.local()
+
+
+@contextlib.contextmanager
+def priority(priority):
+    """Send the controller requests of this thread in the block at
+    priority."""
+    previous = getattr(_priority_state, 'priority', None)
+    _priority_state.priority = priority
+    try:
+        yield
+    finally:
+        _priority_state.priority = previous
+
+
+def current_priority():
+    """Return the priority of the current thread, normal by default."""
+    current = getattr(_priority_state, 'priority', None)
+    return PRIORITY_NORMAL if current is None else current
+
+
+class PriorityDispatcher(object):
+    """Admits controller calls highest priority first.
+
+    At most ``concurrency`` calls run at a time, the rest wait in the
+    calling thread. Every ``aging_interval`` seconds spent waiting raises
+    a caller by one priority class, so background work is not starved by
+    a steady stream of interactive calls. An ``aging_interval`` of 0
+    disables aging. A caller waits no longer than its call deadline, see
+    clients.call_deadline, and gets a RemoteRestError once it passed.
+    """
+
+    def __init__(self, concurrency=1, aging_interval=2.0):
+        self.concurrency = max(1, concurrency)
+        self.aging_interval = aging_interval
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._stats = dict((priority, {'depth': 0,
+                                       'max_depth': 0,
+                                       'dispatched': 0,
+                                       'expired': 0,
+                                       'wait_total': 0.0,
+                                       'max_wait': 0.0})
+                           for priority in PRIORITY_NAMES)
+
+    def call(self, priority, func, *args, **kwargs):
+        """Run func(*args, **kwargs) once a slot is granted to priority."""
+        with tracing.span('dispatch_wait', priority=priority):
+            self._acquire(priority)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._release()
+
+    def admit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) as a call of the current priority."""
+        return self.call(current_priority(), func, *args, **kwargs)
+
+    def get_metrics(self):
+        """Return per priority class queue depth and wait statistics."""
+        with self._cond:
+            metrics = {}
+            for priority, stats in self._stats.items():
+                metrics[PRIORITY_NAMES[priority]] = dict(stats)
+            metrics['running'] = self._running
+            return metrics
+
+    def _effective_priority(self, waiter, now):
+        priority, seq, enqueued_at = waiter
+        if self.aging_interval > 0:
+            priority -= int((now - enqueued_at) / self.aging_interval)
+        return priority, seq
+
+    def _next_waiter(self):
+        now = time.time()
+        return min(self._waiters,
+                   key=lambda w: self._effective_priority(w, now))
+
+    def _acquire(self, priority):
+        if priority not in PRIORITY_NAMES:
+            priority = PRIORITY_NORMAL
+        stats = self._stats[priority]
+        deadline = clients.current_deadline()
+        with self._cond:
+            waiter = [priority, next(self._seq), time.time()]
+            self._waiters.append(waiter)
+            stats['depth'] += 1
+            stats['max_depth'] = max(stats['max_depth'], stats['depth'])
+            while (self._running >= self.concurrency or
+                   self._next_waiter() is not waiter):
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    stats['depth'] -= 1
+                    stats['expired'] += 1
+                    # the waiter may have been the next one in line
+                    self._cond.notify_all()
+                    raise clients.RemoteRestError(
+                        _("Call deadline exceeded waiting for a "
+                          "controller slot"))
+                self._cond.wait(remaining)
+            self._waiters.remove(waiter)
+            self._running += 1
+            waited = time.time() - waiter[2]
+            stats['depth'] -= 1
+            stats['dispatched'] += 1
+            stats['wait_total'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+            if self._waiters and self._running < self.concurrency:
+                # another slot is still free, let the next waiter in
+                self._cond.notify_all()
+        if waited > self.aging_interval > 0:
+            LOG.debug(_("PriorityDispatcher: %(cls)s call waited "
+                        "%(waited).3fs for a controller slot"),
+                      {'cls': PRIORITY_NAMES[priority], 'waited': waited})
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
@@ -0,0 +1,370 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""L3 service plugin provisioning routers on the Huawei sdn controller.
+
+Routers are not seen by ML2 mechanism drivers, so they are pushed from
+this service plugin, enabled alongside ML2 by adding HuaweiL3RouterPlugin
+of this module to service_plugins. Its controller calls are admitted by
+a dispatcher of its own, built from the same options as the one of the
+mechanism driver.
+
+Interfaces added to the same router at about the same time, e.g. by a
+tenant template attaching many subnets, are sent to the controller as
+one batched request, see router_batch_window.
+
+Floating IPs are pushed as changes of the single floating IP, never as
+part of the document of their external network. Changes on the same
+external network at about the same time, e.g. an autoscaling group
+associating its instances, are sent as one request, see
+floatingip_batch_window. Deletes go through the same batches, so they
+are never overtaken by an earlier change of the floating IP.
+"""
+
+import collections
+import contextlib
+import threading
+import weakref
+
+from oslo.config import cfg
+from sqlalchemy import event
+
+from neutron.db import l3_db
+from neutron.extensions import l3
+from neutron.openstack.common import excutils
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import batching
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei.clients import RemoteRestError
+from neutron.plugins.ml2.drivers.huawei import dispatcher
+from neutron.plugins.ml2.drivers.huawei import mechanism_huawei as huawei
+from neutron.plugins.ml2.drivers.huawei import tracing
+from neutron.services.l3_router import l3_router_plugin
+
+
+LOG = logging.getLogger(__name__)
+
+
+# {session: functions to call once its transaction commits}
+_pending_commits = weakref.WeakKeyDictionary()
+_pending_lock = threading.Lock()
+
+
+def _after_commit(session, func):
+    """Call func once the transaction of session commits.
+
+    func is called right away when session is not in a transaction, and
+    never when the transaction rolls back. A session gets one listener
+    per event, the first time it is given a func, whatever the number of
+    transactions it runs, so long lived sessions do not pile them up.
+    """
+    if session.transaction is None:
+        func()
+        return
+    with _pending_lock:
+        pending = _pending_commits.get(session)
+        if pending is None:
+            pending = _pending_commits[session] = []
+            listen = True
+        else:
+            listen = False
+        pending.append(func)
+    if listen:
+        event.listen(session, 'after_commit', _committed)
+        event.listen(session, 'after_rollback', _rolled_back)
+
+
+def _take_pending(session):
+    with _pending_lock:
+        pending = _pending_commits.get(session) or []
+        funcs = list(pending)
+        del pending[:]
+    return funcs
+
+
+def _committed(session):
+    for func in _take_pending(session):
+        func()
+
+
+def _rolled_back(session):
+    _take_pending(session)
+
+
+class HuaweiL3RouterPlugin(l3_router_plugin.L3RouterPlugin):
+    """L3 router service plugin for the Huawei sdn controller."""
+
+    def __init__(self):
+        super(HuaweiL3RouterPlugin, self).__init__()
+        confg = cfg.CONF.ml2_Huawei
+        self.call_deadline = confg.call_deadline
+        self.dispatcher = dispatcher.PriorityDispatcher(
+            confg.dispatch_concurrency, confg.dispatch_aging_interval)
+        self.client_sdn = huawei.create_client(confg, cfg.CONF.RESTCLIENT,
+                                               self.dispatcher)
+        self.interface_batches = batching.BatchCollector(
+            confg.router_batch_window, confg.router_batch_size)
+        self.floatingip_batches = batching.BatchCollector(
+            confg.floatingip_batch_window, confg.floatingip_batch_size)
+        # tenants of external networks, which never change
+        self._network_tenants = {}
+
+    def get_plugin_description(self):
+        return _("Huawei sdn controller L3 router service plugin")
+
+    @contextlib.contextmanager
+    def _controller_call(self, name, context):
+        with tracing.trace(name, getattr(context, 'request_id', None)):
+            with clients.call_deadline(self.call_deadline):
+                yield
+
+    @staticmethod
+    def _map_router(router):
+        return huawei.HuaweiDriver._set_state_and_status(dict(router))
+
+    def create_router(self, context, router):
+        new_router = super(HuaweiL3RouterPlugin, self).create_router(
+            context, router)
+        try:
+            with self._controller_call('create_router', context):
+                self.client_sdn.rest_create_router(
+                    new_router['tenant_id'], self._map_router(new_router))
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                super(HuaweiL3RouterPlugin, self).delete_router(
+                    context, new_router['id'])
+        return new_router
+
+    def update_router(self, context, router_id, router):
+        old_router = self.get_router(context, router_id)
+        new_router = super(HuaweiL3RouterPlugin, self).update_router(
+            context, router_id, router)
+        try:
+            with self._controller_call('update_router', context):
+                self.client_sdn.rest_update_router(
+                    new_router['tenant_id'], self._map_router(new_router),
+                    router_id)
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                restore = dict((name, old_router[name])
+                               for name in router['router']
+                               if name in old_router)
+                super(HuaweiL3RouterPlugin, self).update_router(
+                    context, router_id, {'router': restore})
+        return new_router
+
+    def delete_router(self, context, router_id):
+        router = self.get_router(context, router_id)
+        # deleted from the database first, so that no lock is held over
+        # the controller call; put back if the controller fails
+        super(HuaweiL3RouterPlugin, self).delete_router(context, router_id)
+        try:
+            with self._controller_call('delete_router', context):
+                self.client_sdn.rest_delete_router(router['tenant_id'],
+                                                   router_id)
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                self._restore_router(context, router)
+
+    def _restore_router(self, context, router):
+        """Put router back in the database, with its gateway.
+
+        delete_router refuses routers with interfaces, so the gateway is
+        all there is to restore besides the router itself.
+        """
+        try:
+            with context.session.begin(subtransactions=True):
+                context.session.add(l3_db.Router(
+                    id=router['id'], tenant_id=router['tenant_id'],
+                    name=router['name'],
+                    admin_state_up=router['admin_state_up'],
+                    status=router['status']))
+            gw_info = router.get(l3.EXTERNAL_GW_INFO)
+            if gw_info:
+                self._update_router_gw_info(context, router['id'], gw_info)
+        except Exception:
+            LOG.exception(_("Unable to restore router %s after the "
+                            "controller failed to delete it"), router['id'])
+
+    def _router_tenant(self, context, router_id):
+        """Return the tenant of a router, not of its interface subnet."""
+        return self.get_router(context, router_id,
+                               fields=['tenant_id'])['tenant_id']
+
+    def add_router_interface(self, context, router_id, interface_info):
+        tenant_id = self._router_tenant(context, router_id)
+        info = super(HuaweiL3RouterPlugin, self).add_router_interface(
+            context, router_id, interface_info)
+        port = self._core_plugin.get_port(context, info['port_id'])
+        interface = {'id': port['id'],
+                     'subnet_id': info['subnet_id'],
+                     'network_id': port['network_id'],
+                     'mac_address': port['mac_address'],
+                     'ip_address': port['fixed_ips'][0]['ip_address']}
+        try:
+            with self._controller_call('add_router_interface', context):
+                self.interface_batches.add(
+                    (tenant_id, router_id), interface,
+                    self._send_interfaces)
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                # an interface added by port would delete the port on
+                # removal, the port is left attached then
+                if 'port_id' not in interface_info:
+                    super(HuaweiL3RouterPlugin, self).remove_router_interface(
+                        context, router_id,
+                        {'subnet_id': info['subnet_id']})
+        return info
+
+    def _send_interfaces(self, key, interfaces):
+        tenant_id, router_id = key
+        if len(interfaces) == 1:
+            self.client_sdn.rest_add_router_interface(tenant_id, router_id,
+                                                      interfaces[0])
+        else:
+            self.client_sdn.rest_add_router_interfaces(tenant_id, router_id,
+                                                       interfaces)
+
+    def remove_router_interface(self, context, router_id, interface_info):
+        tenant_id = self._router_tenant(context, router_id)
+        info = super(HuaweiL3RouterPlugin, self).remove_router_interface(
+            context, router_id, interface_info)
+        try:
+            with self._controller_call('remove_router_interface', context):
+                self.client_sdn.rest_remove_router_interface(
+                    tenant_id, router_id, info['port_id'])
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                # the removed port is gone, the subnet gets a new one
+                super(HuaweiL3RouterPlugin, self).add_router_interface(
+                    context, router_id, {'subnet_id': info['subnet_id']})
+        return info
+
+    def _network_tenant(self, context, network_id):
+        tenant_id = self._network_tenants.get(network_id)
+        if tenant_id is None:
+            network = self._core_plugin.get_network(context.elevated(),
+                                                    network_id)
+            tenant_id = self._network_tenants[network_id] = \
+                network['tenant_id']
+        return tenant_id
+
+    @staticmethod
+    def _map_floatingip(floatingip):
+        floatingip = dict(floatingip)
+        floatingip.pop('status', None)
+        return floatingip
+
+    def _push_floatingip(self, context, floatingip):
+        network_id = floatingip['floating_network_id']
+        self._batch_floatingip(self._network_tenant(context, network_id),
+                               network_id, floatingip['id'],
+                               self._map_floatingip(floatingip))
+
+    def _batch_floatingip(self, tenant_id, network_id, id, floatingip):
+        # floatingip is None when the floating IP is deleted
+        self.floatingip_batches.add((tenant_id, network_id),
+                                    (id, floatingip), self._send_floatingips)
+
+    def _send_floatingips(self, key, changes):
+        tenant_id, network_id = key
+        # only the last change of a floating IP in the batch matters
+        latest = collections.OrderedDict()
+        for id, floatingip in changes:
+            latest.pop(id, None)
+            latest[id] = floatingip
+        floatingips = [fip for fip in latest.values() if fip is not None]
+        if len(floatingips) == 1:
+            self.client_sdn.rest_update_floatingip(tenant_id, network_id,
+                                                   floatingips[0])
+        elif floatingips:
+            self.client_sdn.rest_update_floatingips(tenant_id, network_id,
+                                                    floatingips)
+        for id, floatingip in latest.items():
+            if floatingip is None:
+                self.client_sdn.rest_delete_floatingip(tenant_id,
+                                                       network_id, id)
+
+    def create_floatingip(self, context, floatingip):
+        new_fip = super(HuaweiL3RouterPlugin, self).create_floatingip(
+            context, floatingip)
+        try:
+            with self._controller_call('create_floatingip', context):
+                self._push_floatingip(context, new_fip)
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                super(HuaweiL3RouterPlugin, self).delete_floatingip(
+                    context, new_fip['id'])
+        return new_fip
+
+    def update_floatingip(self, context, id, floatingip):
+        old_fip = self.get_floatingip(context, id)
+        new_fip = super(HuaweiL3RouterPlugin, self).update_floatingip(
+            context, id, floatingip)
+        try:
+            with self._controller_call('update_floatingip', context):
+                self._push_floatingip(context, new_fip)
+        except RemoteRestError:
+            with excutils.save_and_reraise_exception():
+                restore = dict((name, old_fip[name])
+                               for name in floatingip['floatingip']
+                               if name in old_fip)
+                super(HuaweiL3RouterPlugin, self).update_floatingip(
+                    context, id, {'floatingip': restore})
+        return new_fip
+
+    def delete_floatingip(self, context, id):
+        floatingip = self.get_floatingip(context, id)
+        network_id = floatingip['floating_network_id']
+        # a deleted floating IP cannot be restored with its address, it
+        # is deleted on the controller first, in the transaction that
+        # removes it from the database
+        with context.session.begin(subtransactions=True):
+            with self._controller_call('delete_floatingip', context):
+                self._batch_floatingip(
+                    self._network_tenant(context, network_id), network_id,
+                    id, None)
+            super(HuaweiL3RouterPlugin, self).delete_floatingip(context, id)
+
+    def disassociate_floatingips(self, context, port_id):
+        floatingips = self.get_floatingips(context,
+                                           filters={'port_id': [port_id]})
+        super(HuaweiL3RouterPlugin, self).disassociate_floatingips(
+            context, port_id)
+        changes = []
+        for floatingip in floatingips:
+            floatingip.update(port_id=None, fixed_ip_address=None,
+                              router_id=None)
+            network_id = floatingip['floating_network_id']
+            changes.append((self._network_tenant(context, network_id),
+                            network_id, floatingip['id'],
+                            self._map_floatingip(floatingip)))
+        if not changes:
+            return
+
+        def push():
+            # called while the port is deleted, which must not fail
+            # because of the controller
+            try:
+                with self._controller_call('disassociate_floatingips',
+                                           context):
+                    for change in changes:
+                        self._batch_floatingip(*change)
+            except RemoteRestError:
+                LOG.error(_("Unable to disassociate floating IPs of port "
+                            "%s on the controller"), port_id)
+        # ML2 calls this in the transaction deleting the port, push once
+        # the floating IPs are cleared for good
+        _after_commit(context.session, push)
@@ -13,26 +13,111 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
+import collections
+import functools
+import json
+import os
+import signal
 import threading
 
 from oslo.config import cfg
+from sqlalchemy import orm
 
 from neutron import context as qcontext
-from neutron.db import db_base_plugin_v2, external_net_db
+from neutron.db import db_base_plugin_v2, external_net_db, models_v2
 from neutron.extensions import portbindings, external_net
 from neutron.openstack.common import log as logging
 from neutron.plugins.ml2 import driver_api
+from neutron.plugins.ml2.drivers.huawei import batching
+from neutron.plugins.ml2.drivers.huawei import changefeed
+from neutron.plugins.ml2.drivers.huawei import checkpoint
 from neutron.plugins.ml2.drivers.huawei import clients
 from neutron.plugins.ml2.drivers.huawei.clients import RemoteRestError
 from neutron.plugins.ml2.drivers.huawei import config  # noqa
+from neutron.plugins.ml2.drivers.huawei import dispatcher
 from neutron.plugins.ml2.drivers.huawei import exceptions as ml2_exc
+from neutron.plugins.ml2.drivers.huawei import profiling
+from neutron.plugins.ml2.drivers.huawei import shared_cache
+from neutron.plugins.ml2.drivers.huawei import sharding
+from neutron.plugins.ml2.drivers.huawei import sync
+from neutron.plugins.ml2.drivers.huawei import tracing
 
 
 LOG = logging.getLogger(__name__)
 
 sdn_UNREACHABLE_MSG = "Unable to reach sdn"
 VXLAN_SEGMENTATION = "vxlan"
+# networks fetched per round of queries by iter_mapped_networks
+BULK_CHUNK_SIZE = 500
+
+
+def _controller_operation(f):
+    """Trace a postcommit and bound its controller calls by call_deadline.
+
+    The trace carries the request ID of the Neutron API call, which is
+    sent along with every controller request made on its behalf.
+    """
+    @functools.wraps(f)
+    def wrapper(self, context):
+        plugin_context = getattr(context, '_plugin_context', None)
+        request_id = getattr(plugin_context, 'request_id', None)
+        if self._prewarm_pid not in (None, os.getpid()):
+            self._start_prewarm()
+        with tracing.trace(f.__name__, request_id):
+            with clients.call_deadline(self.call_deadline):
+                if self.profiler is None:
+                    return f(self, context)
+                with self.profiler.profile(f.__name__,
+                                           tracing.current_request_id()):
+                    return f(self, context)
+    return wrapper
+
+
+def create_client(confg, rest_confg, dispatcher=None):
+    """Build the controller client of the ml2_Huawei and RESTCLIENT options."""
+    kwargs = dict(
+        ssl=rest_confg.server_ssl,
+        timeout=rest_confg.server_timeout,
+        connect_timeout=rest_confg.server_connect_timeout,
+        adaptive_timeouts=rest_confg.adaptive_timeouts,
+        adaptive_percentile=rest_confg.adaptive_timeout_percentile,
+        adaptive_multiplier=rest_confg.adaptive_timeout_multiplier,
+        adaptive_min=rest_confg.adaptive_timeout_min,
+        ssl_ca_file=rest_confg.server_ca_file,
+        ssl_cert_file=rest_confg.server_cert_file,
+        ssl_key_file=rest_confg.server_key_file,
+        ssl_verify=rest_confg.server_ssl_verify,
+        pool_size=rest_confg.server_pool_size,
+        record_file=rest_confg.traffic_record_file,
+        record_max_bytes=rest_confg.traffic_record_max_bytes,
+        record_backups=rest_confg.traffic_record_backups,
+        slow_call_log_size=rest_confg.slow_call_log_size,
+        slow_call_threshold=rest_confg.slow_call_threshold,
+        generations=rest_confg.resource_generations,
+        wire_codec=rest_confg.wire_codec,
+        capabilities_ttl=rest_confg.capabilities_ttl,
+        dispatcher=dispatcher)
+    if rest_confg.server_clusters:
+        clusters = sharding.parse_clusters(rest_confg.server_clusters)
+        LOG.info(_("Sharding tenants across controller clusters %s"),
+                 sorted(clusters))
+        return sharding.ShardedSdnClient(
+            clusters, rest_confg.shard_virtual_nodes, **kwargs)
+    return clients.SdnClient(confg.nos_host, confg.nos_port, **kwargs)
+
+
+class _lazy_property(object):
+    """Build an attribute on first access and keep it on the instance."""
+
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.func.__name__] = self.func(instance)
+        return value
 
 
 class HuaweiDriver(driver_api.MechanismDriver):
@@ -47,39 +132,188 @@ class HuaweiDriver(driver_api.MechanismDriver):
         confg = cfg.CONF.ml2_Huawei
         self.segmentation_type = VXLAN_SEGMENTATION
         self.timer = None
-        self.db_base_plugin_v2 = db_base_plugin_v2.NeutronDbPluginV2()
-        self.external_net_db = external_net_db.External_net_db_mixin()
-        #         self.sdn = SyncService(self.rpc, self.ndb)
+        self.sdn = None
+        self.changefeed = None
         self.sync_timeout = confg['sync_interval']
-        self.cxt = qcontext.get_admin_context()
-        self.sdn_sync_lock = threading.Lock()
-        self.client_sdn = clients.SdnClient(confg.nos_host, confg.nos_port)
+        self.sdn_sync_lock = tracing.TracedLock('lock_wait')
+        self.call_deadline = confg.call_deadline
+        # built by initialize()
+        self.client_sdn = None
+        self._prewarm_pid = None
+        self.dispatcher = dispatcher.PriorityDispatcher(
+            confg.dispatch_concurrency, confg.dispatch_aging_interval)
+        self.create_batches = batching.BatchCollector(
+            confg.create_batch_window, confg.create_batch_size)
+        # created before neutron-server forks, so workers share the map
+        self.network_cache = shared_cache.create_cache(
+            confg.shared_cache_file, confg.shared_cache_slots)
+        self.trace_exporter = None
+        if confg.trace_buffer_size:
+            self.trace_exporter = tracing.InMemoryExporter(
+                confg.trace_buffer_size)
+            tracing.add_exporter(self.trace_exporter)
+        self.profiler = None
+        if confg.profile_threshold > 0:
+            self.profiler = profiling.SamplingProfiler(
+                confg.profile_threshold, confg.profile_interval)
+
+    @_lazy_property
+    def db_base_plugin_v2(self):
+        return db_base_plugin_v2.NeutronDbPluginV2()
+
+    @_lazy_property
+    def external_net_db(self):
+        return external_net_db.External_net_db_mixin()
+
+    @_lazy_property
+    def cxt(self):
+        return qcontext.get_admin_context()
 
     def initialize(self):
         LOG.info("huawei driver instance build...")
+        self.client_sdn = create_client(cfg.CONF.ml2_Huawei,
+                                        cfg.CONF.RESTCLIENT, self.dispatcher)
+        if cfg.CONF.ml2_Huawei.prewarm_connections:
+            self._start_prewarm()
+        if cfg.CONF.ml2_Huawei.diagnostics_signal:
+            self._install_diagnostics_signal(
+                cfg.CONF.ml2_Huawei.diagnostics_signal)
+        if cfg.CONF.RESTCLIENT.sync_data:
+            self._start_synchronization(cfg.CONF.ml2_Huawei)
+
+    def _start_prewarm(self):
+        """Open controller connections in the background.
+
+        Pooled connections are not shared with forked API workers, so a
+        worker prewarms its own on its first operation.
+        """
+        self._prewarm_pid = os.getpid()
+        thread = threading.Thread(
+            target=self._prewarm, name='huawei-prewarm',
+            args=(cfg.CONF.ml2_Huawei.prewarm_connections,))
+        thread.daemon = True
+        thread.start()
+
+    def _prewarm(self, connections):
+        try:
+            self.client_sdn.prewarm(connections)
+        except Exception:
+            LOG.exception(_("Prewarming controller connections failed"))
+
+    def _install_diagnostics_signal(self, name):
+        def handler(signum, frame):
+            # keep the handler short, logging from it could deadlock
+            thread = threading.Thread(target=self.dump_diagnostics)
+            thread.daemon = True
+            thread.start()
+        try:
+            signal.signal(getattr(signal, name), handler)
+        except (AttributeError, ValueError) as e:
+            LOG.warning(_("Unable to install diagnostics signal %(name)s: "
+                          "%(e)s"), {'name': name, 'e': e})
+
+    def dump_diagnostics(self):
+        """Log and return the slow call log and slow operation profiles."""
+        slow_calls = getattr(self.client_sdn, 'slow_calls', None)
+        diagnostics = {
+            'slow_calls': [call._asdict() for call in
+                           (slow_calls.calls() if slow_calls else [])],
+            'profiles': [profile._asdict() for profile in
+                         (self.profiler.profiles if self.profiler else [])],
+        }
+        LOG.warning(_("Huawei driver diagnostics: %s"),
+                    json.dumps(diagnostics, indent=2, default=str))
+        return diagnostics
+
+    def _start_synchronization(self, confg):
+        store = None
+        if confg.sync_checkpoint_file:
+            store = checkpoint.Checkpoint(confg.sync_checkpoint_file)
+        self.sdn = sync.SyncService(self, store,
+                                    confg.sync_checkpoint_interval,
+                                    confg.sync_workers,
+                                    confg.sync_max_inflight)
+        if confg.changefeed:
+            self.changefeed = changefeed.ChangeFeed(
+                self.client_sdn, self.sdn, self._run_sync, self.sdn_sync_lock,
+                confg.changefeed_wait, confg.changefeed_failure_limit)
+            self.changefeed.start()
+        self.timer = threading.Timer(self.sync_timeout,
+                                     self._synchronization_thread)
+        self.timer.daemon = True
+        self.timer.start()
 
+    @_controller_operation
     def create_network_postcommit(self, context):
-        """Provision the network on the Huawei Hardware."""
+        """Provision the network on the Huawei Hardware.
+
+        Networks of the tenant created at about the same time, e.g. by a
+        template onboarding it, are sent along, see create_batch_window.
+        """
         LOG.info("enter HuaweiDriver:create_network_postcommit()")
         network = context.current
         network_id = network['id']
         tenant_id = network['tenant_id']
         LOG.info("network_id = [%s] tenant_id = [%s]"
                  % (network_id, tenant_id))
+        try:
+            errors = self.create_batches.add(('network', tenant_id),
+                                             network, self._create_networks)
+        except RemoteRestError:
+            LOG.error(sdn_UNREACHABLE_MSG)
+            raise ml2_exc.MechanismDriverError(
+                method="create_network_postcommit")
+        if errors.get(network_id) is not None:
+            LOG.error(_("Network %(id)s not created: %(error)s"),
+                      {'id': network_id, 'error': errors[network_id]})
+            raise ml2_exc.MechanismDriverError(
+                method="create_network_postcommit")
+        msg = _('Network %s is created') % network_id
+        LOG.info(msg)
+
+    def _create_networks(self, key, networks):
+        """Create networks of a tenant, return {id: error}."""
+        kind, tenant_id = key
         with self.sdn_sync_lock:
-            try:
-                mapped_network = self._get_mapped_network_with_subnets(
-                    network)
-                LOG.info("mapped_network = [%s]" % mapped_network)
+            generation = self.client_sdn.read_generation()
+            mapped_networks = [clients.with_generation(
+                self._get_mapped_network_with_subnets(network), generation)
+                for network in networks]
+            if len(mapped_networks) == 1:
+                LOG.info(_("mapped_network = [%s]"), mapped_networks[0])
                 # create network on the network controller
-                self.client_sdn.rest_create_network(tenant_id,
-                                                    mapped_network)
-            except RemoteRestError:
-                LOG.error(sdn_UNREACHABLE_MSG)
-                raise ml2_exc.MechanismDriverError(
-                    method="create_network_postcommit")
-            msg = _('Network %s is created') % network_id
-            LOG.info(msg)
+                with dispatcher.priority(dispatcher.PRIORITY_NORMAL):
+                    self.client_sdn.rest_create_network(tenant_id,
+                                                        mapped_networks[0])
+                errors = {mapped_networks[0]['id']: None}
+            else:
+                LOG.info(_("Creating %(count)d networks of tenant "
+                           "%(tenant)s"), {'count': len(mapped_networks),
+                                           'tenant': tenant_id})
+                with dispatcher.priority(dispatcher.PRIORITY_NORMAL):
+                    errors = self.client_sdn.rest_create_networks(
+                        tenant_id, mapped_networks)
+        self._pushed(errors)
+        return errors
+
+    def _pushed(self, errors):
+        """Tell the sync service the networks of errors that were sent.
+
+        errors is {network id: error or None}, as returned by the bulk
+        calls of the client.
+        """
+        if self.sdn is not None:
+            for network_id, error in errors.items():
+                if error is None:
+                    self.sdn.pushed(network_id)
+
+    @staticmethod
+    def _by_tenant(resources):
+        """Return [(tenant_id, resources)] in the order of resources."""
+        groups = collections.OrderedDict()
+        for resource in resources:
+            groups.setdefault(resource['tenant_id'], []).append(resource)
+        return groups.items()
 
     def update_network_precommit(self, context):
         """At the moment we only support network name change
@@ -94,6 +328,7 @@ class HuaweiDriver(driver_api.MechanismDriver):
             msg = _('Network name changed to %s') % new_network['name']
             LOG.info(msg)
 
+    @_controller_operation
     def update_network_postcommit(self, context):
         """At the moment we only support network name change
 
@@ -101,36 +336,43 @@ class HuaweiDriver(driver_api.MechanismDriver):
         sent to the sdn controller.
         """
         new_network = context.current
+        self.network_cache.invalidate(new_network['id'])
         orig_network = context.original
         if new_network['name'] != orig_network['name']:
             network_id = new_network['id']
-            with self.sdn_sync_lock:
-                try:
-                    self._send_update_network(new_network, context)
-                except RemoteRestError:
-                    LOG.error(sdn_UNREACHABLE_MSG)
-                    raise ml2_exc.MechanismDriverError(
-                        method="update_network_postcommit")
-                msg = _('Network %s is updated') % network_id
-                LOG.info(msg)
+            try:
+                self._send_update_network(network_id, context,
+                                          network=new_network)
+            except RemoteRestError:
+                LOG.error(sdn_UNREACHABLE_MSG)
+                raise ml2_exc.MechanismDriverError(
+                    method="update_network_postcommit")
+            msg = _('Network %s is updated') % network_id
+            LOG.info(msg)
 
+    @_controller_operation
     def delete_network_postcommit(self, context):
         """Send network delete request to sdn controller."""
         network = context.current
         network_id = network['id']
         tenant_id = network['tenant_id']
+        self.network_cache.invalidate(network_id)
         with self.sdn_sync_lock:
 
             # Succeed deleting network in case sdn is not accessible.
             # sdn state will be updated by sync thread once sdn gets
             # alive.
             try:
-                self.client_sdn.rest_delete_network(tenant_id, network_id)
+                with dispatcher.priority(dispatcher.PRIORITY_NORMAL):
+                    self.client_sdn.rest_delete_network(tenant_id, network_id)
             except RemoteRestError:
                 LOG.error(sdn_UNREACHABLE_MSG)
                 raise ml2_exc.MechanismDriverError(
                     method="delete_network_postcommit")
+        if self.sdn is not None:
+            self.sdn.deleted(network_id)
 
+    @_controller_operation
     def create_port_postcommit(self, context):
         """Plug a physical host into a network.
 
@@ -146,9 +388,11 @@ class HuaweiDriver(driver_api.MechanismDriver):
         is_vm_boot = device_id and device_owner
         if host and is_vm_boot:
             network_id = port['network_id']
-            net = self.db_base_plugin_v2._get_network(self.cxt, network_id)
+            tenant_id = self._get_network_meta(network_id)[0]
+            net = {'id': network_id, 'tenant_id': tenant_id}
             try:
-                self.client_sdn.rest_create_port(net, port)
+                with dispatcher.priority(dispatcher.PRIORITY_INTERACTIVE):
+                    self.client_sdn.rest_create_port(net, port)
             except RemoteRestError:
                 LOG.error("create port %s on controller failed,reason:%s"
                           % (port['id'], sdn_UNREACHABLE_MSG))
@@ -158,10 +402,9 @@ class HuaweiDriver(driver_api.MechanismDriver):
             tenant_id = net["tenant_id"]
             net_id = net["id"]
             try:
-                self.client_sdn.rest_plug_interface(tenant_id,
-                                                    net_id,
-                                                    port,
-                                                    device_id)
+                with dispatcher.priority(dispatcher.PRIORITY_INTERACTIVE):
+                    self.client_sdn.rest_plug_interface(tenant_id, net_id,
+                                                        port, device_id)
             except RemoteRestError:
                 LOG.error("plug interface %s to server %s failed,reason:%s"
                           % (port['id'], device_id, sdn_UNREACHABLE_MSG))
@@ -194,6 +437,7 @@ class HuaweiDriver(driver_api.MechanismDriver):
             # nothing to do
             return
 
+    @_controller_operation
     def delete_port_postcommit(self, context):
         """unPlug a physical host from a network."""
         port = context.current
@@ -202,9 +446,9 @@ class HuaweiDriver(driver_api.MechanismDriver):
         tenant_id = port['tenant_id']
         # only vm port should be deleted
         try:
-            self.client_sdn.rest_delete_port(tenant_id,
-                                             network_id,
-                                             port_id)
+            with dispatcher.priority(dispatcher.PRIORITY_NORMAL):
+                self.client_sdn.rest_delete_port(tenant_id, network_id,
+                                                 port_id)
         except RemoteRestError:
             LOG.error("delete port %s failed, reason:%s"
                       % (port_id, sdn_UNREACHABLE_MSG))
@@ -212,98 +456,270 @@ class HuaweiDriver(driver_api.MechanismDriver):
                 method="delete_port_postcommit")
 
         try:
-            self.client_sdn.rest_unplug_interface(tenant_id,
-                                                  network_id,
-                                                  port_id)
+            with dispatcher.priority(dispatcher.PRIORITY_NORMAL):
+                self.client_sdn.rest_unplug_interface(tenant_id, network_id,
+                                                      port_id)
         except RemoteRestError:
             LOG.error("unplug interface %s failed, reason:%s"
                       % (port['id'], sdn_UNREACHABLE_MSG))
             raise ml2_exc.MechanismDriverError(
                 method="delete_port_postcommit")
 
+    @_controller_operation
     def create_subnet_postcommit(self, context):
+        """Update the network of the subnet on the controller.
 
+        The networks of the subnets of the tenant created at about the
+        same time are sent along, each once, see create_batch_window.
+        """
         subnet = context.current
-        net_id = subnet['network_id']
-        context = qcontext.get_admin_context()
         try:
-            with self.sdn_sync_lock:
-                orig_net = self.db_base_plugin_v2.get_network(context, net_id)
-                # update network on network controller
-                self._send_update_network(orig_net, context)
+            errors = self.create_batches.add(
+                ('subnet', subnet['tenant_id']), subnet,
+                self._update_subnet_networks)
         except RemoteRestError:
             LOG.error(sdn_UNREACHABLE_MSG)
             raise ml2_exc.MechanismDriverError(
                 method="create_subnet_postcommit")
+        if errors.get(subnet['id']) is not None:
+            LOG.error(_("Network %(net)s of subnet %(id)s not updated: "
+                        "%(error)s"), {'net': subnet['network_id'],
+                                       'id': subnet['id'],
+                                       'error': errors[subnet['id']]})
+            raise ml2_exc.MechanismDriverError(
+                method="create_subnet_postcommit")
 
+    def _update_subnet_networks(self, key, subnets):
+        """Update the networks of subnets, return {subnet id: error}."""
+        context = qcontext.get_admin_context()
+        net_ids = list(collections.OrderedDict(
+            (subnet['network_id'], None) for subnet in subnets))
+        if len(net_ids) == 1:
+            # update network on network controller
+            self._send_update_network(net_ids[0], context,
+                                      dispatcher.PRIORITY_BACKGROUND)
+            return dict((subnet['id'], None) for subnet in subnets)
+        with self.sdn_sync_lock:
+            generation = self.client_sdn.read_generation()
+            networks = []
+            for net_id in net_ids:
+                with tracing.span('db', query='get_network'):
+                    networks.append(self.db_base_plugin_v2.get_network(
+                        context, net_id))
+            mapped = [(tenant_id, [
+                clients.with_generation(
+                    self._get_mapped_network_with_subnets(network, context),
+                    generation)
+                for network in tenant_networks])
+                for tenant_id, tenant_networks in self._by_tenant(networks)]
+        results = {}
+        for tenant_id, mapped_networks in mapped:
+            with dispatcher.priority(dispatcher.PRIORITY_BACKGROUND):
+                results.update(self.client_sdn.rest_update_networks(
+                    tenant_id, mapped_networks))
+        self._pushed(results)
+        return dict((subnet['id'], results.get(subnet['network_id']))
+                    for subnet in subnets)
+
+    @_controller_operation
     def update_subnet_postcommit(self, context):
 
         subnet = context.current
         net_id = subnet['network_id']
         try:
-            with self.sdn_sync_lock:
-                orig_net = self.db_base_plugin_v2.get_network(context, net_id)
-                # update network on network controller
-                self._send_update_network(orig_net, context)
+            # update network on network controller
+            self._send_update_network(net_id, context,
+                                      dispatcher.PRIORITY_BACKGROUND)
         except RemoteRestError:
             LOG.error(sdn_UNREACHABLE_MSG)
             raise ml2_exc.MechanismDriverError(
                 method="update_subnet_postcommit")
 
+    @_controller_operation
     def delete_subnet_postcommit(self, context):
 
         subnet = context.current
         net_id = subnet['network_id']
         try:
-            with self.sdn_sync_lock:
-                orig_net = self.db_base_plugin_v2.get_network(self.cxt, net_id)
-                # update network on network controller
-                self._send_update_network(orig_net, context)
+            # update network on network controller
+            self._send_update_network(net_id, context,
+                                      dispatcher.PRIORITY_BACKGROUND,
+                                      read_context=self.cxt)
         except RemoteRestError:
             LOG.error(sdn_UNREACHABLE_MSG)
             raise ml2_exc.MechanismDriverError(
                 method="delete_subnet_postcommit")
 
-    def _synchronization_thread(self):
-        with self.sdn_sync_lock:
+    def _run_sync(self):
+        if self.sdn.workers:
+            # partitioned cycles push concurrently, holding the lock
+            # would stall every postcommit for the whole cycle; a
+            # push racing a postcommit is corrected the next cycle
             self.sdn.synchronize()
+        else:
+            with self.sdn_sync_lock:
+                self.sdn.synchronize()
+
+    def _synchronization_thread(self):
+        try:
+            if self.changefeed is not None and self.changefeed.healthy():
+                LOG.debug(_("Change feed healthy, periodic sync skipped"))
+            else:
+                self._run_sync()
+        except Exception:
+            LOG.exception(_("Synchronization with sdn failed"))
 
         self.timer = threading.Timer(self.sync_timeout,
                                      self._synchronization_thread)
+        self.timer.daemon = True
         self.timer.start()
 
     def stop_synchronization_thread(self):
         if self.timer:
             self.timer.cancel()
             self.timer = None
+        if self.changefeed:
+            self.changefeed.stop()
+        if self.sdn:
+            self.sdn.stop()
 
     def _get_mapped_network_with_subnets(self, network, context=None):
         # if context is not provided, admin context is used
         if context is None:
             context = qcontext.get_admin_context()
-        network = self._map_state_and_status(network)
-        subnets = self._get_all_subnets_json_for_network(network['id'],
-                                                         context)
-        network['subnets'] = subnets
-        for subnet in (subnets or []):
-            if subnet['gateway_ip']:
-                # FIX: For backward compatibility with wire protocol
-                network['gateway'] = subnet['gateway_ip']
-                break
-            else:
-                network['gateway'] = ''
-        network[
-            external_net.EXTERNAL] = self.external_net_db. \
-            _network_is_external(context, network['id'])
-        return network
+        mapped_network = self._map_state_and_status(network)
+        with tracing.span('db', query='network_document'):
+            subnets = self._get_all_subnets_json_for_network(network['id'],
+                                                             context)
+        is_external = self._get_network_meta(network['id'], context,
+                                             network)[1]
+        return self._add_subnets_and_external(mapped_network, subnets,
+                                              is_external)
+
+    def _get_network_meta(self, network_id, context=None, network=None):
+        """Return (tenant_id, is_external) of network_id.
+
+        Served from the cache shared by the API workers of the host, a
+        miss reads the database, or network if the caller has it.
+        """
+        value, version = self.network_cache.get(network_id)
+        if value is not None:
+            return value[1:].decode('utf-8'), value[:1] == b'\x01'
+        context = context or self.cxt
+        with tracing.span('db', query='network_meta'):
+            if network is None:
+                network = self.db_base_plugin_v2._get_network(context,
+                                                              network_id)
+            is_external = bool(self.external_net_db._network_is_external(
+                context, network_id))
+        tenant_id = network['tenant_id']
+        self.network_cache.put(
+            network_id,
+            (b'\x01' if is_external else b'\x00') + tenant_id.encode('utf-8'),
+            version)
+        return tenant_id, is_external
+
+    @staticmethod
+    def _add_subnets_and_external(mapped_network, subnets, is_external):
+        mapped_network['subnets'] = subnets
+        if subnets:
+            # FIX: For backward compatibility with wire protocol
+            mapped_network['gateway'] = next(
+                (subnet['gateway_ip'] for subnet in subnets
+                 if subnet['gateway_ip']), '')
+        mapped_network[external_net.EXTERNAL] = is_external
+        return mapped_network
+
+    def iter_mapped_networks(self, network_ids=None, tenant_id=None,
+                             context=None, chunk_size=BULK_CHUNK_SIZE):
+        """Yield controller documents for many networks.
+
+        Networks are selected by network_ids, by tenant_id, or both; with
+        neither, all networks are yielded. They are processed chunk_size
+        at a time in network id order, each chunk with one query for the
+        networks, one for their subnets and one for the external flags,
+        so memory stays bounded by the chunk whatever the total.
+
+        Documents are built from the Neutron database alone, so the ML2
+        provider attributes of context.current are not part of them.
+        """
+        if context is None:
+            context = qcontext.get_admin_context()
+        make_subnet_dict = self.db_base_plugin_v2._make_subnet_dict
+        make_network_dict = self.db_base_plugin_v2._make_network_dict
+        for chunk in self._network_id_chunks(context, network_ids,
+                                             tenant_id, chunk_size):
+            networks, subnets, external_ids = self._fetch_network_chunk(
+                context, chunk, tenant_id)
+            subnets_by_network = collections.defaultdict(list)
+            for subnet in subnets:
+                subnets_by_network[subnet['network_id']].append(
+                    self._set_state_and_status(make_subnet_dict(subnet)))
+            for network in networks:
+                mapped_network = self._set_state_and_status(
+                    make_network_dict(network, process_extensions=False))
+                yield self._add_subnets_and_external(
+                    mapped_network,
+                    subnets_by_network.pop(network['id'], []),
+                    network['id'] in external_ids)
+
+    def get_network_tenant_ids(self, context=None):
+        """Return the IDs of the tenants owning at least one network."""
+        if context is None:
+            context = qcontext.get_admin_context()
+        query = context.session.query(models_v2.Network.tenant_id)
+        return [row[0] for row in query.distinct()]
+
+    def _network_id_chunks(self, context, network_ids, tenant_id,
+                           chunk_size):
+        if network_ids is not None:
+            network_ids = sorted(set(network_ids))
+            for i in range(0, len(network_ids), chunk_size):
+                yield network_ids[i:i + chunk_size]
+            return
+        # keyset pagination, only ids are held between chunks
+        last_id = None
+        while True:
+            query = context.session.query(models_v2.Network.id)
+            if tenant_id is not None:
+                query = query.filter(models_v2.Network.tenant_id == tenant_id)
+            if last_id is not None:
+                query = query.filter(models_v2.Network.id > last_id)
+            ids = [row[0] for row in
+                   query.order_by(models_v2.Network.id).limit(chunk_size)]
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    def _fetch_network_chunk(self, context, network_ids, tenant_id=None):
+        """Return (networks, subnets, external network ids) of a chunk."""
+        session = context.session
+        with session.begin(subtransactions=True):
+            # subnets are fetched below, skip their joined load here
+            query = session.query(models_v2.Network).options(
+                orm.noload('subnets')).filter(
+                models_v2.Network.id.in_(network_ids))
+            if tenant_id is not None:
+                query = query.filter(models_v2.Network.tenant_id == tenant_id)
+            networks = query.order_by(models_v2.Network.id).all()
+            subnets = session.query(models_v2.Subnet).filter(
+                models_v2.Subnet.network_id.in_(network_ids)).all()
+            external_ids = set(row[0] for row in session.query(
+                external_net_db.ExternalNetwork.network_id).filter(
+                external_net_db.ExternalNetwork.network_id.in_(network_ids)))
+        return networks, subnets, external_ids
 
     def _map_state_and_status(self, resource):
-        resource = copy.copy(resource)
+        """Return a mapped copy of resource, resource is left untouched."""
+        return self._set_state_and_status(dict(resource))
 
+    @staticmethod
+    def _set_state_and_status(resource):
+        """Map admin_state_up/status of resource to state, in place."""
         resource['state'] = ('UP' if resource.pop('admin_state_up',
                                                   True) else 'DOWN')
-        if 'status' in resource:
-            del resource['status']
+        resource.pop('status', None)
         return resource
 
     def _get_all_subnets_json_for_network(self, net_id, context=None):
@@ -313,19 +729,32 @@ class HuaweiDriver(driver_api.MechanismDriver):
         with context.session.begin(subtransactions=True):
             subnets = self.db_base_plugin_v2._get_subnets_by_network(context,
                                                                      net_id)
-        subnets_details = []
-        if subnets:
-            for subnet in subnets:
-                subnet_dict = self.db_base_plugin_v2._make_subnet_dict(subnet)
-                mapped_subnet = self._map_state_and_status(subnet_dict)
-                subnets_details.append(mapped_subnet)
-        return subnets_details
-
-    def _send_update_network(self, network, context):
-        net_id = network['id']
-        tenant_id = network['tenant_id']
-        # update network on network controller
-        mapped_network = self._get_mapped_network_with_subnets(network,
-                                                               context)
-        mapped_network['floatingips'] = []
-        self.client_sdn.rest_update_network(tenant_id, net_id, mapped_network)
+        # the subnet dicts are built here, so they are mapped in place
+        make_subnet_dict = self.db_base_plugin_v2._make_subnet_dict
+        return [self._set_state_and_status(make_subnet_dict(subnet))
+                for subnet in subnets or ()]
+
+    def _send_update_network(self, net_id, context,
+                             priority=dispatcher.PRIORITY_NORMAL,
+                             network=None, read_context=None):
+        """Send the document of network net_id to the controller.
+
+        The network is read with read_context, context by default, unless
+        given. The document is built under sdn_sync_lock, released before
+        the request queues for a dispatcher slot so that a background
+        update does not hold off the operations waiting for the lock.
+        """
+        with self.sdn_sync_lock:
+            generation = self.client_sdn.read_generation()
+            if network is None:
+                with tracing.span('db', query='get_network'):
+                    network = self.db_base_plugin_v2.get_network(
+                        read_context or context, net_id)
+            # floating IPs are pushed on their own by the L3 service plugin
+            mapped_network = clients.with_generation(
+                self._get_mapped_network_with_subnets(network, context),
+                generation)
+        with dispatcher.priority(priority):
+            self.client_sdn.rest_update_network(network['tenant_id'], net_id,
+                                                mapped_network)
+        self._pushed({net_id: None})
@@ -0,0 +1,170 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sampling profiler for slow driver operations.
+
+Operations run inside profile() are watched by one sampler thread. Once
+an operation has been running for threshold seconds, the stack of its
+thread is sampled every interval seconds until it returns, so only the
+slow part of slow operations is ever sampled. The samples of each slow
+operation are kept, as collapsed stacks with their counts, in a bounded
+list of recent profiles.
+
+When eventlet has patched threading, operations run in green threads
+that share one OS thread, so they are told apart by their greenlet and
+sampled through its frame; the sampler is a green thread itself and
+samples whenever the operations yield.
+"""
+
+import atexit
+import collections
+import contextlib
+import sys
+import threading
+import time
+
+try:
+    from eventlet import patcher
+    import greenlet
+except ImportError:
+    patcher = None
+    greenlet = None
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+Profile = collections.namedtuple('Profile', ['name', 'request_id', 'start',
+                                             'duration', 'samples',
+                                             'stacks'])
+
+
+def _green():
+    """True if eventlet replaced the threads with green threads."""
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+def collapse_stack(frame, limit=64):
+    """Return frame's stack as 'file:function:line;...', outermost first."""
+    entries = []
+    while frame is not None and len(entries) < limit:
+        code = frame.f_code
+        entries.append('%s:%s:%d' % (code.co_filename, code.co_name,
+                                     frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(entries))
+
+
+class _Active(object):
+    __slots__ = ('name', 'request_id', 'start', 'stacks')
+
+    def __init__(self, name, request_id):
+        self.name = name
+        self.request_id = request_id
+        self.start = time.time()
+        self.stacks = collections.Counter()
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of operations running over threshold."""
+
+    def __init__(self, threshold=1.0, interval=0.01, capacity=20,
+                 top_stacks=20):
+        self.threshold = threshold
+        self.interval = interval
+        self.top_stacks = top_stacks
+        self.profiles = collections.deque(maxlen=capacity)
+        # {thread ident, or greenlet under eventlet: _Active}
+        self._active = {}
+        self._green = _green()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def _current(self):
+        if self._green:
+            return greenlet.getcurrent()
+        return threading.current_thread().ident
+
+    @contextlib.contextmanager
+    def profile(self, name, request_id=None):
+        ident = self._current()
+        active = _Active(name, request_id)
+        with self._lock:
+            if ident in self._active:
+                # nested operation, part of the outer profile
+                active = None
+            else:
+                self._active[ident] = active
+            if self._sampler is None and not self._stopped.is_set():
+                self._sampler = threading.Thread(target=self._run,
+                                                 name='huawei-profiler')
+                self._sampler.daemon = True
+                self._sampler.start()
+                # a daemon thread still sampling while the interpreter
+                # tears the modules down fails on their cleared globals
+                atexit.register(self.stop)
+        if active is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._active[ident]
+            duration = time.time() - active.start
+            if duration >= self.threshold and active.stacks:
+                self.profiles.append(Profile(
+                    name, request_id, active.start, duration,
+                    sum(active.stacks.values()),
+                    active.stacks.most_common(self.top_stacks)))
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to exit."""
+        self._stopped.set()
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            sampler.join()
+
+    def _run(self):
+        while True:
+            if self._active:
+                delay = self.interval
+            else:
+                delay = max(self.interval, self.threshold / 2)
+            self._stopped.wait(delay)
+            if self._stopped.is_set():
+                return
+            self.sample()
+
+    def sample(self):
+        """Take one sample of every operation over threshold."""
+        now = time.time()
+        with self._lock:
+            slow = [(ident, active) for ident, active in self._active.items()
+                    if now - active.start >= self.threshold]
+        if not slow:
+            return
+        if self._green:
+            # the frame a green thread was suspended at
+            frames = dict((ident, ident.gr_frame) for ident, active in slow)
+        else:
+            frames = sys._current_frames()
+        for ident, active in slow:
+            frame = frames.get(ident)
+            if frame is not None:
+                active.stacks[collapse_stack(frame)] += 1
@@ -0,0 +1,135 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recording of controller traffic for later replay.
+
+Every request is appended to the recording as one tab separated line:
+
+    start  duration_ms  method  resource  payload_bytes  status  server
+
+Payloads themselves are not recorded, only their size. The file is
+rotated to <file>.1 ... <file>.<backups> once it exceeds max_bytes.
+API workers forked from one server share the file; rotation is done by
+whichever worker sees it full first, under an flock on <file>.lock, and
+the others reopen the new file.
+"""
+
+import collections
+import fcntl
+import os
+import threading
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+Record = collections.namedtuple('Record', ['start', 'duration', 'method',
+                                           'resource', 'payload_bytes',
+                                           'status', 'server'])
+
+
+class TrafficRecorder(object):
+    """Append-only, size rotated recorder of controller requests."""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def record(self, start, duration, method, resource, payload_bytes,
+               status, server):
+        line = '%.6f\t%.3f\t%s\t%s\t%d\t%d\t%s\n' % (
+            start, duration * 1000, method, resource, payload_bytes, status,
+            server)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                elif self.max_bytes and self._size >= self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._file.flush()
+                # other workers append to the same file
+                self._size = os.fstat(self._file.fileno()).st_size
+            except (IOError, OSError) as e:
+                LOG.warning(_("TrafficRecorder: unable to write %(path)s: "
+                              "%(e)s"), {'path': self.path, 'e': e})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        self._file = open(self.path, 'a')
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                rotated = self._rotated_elsewhere()
+                self._file.close()
+                if not rotated:
+                    for index in range(self.backups - 1, 0, -1):
+                        source = '%s.%d' % (self.path, index)
+                        if os.path.exists(source):
+                            os.rename(source,
+                                      '%s.%d' % (self.path, index + 1))
+                    if self.backups > 0:
+                        os.rename(self.path, self.path + '.1')
+                    else:
+                        os.remove(self.path)
+                self._open()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rotated_elsewhere(self):
+        """True if another worker already moved our file aside."""
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return True
+        return current.st_ino != os.fstat(self._file.fileno()).st_ino
+
+
+def recording_files(path):
+    """Return the recording and its rotated parts, oldest first."""
+    index = 1
+    files = []
+    while os.path.exists('%s.%d' % (path, index)):
+        files.insert(0, '%s.%d' % (path, index))
+        index += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_records(paths):
+    """Yield a Record for each line of the given recording files."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != len(Record._fields):
+                    continue
+                yield Record(float(fields[0]), float(fields[1]) / 1000,
+                             fields[2], fields[3], int(fields[4]),
+                             int(fields[5]), fields[6])
@@ -0,0 +1,178 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact records of the resources the driver keeps state about.
+
+Anything the driver holds per resource (caches, fingerprints, sync
+state) is stored in these records rather than in Neutron resource dicts.
+Records use __slots__, UUIDs are kept as their 16 byte form and strings
+shared by many resources (tenant and host names) are interned, so a
+record costs a fraction of the dict it is built from.
+"""
+
+import hashlib
+import json
+import sys
+import uuid
+
+try:
+    _intern = intern
+except NameError:
+    _intern = sys.intern
+
+
+FINGERPRINT_BYTES = 8
+
+
+class UUIDKey(bytes):
+    """16 byte form of a UUID.
+
+    On Python 2 bytes is str, the type tells packed UUIDs apart from
+    other IDs that happen to be 16 characters long.
+    """
+    __slots__ = ()
+
+
+def uuid_key(resource_id):
+    """Return the 16 byte key of a UUID, other IDs are kept interned."""
+    if resource_id is None:
+        return None
+    try:
+        return UUIDKey(uuid.UUID(resource_id).bytes)
+    except (AttributeError, TypeError, ValueError):
+        return _intern(str(resource_id))
+
+
+def key_to_id(key):
+    """Return the resource ID a key was made from."""
+    if isinstance(key, UUIDKey):
+        return str(uuid.UUID(bytes=bytes(key)))
+    return key
+
+
+def intern_str(value):
+    return None if value is None else _intern(str(value))
+
+
+def fingerprint(document):
+    """Return a short digest of a document, to detect that it changed."""
+    data = json.dumps(document, sort_keys=True).encode('utf-8')
+    return hashlib.md5(data).digest()[:FINGERPRINT_BYTES]
+
+
+class _Record(object):
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise TypeError(_("%(cls)s takes %(n)d values") %
+                            {'cls': type(self).__name__,
+                             'n': len(self.__slots__)})
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                all(getattr(self, name) == getattr(other, name)
+                    for name in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name))
+                                     for name in self.__slots__))
+
+
+class NetworkRecord(_Record):
+    __slots__ = ('key', 'tenant_id', 'up', 'external', 'fingerprint')
+
+    @classmethod
+    def from_document(cls, network):
+        """Build from a mapped network as sent to the controller."""
+        return cls(uuid_key(network['id']),
+                   intern_str(network['tenant_id']),
+                   network.get('state', 'UP') == 'UP',
+                   bool(network.get('router:external')),
+                   fingerprint(network))
+
+
+class SubnetRecord(_Record):
+    __slots__ = ('key', 'network_key', 'cidr', 'gateway_ip', 'fingerprint')
+
+    @classmethod
+    def from_document(cls, subnet):
+        return cls(uuid_key(subnet['id']),
+                   uuid_key(subnet['network_id']),
+                   subnet.get('cidr'),
+                   subnet.get('gateway_ip'),
+                   fingerprint(subnet))
+
+
+class PortRecord(_Record):
+    __slots__ = ('key', 'network_key', 'tenant_id', 'device_key', 'host_id',
+                 'fingerprint')
+
+    @classmethod
+    def from_document(cls, port):
+        return cls(uuid_key(port['id']),
+                   uuid_key(port['network_id']),
+                   intern_str(port['tenant_id']),
+                   uuid_key(port.get('device_id') or None),
+                   intern_str(port.get('binding:host_id') or None),
+                   fingerprint(port))
+
+
+class AttachmentRecord(_Record):
+    """A port plugged into a VM on a host, as sent with plug_port."""
+    __slots__ = ('port_key', 'device_key', 'host_id', 'segmentation_id')
+
+    @classmethod
+    def from_port(cls, port, segmentation_id=None):
+        return cls(uuid_key(port['id']),
+                   uuid_key(port.get('device_id') or None),
+                   intern_str(port.get('binding:host_id') or None),
+                   segmentation_id)
+
+
+class RecordTable(object):
+    """Records of one resource type, looked up by resource ID."""
+
+    def __init__(self, key_attr='key'):
+        self.key_attr = key_attr
+        self._records = {}
+
+    def add(self, record):
+        self._records[getattr(record, self.key_attr)] = record
+
+    def get(self, resource_id, default=None):
+        return self._records.get(uuid_key(resource_id), default)
+
+    def pop(self, resource_id, default=None):
+        return self._records.pop(uuid_key(resource_id), default)
+
+    def ids(self):
+        for key in self._records:
+            yield key_to_id(key)
+
+    def __contains__(self, resource_id):
+        return uuid_key(resource_id) in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
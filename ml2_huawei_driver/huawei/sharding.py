@@ -0,0 +1,129 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tenant sharding across several Huawei sdn controller clusters.
+
+Tenants are mapped to clusters with a consistent hash ring, so adding or
+removing a cluster only moves the tenants whose ring segment changed
+owner. Every controller URL carries the tenant ID, which is how requests
+are routed to their cluster.
+"""
+
+import bisect
+import hashlib
+import re
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import clients
+
+
+LOG = logging.getLogger(__name__)
+
+TENANT_RE = re.compile(r'^/tenants/([^/]+)')
+
+
+def parse_clusters(cluster_specs):
+    """Parse 'name=host:port|host:port' entries into {name: [(h, p)]}."""
+    clusters = {}
+    for spec in cluster_specs:
+        try:
+            name, servers = spec.split('=', 1)
+            endpoints = []
+            for server in servers.split('|'):
+                host, port = server.rsplit(':', 1)
+                endpoints.append((host.strip(), int(port)))
+        except ValueError:
+            LOG.error(clients.SYNTAX_ERROR_MESSAGE)
+            raise
+        clusters[name.strip()] = endpoints
+    return clusters
+
+
+class HashRing(object):
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes, virtual_nodes=128):
+        self.nodes = sorted(nodes)
+        self.virtual_nodes = virtual_nodes
+        points = []
+        for node in self.nodes:
+            for replica in range(virtual_nodes):
+                points.append((self._hash('%s-%d' % (node, replica)), node))
+        points.sort()
+        self._keys = [point for point, node in points]
+        self._owners = [node for point, node in points]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get_node(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key))
+        if index == len(self._keys):
+            index = 0
+        return self._owners[index]
+
+
+def rebalance(tenant_ids, old_ring, new_ring):
+    """Return {tenant_id: (old_cluster, new_cluster)} for moved tenants."""
+    moves = {}
+    for tenant_id in tenant_ids:
+        old = old_ring.get_node(tenant_id)
+        new = new_ring.get_node(tenant_id)
+        if old != new:
+            moves[tenant_id] = (old, new)
+    return moves
+
+
+class ShardedSdnClient(clients.SdnClient):
+    """SdnClient that sends each tenant to its controller cluster.
+
+    Failover happens between the servers of the owning cluster only.
+    Requests without a tenant in their path may go to any server.
+    """
+
+    def __init__(self, clusters, virtual_nodes=128, **kwargs):
+        super(ShardedSdnClient, self).__init__(None, None, **kwargs)
+        self.clusters = {}
+        for name, endpoints in clusters.items():
+            proxies = [self.server_proxy_for(host, port)
+                       for host, port in endpoints]
+            self.clusters[name] = proxies
+            self.servers.extend(proxies)
+        self.ring = HashRing(self.clusters.keys(), virtual_nodes)
+
+    def cluster_for(self, tenant_id):
+        return self.ring.get_node(tenant_id)
+
+    def servers_for(self, resource):
+        match = TENANT_RE.match(resource)
+        if not match:
+            return self.servers
+        return self.clusters[self.cluster_for(match.group(1))]
+
+    def feed_groups(self):
+        # every cluster reports the changes of its own tenants
+        return dict(self.clusters)
+
+    def rebalance_plan(self, tenant_ids, clusters):
+        """Report the tenants to migrate if clusters replaced the current.
+
+        clusters is a collection of cluster names, e.g. the current ones
+        plus a new cluster.
+        """
+        new_ring = HashRing(clusters, self.ring.virtual_nodes)
+        return rebalance(tenant_ids, self.ring, new_ring)
@@ -0,0 +1,263 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read-mostly resource cache shared by the API workers of a host.
+
+neutron-server forks its API workers, each running its own driver.
+Rather than each worker warming a private cache, they share a fixed size
+table in a memory mapped file:
+
+    header  magic, slot count
+    slot    seq, version, key, expiry, value length, value
+
+Keys are direct mapped to slots, a key evicts whatever its slot held.
+Readers take no lock: a slot is only written between two increments of
+its seq, so a reader that sees an odd or changed seq reads again.
+Writers lock the slot with a POSIX record lock, which excludes other
+processes, and a thread lock.
+
+Invalidation is versioned. invalidate() bumps the version of the slot of
+a key, and put() only stores a value if the slot version is still the
+one get() returned before the value was read from the database. A value
+read before a concurrent update is thereby never cached after the update
+invalidated it.
+
+Entries expire after TTL seconds. Invalidations are only made by the
+workers of the host, updates made through other neutron-servers reach
+the cache by expiry alone, as do updates made while the file outlived a
+restart.
+
+Where the file cannot be mapped, LocalCache offers the same interface
+within a single process. Invalidations made by other workers do not
+reach it either.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'HWC2'
+SLOT_SIZE = 96
+_HEADER = struct.Struct('<4sI')
+_SLOT = struct.Struct('<II16sIH')
+_SEQ = struct.Struct('<I')
+VALUE_SIZE = SLOT_SIZE - _SLOT.size
+# reads retried while a writer holds the slot before giving up
+READ_RETRIES = 16
+TTL = 30
+_EMPTY_KEY = b'\0' * 16
+
+
+def cache_key(resource_id):
+    """Return the 16 byte cache key of a resource ID."""
+    try:
+        return uuid.UUID(resource_id).bytes
+    except (AttributeError, TypeError, ValueError):
+        return hashlib.md5(str(resource_id).encode('utf-8')).digest()
+
+
+def _index(key, slots):
+    return struct.unpack_from('<I', key, 12)[0] % slots
+
+
+class LocalCache(object):
+    """Per process cache with the interface of SharedCache."""
+
+    def __init__(self, slots=65536, ttl=TTL):
+        self.slots = slots
+        self.ttl = ttl
+        self._values = {}
+        self._versions = [0] * slots
+        self._lock = threading.Lock()
+
+    def get(self, resource_id):
+        """Return (value or None, version to pass to put)."""
+        key = cache_key(resource_id)
+        index = _index(key, self.slots)
+        with self._lock:
+            entry = self._values.get(index)
+            version = self._versions[index]
+        if (entry is not None and entry[0] == key and
+                entry[2] > time.time()):
+            return entry[1], version
+        return None, version
+
+    def put(self, resource_id, value, version):
+        """Cache value unless invalidated since get returned version."""
+        if version is None or len(value) > VALUE_SIZE:
+            return False
+        key = cache_key(resource_id)
+        index = _index(key, self.slots)
+        with self._lock:
+            if self._versions[index] != version:
+                return False
+            self._values[index] = (key, value, time.time() + self.ttl)
+        return True
+
+    def invalidate(self, resource_id):
+        key = cache_key(resource_id)
+        index = _index(key, self.slots)
+        with self._lock:
+            self._versions[index] = (self._versions[index] + 1) & 0xffffffff
+            entry = self._values.get(index)
+            if entry is not None and entry[0] == key:
+                del self._values[index]
+
+
+class SharedCache(object):
+    """Cache in a memory mapped file, shared across processes."""
+
+    def __init__(self, path, slots=65536, ttl=TTL):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl
+        self._size = SLOT_SIZE * (slots + 1)
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._init_file()
+            self._map = mmap.mmap(self._fd, self._size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _init_file(self):
+        # the header slot is locked while the file is checked
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, 0)
+        try:
+            header = os.read(self._fd, _HEADER.size)
+            if (len(header) == _HEADER.size and
+                    _HEADER.unpack(header) == (MAGIC, self.slots) and
+                    os.fstat(self._fd).st_size == self._size):
+                return
+            LOG.info(_("SharedCache: initializing %s"), self.path)
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, self._size)
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.write(self._fd, _HEADER.pack(MAGIC, self.slots))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, 0)
+
+    def _offset(self, key):
+        return SLOT_SIZE * (_index(key, self.slots) + 1)
+
+    def get(self, resource_id):
+        """Return (value or None, version to pass to put).
+
+        The version is None if the slot stayed busy, nothing is cached
+        for such a read then.
+        """
+        key = cache_key(resource_id)
+        offset = self._offset(key)
+        start = offset + _SLOT.size
+        for attempt in range(READ_RETRIES):
+            seq, version, slot_key, expires, length = _SLOT.unpack_from(
+                self._map, offset)
+            value = self._map[start:start + min(length, VALUE_SIZE)]
+            if seq & 1 or _SEQ.unpack_from(self._map, offset)[0] != seq:
+                continue
+            if slot_key == key and length and expires > time.time():
+                return value, version
+            return None, version
+        return None, None
+
+    def put(self, resource_id, value, version):
+        """Cache value unless invalidated since get returned version."""
+        if version is None or len(value) > VALUE_SIZE:
+            return False
+        key = cache_key(resource_id)
+        offset = self._offset(key)
+        with self._locked(offset):
+            seq, current, slot_key, expires, length = _SLOT.unpack_from(
+                self._map, offset)
+            if current != version:
+                return False
+            self._write(offset, seq, version, key,
+                        int(time.time() + self.ttl), len(value), value)
+        return True
+
+    def invalidate(self, resource_id):
+        key = cache_key(resource_id)
+        offset = self._offset(key)
+        with self._locked(offset):
+            seq, version, slot_key, expires, length = _SLOT.unpack_from(
+                self._map, offset)
+            version = (version + 1) & 0xffffffff
+            if slot_key == key:
+                slot_key, length = _EMPTY_KEY, 0
+            self._write(offset, seq, version, slot_key, expires, length)
+
+    def _write(self, offset, seq, version, key, expires, length,
+               value=None):
+        _SEQ.pack_into(self._map, offset, (seq + 1) & 0xffffffff)
+        if value is not None:
+            start = offset + _SLOT.size
+            self._map[start:start + len(value)] = value
+        _SLOT.pack_into(self._map, offset, (seq + 1) & 0xffffffff, version,
+                        key, expires, length)
+        _SEQ.pack_into(self._map, offset, (seq + 2) & 0xffffffff)
+
+    def _locked(self, offset):
+        return _SlotLock(self._lock, self._fd, offset)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _SlotLock(object):
+    def __init__(self, lock, fd, offset):
+        self.lock = lock
+        self.fd = fd
+        self.offset = offset
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT_SIZE, self.offset)
+        except Exception:
+            self.lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT_SIZE, self.offset)
+        finally:
+            self.lock.release()
+
+
+def create_cache(path=None, slots=65536):
+    """Return a SharedCache of path, or a LocalCache if it is unusable."""
+    if path and fcntl is not None:
+        try:
+            return SharedCache(path, slots)
+        except (EnvironmentError, ValueError) as e:
+            LOG.warning(_("SharedCache: unable to map %(path)s, caching per "
+                          "process: %(e)s"), {'path': path, 'e': e})
+    return LocalCache(slots)
@@ -0,0 +1,132 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Single-flight suppression of duplicate controller requests.
+
+Keeps at most one request per key, normally (method, resource path), on
+the wire. How a caller that finds the key busy is handled depends on the
+mode:
+
+MODE_MERGE  -- the caller is merged into a trailing request that is sent
+               once the in-flight one completes, carrying the data of the
+               newest caller, or the data a merge function picks. A
+               caller arriving while the trailing request waits to be
+               sent is merged into it as well, so older data is never
+               sent after newer. Used for full document replacement
+               (PUT).
+MODE_JOIN   -- the caller shares the result of the in-flight request.
+               Used for idempotent reads and deletes.
+MODE_SERIAL -- the caller waits for the in-flight request and then sends
+               its own. Used for creates, which must never be dropped.
+"""
+
+import threading
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+MODE_MERGE = 'merge'
+MODE_JOIN = 'join'
+MODE_SERIAL = 'serial'
+
+
+class _Flight(object):
+    def __init__(self, data):
+        self.data = data
+        self.done = False
+        self.result = None
+        self.error = None
+        self.merged = 0
+
+
+class _Entry(object):
+    def __init__(self):
+        self.current = None
+        self.pending = None
+        self.users = 0
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._entries = {}
+
+    def call(self, key, func, data, mode=MODE_SERIAL, merge=None):
+        """Return func(data), sharing the wire with callers of the same key.
+
+        merge(trailing data, data) returns the data a trailing request
+        is sent with once data is merged into it, data by default.
+        Exceptions raised by func are re-raised in every caller that was
+        merged into or joined the failed request.
+        """
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            entry.users += 1
+            leader = True
+            if entry.current is not None and mode == MODE_JOIN:
+                flight = entry.current
+                leader = False
+            elif mode == MODE_MERGE and entry.pending is not None:
+                # still waiting to be sent, even if current just finished
+                flight = entry.pending
+                flight.data = data if merge is None else merge(flight.data,
+                                                               data)
+                flight.merged += 1
+                leader = False
+                LOG.debug(_("SingleFlight: merged request for %s into "
+                            "trailing request"), key)
+            elif mode == MODE_MERGE and entry.current is not None:
+                flight = entry.pending = _Flight(data)
+            else:
+                flight = _Flight(data)
+
+            if leader:
+                while entry.current is not None:
+                    self._cond.wait()
+                entry.current = flight
+                if entry.pending is flight:
+                    entry.pending = None
+                data = flight.data
+            else:
+                while not flight.done:
+                    self._cond.wait()
+                self._leave(key, entry)
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+
+        try:
+            flight.result = func(data)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._cond:
+                flight.done = True
+                entry.current = None
+                self._leave(key, entry)
+                self._cond.notify_all()
+        return flight.result
+
+    def _leave(self, key, entry):
+        entry.users -= 1
+        if entry.users == 0:
+            del self._entries[key]
@@ -0,0 +1,426 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Periodic reconciliation of Neutron networks with the sdn controller.
+
+Neutron resources carry no revision number, so every network document is
+fingerprinted and only documents whose fingerprint differs from the one
+last pushed are sent. The fingerprints survive restarts through the
+checkpoint, so the first cycle after a restart pushes only what changed
+while the server was down instead of every network.
+
+With workers set, a cycle is partitioned by tenant: workers threads
+each read, map and diff the networks of one tenant at a time and the
+changes are pushed by max_inflight threads, so neither the database
+reads nor the controller round trips are done one at a time.
+
+Networks the driver postcommits sent are noted with pushed(), the next
+cycle records them as it reads them rather than pushing them again.
+The records of what was pushed are shared with change feed
+reconciliation, every access to them holds the service lock. The feed
+cursors are checkpointed through the service too, together with the
+records changed since the last checkpoint.
+"""
+
+import collections
+import Queue
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei.clients import RemoteRestError
+from neutron.plugins.ml2.drivers.huawei import dispatcher
+from neutron.plugins.ml2.drivers.huawei import records
+
+
+LOG = logging.getLogger(__name__)
+
+# seconds between two progress reports of a partitioned cycle
+PROGRESS_INTERVAL = 10
+
+
+def _diff_tenant(documents, known):
+    """Diff documents against known {key: fingerprint} of their tenant.
+
+    Returns the (document, record, is_new) of the documents to push and
+    the keys of the networks to delete.
+    """
+    changes = []
+    for document in documents:
+        record = records.NetworkRecord.from_document(document)
+        fingerprint = known.pop(record.key, None)
+        if fingerprint != record.fingerprint:
+            changes.append((document, record, fingerprint is None))
+    return changes, list(known)
+
+
+class SyncService(object):
+    """Push networks changed since the last sync to the controller."""
+
+    def __init__(self, driver, checkpoint=None, checkpoint_interval=300,
+                 workers=0, max_inflight=8):
+        self.driver = driver
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.workers = workers
+        self.max_inflight = max(1, max_inflight)
+        # guards networks, cursors and progress
+        self._lock = threading.Lock()
+        self.progress = {}
+        self.last_sync = None
+        self.last_checkpoint = None
+        self.networks = records.RecordTable()
+        # change feed cursors, {feed name: cursor}
+        self.cursors = {}
+        # ids of the networks changed since the checkpoint was written
+        self._unsaved = set()
+        # ids of the networks postcommits sent since the cycle started
+        self._pushed = set()
+        if checkpoint is not None:
+            self.last_sync, self.networks = checkpoint.load()
+            self.cursors = checkpoint.load_cursors()
+            LOG.info(_("SyncService: loaded checkpoint of %(count)d "
+                       "networks, last sync at %(time)s"),
+                     {'count': len(self.networks), 'time': self.last_sync})
+
+    def _call(self, func, *args):
+        with dispatcher.priority(dispatcher.PRIORITY_BACKGROUND):
+            return func(*args)
+
+    def _recorded(self, network_id):
+        with self._lock:
+            return self.networks.get(network_id)
+
+    def _record(self, record):
+        with self._lock:
+            self._add(record)
+
+    def _forget(self, network_id):
+        with self._lock:
+            self._pop(network_id)
+
+    def pushed(self, network_id):
+        """Note that a postcommit sent network_id to the controller.
+
+        The next cycle records the network as it reads it instead of
+        pushing it again.
+        """
+        with self._lock:
+            self._pushed.add(network_id)
+
+    def deleted(self, network_id):
+        """Note that a postcommit deleted network_id on the controller."""
+        with self._lock:
+            self._pushed.discard(network_id)
+            if network_id in self.networks:
+                self._pop(network_id)
+
+    def _take_pushed(self):
+        with self._lock:
+            pushed, self._pushed = self._pushed, set()
+        return pushed
+
+    def _add(self, record):
+        self.networks.add(record)
+        if self.checkpoint is not None:
+            self._unsaved.add(records.key_to_id(record.key))
+
+    def _pop(self, network_id):
+        self.networks.pop(network_id)
+        if self.checkpoint is not None:
+            self._unsaved.add(network_id)
+
+    def _push(self, network, exists):
+        """Create network on the controller, or update it if it exists.
+
+        The other request is only sent when the controller disagrees:
+        409 on a create of a network it has, 404 on an update of one it
+        lost. Both are answered without failing over, any other error is
+        raised.
+        """
+        client = self.driver.client_sdn
+        tenant_id = network['tenant_id']
+        if exists:
+            resp = self._call(client.rest_update_network, tenant_id,
+                              network['id'], network, [404])
+            if resp[0] != 404:
+                return
+            # removed on the controller, create it again
+            self._call(client.rest_create_network, tenant_id, network)
+            return
+        resp = self._call(client.rest_create_network, tenant_id, network)
+        if resp[0] == 409:
+            # created before the checkpoint was taken, update it
+            self._call(client.rest_update_network, tenant_id,
+                       network['id'], network)
+
+    def synchronize(self):
+        """Run one reconciliation cycle, return the number of calls."""
+        if self.workers:
+            return self._synchronize_partitioned()
+        start = time.time()
+        seen = set()
+        calls = 0
+        failed = 0
+        # older than the postcommits during the cycle, which win
+        generation = self.driver.client_sdn.read_generation()
+        pushed = self._take_pushed()
+        for network in self.driver.iter_mapped_networks():
+            record = records.NetworkRecord.from_document(network)
+            seen.add(record.key)
+            known = self._recorded(network['id'])
+            if known is not None and known.fingerprint == record.fingerprint:
+                continue
+            if network['id'] in pushed:
+                # sent by a postcommit since the last cycle
+                self._record(record)
+                continue
+            calls += 1
+            try:
+                self._push(clients.with_generation(network, generation),
+                           known is not None)
+            except RemoteRestError:
+                # left unrecorded so that the next cycle retries it
+                failed += 1
+                continue
+            self._record(record)
+
+        client = self.driver.client_sdn
+        with self._lock:
+            gone = [r for r in self.networks if r.key not in seen]
+        for record in gone:
+            network_id = records.key_to_id(record.key)
+            calls += 1
+            try:
+                self._call(client.rest_delete_network, record.tenant_id,
+                           network_id)
+            except RemoteRestError:
+                failed += 1
+                continue
+            self._forget(network_id)
+
+        self._finish_cycle(start, calls, failed)
+        return calls
+
+    def reconcile(self, changes):
+        """Re-push the networks of changes reported by the controller.
+
+        changes are change feed entries, {'type': ..., 'id': ...,
+        'tenant_id': ...} with 'network_id' for subnets and ports. The
+        controller copy of these networks drifted from Neutron, so they
+        are pushed whatever their fingerprint. Returns the failed calls.
+        """
+        tenants = {}
+        for change in changes:
+            kind = change.get('type')
+            if kind == 'network':
+                network_id = change.get('id')
+            elif kind in ('subnet', 'port'):
+                network_id = change.get('network_id')
+            else:
+                network_id = None
+            if not network_id:
+                LOG.warning(_("SyncService: ignoring change %s"), change)
+                continue
+            tenants[network_id] = change.get('tenant_id')
+        if not tenants:
+            return 0
+
+        client = self.driver.client_sdn
+        failed = 0
+        generation = client.read_generation()
+        for network in self.driver.iter_mapped_networks(
+                network_ids=list(tenants)):
+            del tenants[network['id']]
+            document = clients.with_generation(network, generation)
+            try:
+                self._push(document, True)
+            except RemoteRestError:
+                failed += 1
+                continue
+            self._record(records.NetworkRecord.from_document(network))
+
+        # reported networks that no longer exist in Neutron
+        for network_id, tenant_id in tenants.items():
+            known = self._recorded(network_id)
+            if known is not None:
+                tenant_id = known.tenant_id
+            if tenant_id is None:
+                continue
+            try:
+                self._call(client.rest_delete_network, tenant_id, network_id)
+            except RemoteRestError:
+                failed += 1
+                continue
+            self._forget(network_id)
+        return failed
+
+    def _finish_cycle(self, start, calls, failed):
+        LOG.info(_("SyncService: %(calls)d controller calls, %(failed)d "
+                   "failed, %(count)d networks in sync, took %(time).2fs"),
+                 {'calls': calls, 'failed': failed,
+                  'count': len(self.networks), 'time': time.time() - start})
+        if not failed:
+            self.last_sync = start
+        self._save_checkpoint()
+
+    def _synchronize_partitioned(self):
+        start = time.time()
+        known = collections.defaultdict(dict)
+        with self._lock:
+            for record in self.networks:
+                known[record.tenant_id][record.key] = record.fingerprint
+        tenants = Queue.Queue()
+        for tenant_id in sorted(set(self.driver.get_network_tenant_ids()) |
+                                set(known)):
+            tenants.put(tenant_id)
+        with self._lock:
+            self.progress = {'tenants': tenants.qsize(), 'tenants_done': 0,
+                             'calls': 0, 'failed': 0}
+
+        # pushes are queued for max_inflight pushers, a full queue holds
+        # back the readers so memory stays bounded
+        changes = Queue.Queue(self.max_inflight * 2)
+        pushed = self._take_pushed()
+        pushers = [threading.Thread(target=self._pusher, args=(changes,))
+                   for i in range(self.max_inflight)]
+        readers = [threading.Thread(target=self._reader,
+                                    args=(tenants, known, pushed, changes))
+                   for i in range(self.workers)]
+        for thread in pushers + readers:
+            thread.daemon = True
+            thread.start()
+        try:
+            for reader in readers:
+                while reader.is_alive():
+                    reader.join(PROGRESS_INTERVAL)
+                    if reader.is_alive():
+                        self._report_progress()
+        finally:
+            for pusher in pushers:
+                changes.put(None)
+            for pusher in pushers:
+                pusher.join()
+        self._finish_cycle(start, self.progress['calls'],
+                           self.progress['failed'])
+        return self.progress['calls']
+
+    def _reader(self, tenants, known, pushed, changes):
+        """Read, map and diff the networks of tenants until none is left.
+
+        Each tenant is read with its own admin context, so the database
+        round trips of several tenants overlap.
+        """
+        while True:
+            try:
+                tenant_id = tenants.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                generation = self.driver.client_sdn.read_generation()
+                documents = list(self.driver.iter_mapped_networks(
+                    tenant_id=tenant_id))
+            except Exception:
+                LOG.exception(_("SyncService: reading the networks of "
+                                "tenant %s failed"), tenant_id)
+                with self._lock:
+                    self.progress['failed'] += 1
+                continue
+            pushes, deletes = _diff_tenant(documents,
+                                           known.pop(tenant_id, {}))
+            for document, record, is_new in pushes:
+                if document['id'] in pushed:
+                    # sent by a postcommit since the last cycle
+                    self._record(record)
+                    continue
+                changes.put(('push', tenant_id,
+                             clients.with_generation(document, generation),
+                             record, is_new))
+            for key in deletes:
+                changes.put(('delete', tenant_id, records.key_to_id(key),
+                             None, False))
+            with self._lock:
+                self.progress['tenants_done'] += 1
+
+    def _pusher(self, changes):
+        client = self.driver.client_sdn
+        while True:
+            change = changes.get()
+            if change is None:
+                return
+            action, tenant_id, payload, record, is_new = change
+            try:
+                if action == 'push':
+                    self._push(payload, not is_new)
+                else:
+                    self._call(client.rest_delete_network, tenant_id,
+                               payload)
+            except RemoteRestError:
+                failed = True
+            except Exception:
+                LOG.exception(_("SyncService: %s of a network failed"),
+                              action)
+                failed = True
+            else:
+                failed = False
+            with self._lock:
+                self.progress['calls'] += 1
+                if failed:
+                    self.progress['failed'] += 1
+                elif action == 'push':
+                    self._add(record)
+                else:
+                    self._pop(payload)
+
+    def _report_progress(self):
+        with self._lock:
+            progress = dict(self.progress)
+        LOG.info(_("SyncService: %(tenants_done)d of %(tenants)d tenants "
+                   "diffed, %(calls)d controller calls, %(failed)d failed"),
+                 progress)
+
+    def _save_checkpoint(self, force=False):
+        if self.checkpoint is None:
+            return
+        now = time.time()
+        if (not force and self.last_checkpoint is not None and
+                now - self.last_checkpoint < self.checkpoint_interval):
+            return
+        with self._lock:
+            saved = self.checkpoint.save(self.networks, self.last_sync,
+                                         self.cursors)
+            if saved:
+                self._unsaved.clear()
+        if saved:
+            self.last_checkpoint = now
+
+    def save_cursor(self, name, cursor):
+        """Checkpoint change feed name as reconciled up to cursor.
+
+        The networks changed since the last checkpoint are written in
+        the same transaction, so after a crash the cursor does not skip
+        changes whose records were lost.
+        """
+        with self._lock:
+            self.cursors[name] = cursor
+            if self.checkpoint is None:
+                return
+            if self.checkpoint.update(self.networks, self._unsaved,
+                                      self.cursors):
+                self._unsaved.clear()
+
+    def stop(self):
+        self._save_checkpoint(force=True)
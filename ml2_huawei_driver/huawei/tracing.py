@@ -0,0 +1,163 @@
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request tracing across the driver and the sdn controller.
+
+A trace is opened per driver operation with the Neutron request ID,
+which ServerProxy sends to the controller as X-Request-ID so both sides
+can be correlated. While a trace is open in a thread, span() records
+where its time goes (lock and dispatch waits, database, HTTP). Finished
+traces are handed to the registered exporters; nothing is recorded when
+there are none, only the request ID is propagated.
+"""
+
+import collections
+import contextlib
+import heapq
+import threading
+import time
+import uuid
+
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+Span = collections.namedtuple('Span', ['name', 'start', 'duration', 'depth',
+                                       'tags'])
+
+_state = threading.local()
+_exporters = []
+
+
+class Trace(object):
+    """Spans of one driver operation."""
+
+    def __init__(self, request_id, name):
+        self.request_id = request_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.spans = []
+        self.depth = 0
+
+    def as_dict(self):
+        return {'request_id': self.request_id, 'name': self.name,
+                'start': self.start, 'duration': self.duration,
+                'spans': [dict(s._asdict()) for s in self.spans]}
+
+
+class InMemoryExporter(object):
+    """Keep the last capacity traces for inspection."""
+
+    def __init__(self, capacity=1000):
+        self.traces = collections.deque(maxlen=capacity)
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+    def slowest(self, count=10):
+        return heapq.nlargest(count, list(self.traces),
+                              key=lambda t: t.duration)
+
+    def find(self, request_id):
+        return [t for t in list(self.traces) if t.request_id == request_id]
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def generate_request_id():
+    return 'req-' + str(uuid.uuid4())
+
+
+def current_request_id():
+    """Return the request ID of the operation run by this thread."""
+    return getattr(_state, 'request_id', None)
+
+
+@contextlib.contextmanager
+def trace(name, request_id=None):
+    """Run the block as operation name of request request_id.
+
+    Nested traces join the outer one.
+    """
+    if current_request_id() is not None:
+        with span(name):
+            yield
+        return
+    _state.request_id = request_id or generate_request_id()
+    current = Trace(_state.request_id, name) if _exporters else None
+    _state.trace = current
+    try:
+        yield
+    finally:
+        _state.request_id = None
+        _state.trace = None
+        if current is not None:
+            current.duration = time.time() - current.start
+            for exporter in list(_exporters):
+                exporter.export(current)
+
+
+@contextlib.contextmanager
+def span(name, **tags):
+    """Time the block as a span of the trace open in this thread."""
+    current = getattr(_state, 'trace', None)
+    if current is None:
+        yield tags
+        return
+    start = time.time()
+    current.depth += 1
+    try:
+        yield tags
+    finally:
+        current.depth -= 1
+        current.spans.append(Span(name, start, time.time() - start,
+                                  current.depth, tags))
+
+
+def add_span(name, start, duration, **tags):
+    """Record an already timed span in the trace open in this thread."""
+    current = getattr(_state, 'trace', None)
+    if current is not None:
+        current.spans.append(Span(name, start, duration, current.depth,
+                                  tags))
+
+
+class TracedLock(object):
+    """Lock whose acquisition wait is recorded as a span."""
+
+    def __init__(self, name, lock=None):
+        self.name = name
+        self._lock = lock or threading.Lock()
+
+    def acquire(self, blocking=True):
+        with span(self.name):
+            return self._lock.acquire(blocking)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
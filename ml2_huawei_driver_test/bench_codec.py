@@ -0,0 +1,128 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encode and decode throughput of the wire codecs.
+
+Times every available codec on controller documents mapped the way
+HuaweiDriver maps them: a port, a network with 4 and one with 256
+subnets, and a bulk payload of 500 networks as a sync would send.
+Prints the encoded size, the time per call and the throughput of both
+directions as JSON:
+
+    python bench_codec.py --repeat 5 --min-time 0.2
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from neutron.plugins.ml2.drivers.huawei import codec
+from neutron.plugins.ml2.drivers.huawei import mechanism_huawei as huawei
+
+
+def _subnet(network_id, index):
+    return {'id': '9c3f%04x-5e1d-4c3a-8a5b-2f0d%08x' % (index, index),
+            'name': 'subnet-%d' % index,
+            'tenant_id': 'b8a5e1f6c3d24e9f8a7b6c5d4e3f2a1b',
+            'network_id': network_id,
+            'ip_version': 4,
+            'cidr': '10.%d.%d.0/24' % (index // 256, index % 256),
+            'allocation_pools': [{'start': '10.0.0.2',
+                                  'end': '10.0.0.254'}],
+            'gateway_ip': '10.%d.%d.1' % (index // 256, index % 256),
+            'enable_dhcp': True,
+            'dns_nameservers': ['8.8.8.8', '8.8.4.4'],
+            'host_routes': [],
+            'shared': False,
+            'admin_state_up': True}
+
+
+def mapped_network(index, subnet_count):
+    network_id = '4e8e5957-649f-477b-9e5b-f1f7%08x' % index
+    network = {'id': network_id,
+               'name': 'network-%d' % index,
+               'tenant_id': 'b8a5e1f6c3d24e9f8a7b6c5d4e3f2a1b',
+               'admin_state_up': True, 'status': 'ACTIVE', 'shared': False,
+               'provider:network_type': 'vxlan',
+               'provider:segmentation_id': 1000 + index,
+               'provider:physical_network': None}
+    subnets = [huawei.HuaweiDriver._set_state_and_status(
+        _subnet(network_id, i)) for i in range(subnet_count)]
+    return huawei.HuaweiDriver._add_subnets_and_external(
+        huawei.HuaweiDriver._set_state_and_status(network), subnets, False)
+
+
+def port():
+    return {'id': '7a1c2b3d-4e5f-4a6b-8c7d-9e0f1a2b3c4d',
+            'name': '', 'tenant_id': 'b8a5e1f6c3d24e9f8a7b6c5d4e3f2a1b',
+            'network_id': '4e8e5957-649f-477b-9e5b-f1f700000000',
+            'mac_address': 'fa:16:3e:4c:2c:30', 'state': 'UP',
+            'fixed_ips': [{'subnet_id': '9c3f0000-5e1d-4c3a-8a5b-'
+                                        '2f0d00000000',
+                           'ip_address': '10.0.0.5'}],
+            'device_id': 'e2f4c6a8-0b1d-4e3f-9a5b-7c9d1e3f5a7b',
+            'device_owner': 'compute:nova',
+            'binding:host_id': 'compute-17'}
+
+
+def documents():
+    return [
+        ('port', {'port': port()}),
+        ('network/4', {'network': mapped_network(0, 4)}),
+        ('network/256', {'network': mapped_network(0, 256)}),
+        ('sync/500', {'networks': [mapped_network(i, 4)
+                                   for i in range(500)]}),
+    ]
+
+
+def _time(func, repeat, min_time):
+    number = 1
+    while timeit.timeit(func, number=number) < min_time:
+        number *= 2
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run(repeat, min_time):
+    results = {}
+    for doc_name, document in documents():
+        for name in codec.available():
+            wire = codec.get_codec(name)
+            body = wire.encode(document)
+            encode = _time(lambda: wire.encode(document), repeat, min_time)
+            decode = _time(lambda: wire.decode(body), repeat, min_time)
+            mbytes = len(body) / 1e6
+            results['%s/%s' % (doc_name, name)] = {
+                'bytes': len(body),
+                'encode_usec': round(encode * 1e6, 2),
+                'decode_usec': round(decode * 1e6, 2),
+                'encode_mb_s': round(mbytes / encode, 1),
+                'decode_mb_s': round(mbytes / decode, 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per timing run')
+    args = parser.parse_args()
+    results = run(args.repeat, args.min_time)
+    sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
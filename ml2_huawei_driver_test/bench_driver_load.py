@@ -0,0 +1,342 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end load benchmark of HuaweiDriver against a fake controller.
+
+Drives the real postcommits of HuaweiDriver, SdnClient and ServerProxy
+from concurrent threads against FakeController, with Neutron state in a
+throw-away sqlite database. Scenarios:
+
+    vm_boot       port create + plug storms on a set of tenant networks
+    subnet_burst  subnet creates triggering full network updates
+    teardown      per tenant port, subnet and network deletion, in the
+                  order ML2 deletes a network
+    onboarding    a template creating the networks of a new tenant, each
+                  with one subnet, as concurrent requests
+
+Scenarios run one after the other, or with --mixed interleaved into a
+single run, as the load of a busy cloud arrives; operations on networks
+a concurrent teardown removed then count as errors. Results are printed
+as JSON (throughput, p50/p95/p99 latency per scenario, and per
+operation) for regression tracking:
+
+    python bench_driver_load.py --threads 16 --ops 2000 --latency 0.002
+    python bench_driver_load.py --mixed --scenarios vm_boot,teardown
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from oslo.config import cfg
+
+from neutron.api.v2 import attributes
+from neutron import context as qcontext
+from neutron.db import api as db_api
+from neutron.plugins.ml2.drivers.huawei import exceptions as ml2_exc
+from neutron.plugins.ml2.drivers.huawei import mechanism_huawei as huawei
+
+import fake_controller
+
+
+class ResourceContext(object):
+    """Minimal ML2 driver context, only what HuaweiDriver looks at."""
+
+    def __init__(self, current, original=None, plugin_context=None):
+        self.current = current
+        self.original = original if original is not None else current
+        self._plugin_context = plugin_context
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Workload(object):
+    """Neutron side state and job generators for the scenarios."""
+
+    def __init__(self, driver, tenants, networks_per_tenant):
+        self.driver = driver
+        self.plugin = driver.db_base_plugin_v2
+        self.context = qcontext.get_admin_context()
+        self.tenants = {}
+        for t in range(tenants):
+            tenant_id = 'tenant-%d' % t
+            self.tenants[tenant_id] = [
+                self.create_network(tenant_id, 'net-%d' % n)
+                for n in range(networks_per_tenant)]
+        self.ports = {}
+        self._lock = threading.Lock()
+        self._cidr = 0
+
+    def create_network(self, tenant_id, name):
+        return self.plugin.create_network(
+            self.context, {'network': {'name': name,
+                                       'admin_state_up': True,
+                                       'shared': False,
+                                       'tenant_id': tenant_id}})
+
+    def create_subnet(self, network):
+        with self._lock:
+            self._cidr += 1
+            cidr = '10.%d.%d.0/24' % (self._cidr // 256, self._cidr % 256)
+        return self.plugin.create_subnet(
+            self.context, {'subnet': {
+                'name': 'subnet', 'network_id': network['id'],
+                'tenant_id': network['tenant_id'], 'cidr': cidr,
+                'ip_version': 4, 'enable_dhcp': False,
+                'gateway_ip': attributes.ATTR_NOT_SPECIFIED,
+                'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+                'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+                'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+
+    def port_for(self, network):
+        port = {'id': str(uuid.uuid4()),
+                'name': '',
+                'network_id': network['id'],
+                'tenant_id': network['tenant_id'],
+                'device_id': str(uuid.uuid4()),
+                'device_owner': 'compute:nova',
+                'mac_address': 'fa:16:3e:00:00:01',
+                'admin_state_up': True,
+                'binding:host_id': 'compute-1'}
+        with self._lock:
+            self.ports.setdefault(network['id'], []).append(port)
+        return port
+
+    def all_networks(self):
+        for networks in self.tenants.values():
+            for network in networks:
+                yield network
+
+    def vm_boot_jobs(self, count):
+        networks = list(self.all_networks())
+        for network in networks:
+            self.driver.create_network_postcommit(ResourceContext(network))
+        for i in range(count):
+            network = networks[i % len(networks)]
+            port = self.port_for(network)
+            yield [('create_port', self.driver.create_port_postcommit,
+                    ResourceContext(port))]
+
+    def subnet_burst_jobs(self, count):
+        networks = list(self.all_networks())
+        for i in range(count):
+            network = networks[i % len(networks)]
+            subnet = self.create_subnet(network)
+            yield [('create_subnet', self.driver.create_subnet_postcommit,
+                    ResourceContext(subnet))]
+
+    def teardown_jobs(self, ports_per_network):
+        for tenant_id, networks in self.tenants.items():
+            steps = []
+            for network in networks:
+                if not self.ports.get(network['id']):
+                    self.driver.create_network_postcommit(
+                        ResourceContext(network))
+                    for i in range(ports_per_network):
+                        self.driver.create_port_postcommit(
+                            ResourceContext(self.port_for(network)))
+                for port in self.ports.pop(network['id'], []):
+                    steps.append(('delete_port',
+                                  self.driver.delete_port_postcommit,
+                                  ResourceContext(port)))
+                network = self.plugin.get_network(self.context,
+                                                  network['id'])
+                for subnet_id in network['subnets']:
+                    steps.append(('delete_subnet',
+                                  self._delete_subnet, subnet_id))
+                steps.append(('delete_network',
+                              self.driver.delete_network_postcommit,
+                              ResourceContext(network)))
+            yield steps
+
+    def onboarding_jobs(self, count, networks_per_tenant):
+        for t in range(count):
+            tenant_id = 'onboarded-%d' % t
+            for n in range(networks_per_tenant):
+                network = self.create_network(tenant_id, 'net-%d' % n)
+                # the jobs of a tenant run side by side, as the requests
+                # of a template do; the subnet is only created once the
+                # postcommit of its network returned
+                yield [('create_network',
+                        self.driver.create_network_postcommit,
+                        ResourceContext(network)),
+                       ('create_subnet', self._create_subnet, network)]
+
+    def _create_subnet(self, network):
+        subnet = self.create_subnet(network)
+        self.driver.create_subnet_postcommit(ResourceContext(subnet))
+
+    def _delete_subnet(self, subnet_id):
+        subnet = self.plugin.get_subnet(self.context, subnet_id)
+        self.plugin.delete_subnet(self.context, subnet_id)
+        self.driver.delete_subnet_postcommit(ResourceContext(subnet))
+
+
+def interleave(job_lists):
+    """Return the jobs of job_lists taken in turn from each."""
+    job_lists = [list(jobs) for jobs in job_lists]
+    jobs = []
+    for i in range(max(len(j) for j in job_lists)):
+        jobs.extend(j[i] for j in job_lists if i < len(j))
+    return jobs
+
+
+def run_jobs(jobs, threads):
+    """Run job step lists from a pool of threads, timing every step."""
+    jobs = list(jobs)
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    index = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if index[0] >= len(jobs):
+                    return
+                job = jobs[index[0]]
+                index[0] += 1
+            for name, func, arg in job:
+                start = time.time()
+                try:
+                    func(arg)
+                    failed = False
+                except ml2_exc.MechanismDriverError:
+                    failed = True
+                elapsed = time.time() - start
+                with lock:
+                    latencies.setdefault(name, []).append(elapsed)
+                    if failed:
+                        errors[name] = errors.get(name, 0) + 1
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+
+    def summary(values, failed):
+        values = sorted(values)
+        return {'ops': len(values),
+                'errors': failed,
+                'throughput_ops_s': round(len(values) / elapsed, 2),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000 if values else 0, 3)}
+
+    result = {'seconds': round(elapsed, 3),
+              'operations': dict((name, summary(values, errors.get(name, 0)))
+                                 for name, values in latencies.items())}
+    result['total'] = summary(sum(latencies.values(), []),
+                              sum(errors.values()))
+    return result
+
+
+def setup_driver(workdir, controller_port):
+    cfg.CONF.set_override('connection',
+                          'sqlite:///%s' % os.path.join(workdir, 'bench.db'),
+                          'database')
+    db_api.configure_db()
+    cfg.CONF.set_override('nos_host', '127.0.0.1', 'ml2_Huawei')
+    cfg.CONF.set_override('nos_port', controller_port, 'ml2_Huawei')
+    driver = huawei.HuaweiDriver()
+    driver.initialize()
+    return driver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=500,
+                        help='operations per scenario')
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--networks-per-tenant', type=int, default=2)
+    parser.add_argument('--ports-per-network', type=int, default=10,
+                        help='ports deleted per network on teardown')
+    parser.add_argument('--scenarios', default='vm_boot,subnet_burst,teardown')
+    parser.add_argument('--mixed', action='store_true',
+                        help='interleave the scenarios into one run')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='controller latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--capacity', type=int, default=0,
+                        help='max concurrent controller requests, 0=inf')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    controller = fake_controller.FakeController(
+        latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, capacity=args.capacity, seed=1)
+    port = controller.start()
+    workdir = tempfile.mkdtemp()
+    try:
+        driver = setup_driver(workdir, port)
+        workload = Workload(driver, args.tenants, args.networks_per_tenant)
+        results = {'config': vars(args), 'scenarios': {}}
+
+        def jobs_for(scenario):
+            if scenario == 'vm_boot':
+                return workload.vm_boot_jobs(args.ops)
+            elif scenario == 'subnet_burst':
+                return workload.subnet_burst_jobs(args.ops)
+            elif scenario == 'teardown':
+                return workload.teardown_jobs(args.ports_per_network)
+            elif scenario == 'onboarding':
+                return workload.onboarding_jobs(
+                    max(1, args.ops // (2 * args.networks_per_tenant)),
+                    args.networks_per_tenant)
+            parser.error('unknown scenario %s' % scenario)
+
+        scenarios = args.scenarios.split(',')
+        if args.mixed:
+            runs = [('mixed', interleave(jobs_for(s) for s in scenarios))]
+        else:
+            runs = ((s, jobs_for(s)) for s in scenarios)
+        for scenario, jobs in runs:
+            controller.stats.clear()
+            result = run_jobs(jobs, args.threads)
+            result['controller'] = dict(controller.stats)
+            result['dispatcher'] = driver.dispatcher.get_metrics()
+            results['scenarios'][scenario] = result
+    finally:
+        controller.stop()
+        shutil.rmtree(workdir)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Floating IP association cost on a large external network.
+
+Allocates --floatingips floating IPs on one external network of a fake
+controller, then associates --associations of them from concurrent
+threads, the way an autoscaling group scales out, in three modes:
+
+    network   the external network document with all its floating IPs
+              is sent on every association
+    delta     one request per associated floating IP
+    batched   the associations are batched per network by
+              HuaweiL3RouterPlugin
+
+Prints throughput, latency percentiles, controller requests and bytes
+sent per association of each mode as JSON:
+
+    python bench_floatingips.py --floatingips 5000 --associations 1000 \\
+        --threads 32 --latency 0.005
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+from neutron.plugins.ml2.drivers.huawei import batching
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import l3_router_huawei
+
+import fake_controller
+
+
+TENANT_ID = 'admin'
+NETWORK_ID = 'ext-net'
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def floatingip(index, port_id=None):
+    return {'id': 'fip-%d' % index,
+            'tenant_id': 'tenant-%d' % (index % 16),
+            'floating_network_id': NETWORK_ID,
+            'floating_ip_address': '172.%d.%d.%d' % (
+                16 + index // 65536, index // 256 % 256, index % 256),
+            'port_id': port_id,
+            'fixed_ip_address': port_id and '10.0.%d.%d' % (
+                index // 256 % 256, index % 256),
+            'router_id': port_id and 'router-1'}
+
+
+def make_plugin(client, window, size):
+    # only the controller side of the plugin is exercised, no database
+    plugin = l3_router_huawei.HuaweiL3RouterPlugin.__new__(
+        l3_router_huawei.HuaweiL3RouterPlugin)
+    plugin.client_sdn = client
+    plugin.floatingip_batches = batching.BatchCollector(window, size)
+    plugin._network_tenants = {NETWORK_ID: TENANT_ID}
+    return plugin
+
+
+def populate(client, count):
+    client.rest_create_network(TENANT_ID, {'id': NETWORK_ID,
+                                           'name': 'public'})
+    for start in range(0, count, 500):
+        client.rest_update_floatingips(
+            TENANT_ID, NETWORK_ID,
+            [floatingip(i) for i in range(start, min(count, start + 500))])
+
+
+def network_mode(client, floatingips):
+    # the whole network document, guarded like _send_update_network
+    lock = threading.Lock()
+
+    def associate(index, port_id):
+        with lock:
+            floatingips[index] = floatingip(index, port_id)
+            client.rest_update_network(
+                TENANT_ID, NETWORK_ID,
+                {'id': NETWORK_ID, 'name': 'public',
+                 'floatingips': list(floatingips)})
+    return associate
+
+
+def count_associated(store):
+    network = store.get(clients.NETWORKS_PATH % (TENANT_ID, NETWORK_ID), {})
+    docs = [doc for path, doc in store.items() if '/floatingips/' in path]
+    docs.extend(network.get('floatingips', ()))
+    return len([doc for doc in docs if doc.get('port_id')])
+
+
+def run_mode(associations, threads, associate):
+    latencies = []
+    lock = threading.Lock()
+    index = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if index[0] >= associations:
+                    return
+                i = index[0]
+                index[0] += 1
+            start = time.time()
+            associate(i, 'port-%d' % i)
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return {'associations': len(latencies),
+            'seconds': round(elapsed, 3),
+            'throughput_ops_s': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--floatingips', type=int, default=5000,
+                        help='floating IPs on the external network')
+    parser.add_argument('--associations', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='controller latency in seconds')
+    parser.add_argument('--window', type=float, default=0,
+                        help='floatingip_batch_window')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='floatingip_batch_size')
+    parser.add_argument('--modes', default='network,delta,batched',
+                        help='comma separated modes to run')
+    args = parser.parse_args()
+    args.associations = min(args.associations, args.floatingips)
+
+    controller = fake_controller.FakeController(latency=args.latency)
+    port = controller.start()
+    results = {'config': vars(args), 'modes': {}}
+    try:
+        client = clients.SdnClient('127.0.0.1', port, neutron_id='bench')
+        plugin = make_plugin(client, args.window, args.batch_size)
+        for name in args.modes.split(','):
+            controller.store.clear()
+            controller.generations.clear()
+            populate(client, args.floatingips)
+            if name == 'network':
+                associate = network_mode(
+                    client, [floatingip(i) for i in range(args.floatingips)])
+            elif name == 'delta':
+                associate = lambda i, port_id: client.rest_update_floatingip(
+                    TENANT_ID, NETWORK_ID, floatingip(i, port_id))
+            else:
+                associate = lambda i, port_id: plugin._push_floatingip(
+                    None, floatingip(i, port_id))
+            controller.stats.clear()
+            result = run_mode(args.associations, args.threads, associate)
+            result['controller_requests'] = controller.stats['requests']
+            result['bytes_per_association'] = (
+                controller.stats['request_bytes'] // args.associations)
+            result['associated'] = count_associated(controller.store)
+            results['modes'][name] = result
+    finally:
+        controller.stop()
+    sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
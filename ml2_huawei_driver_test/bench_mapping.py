@@ -0,0 +1,237 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks of the network document mapping hot path.
+
+Times _map_state_and_status, _get_all_subnets_json_for_network and
+_get_mapped_network_with_subnets at 1, 100 and 1000 subnets per network.
+The database is replaced by in-memory subnet rows, so only the mapping
+itself is measured. The objects a call creates are counted from the
+garbage collector, along with their sys.getsizeof bytes, which works on
+Python 2.7 as well. Where tracemalloc is available the allocated blocks
+and bytes kept per call and the transient peak are reported too.
+
+    python bench_mapping.py --save-baseline    # record bench_mapping.json
+    python bench_mapping.py                    # compare against it
+
+The committed baseline records the Python version it was taken with.
+Timings only compare on the same machine and runtime; the object counts
+compare across machines.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+
+from neutron.plugins.ml2.drivers.huawei import mechanism_huawei as huawei
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'bench_mapping.json')
+SUBNET_COUNTS = (1, 100, 1000)
+
+
+class _Session(object):
+    @contextlib.contextmanager
+    def begin(self, subtransactions=False):
+        yield
+
+
+class _Context(object):
+    session = _Session()
+
+
+def _subnet_row(network_id, index):
+    return {'id': 'subnet-%d' % index,
+            'name': 'subnet-%d' % index,
+            'tenant_id': 'tenant-1',
+            'network_id': network_id,
+            'ip_version': 4,
+            'cidr': '10.%d.%d.0/24' % (index // 256, index % 256),
+            'allocation_pools': [{'first_ip': '10.0.0.2',
+                                  'last_ip': '10.0.0.254'}],
+            'gateway_ip': '10.0.0.1' if index else None,
+            'enable_dhcp': True,
+            'dns_nameservers': [{'address': '8.8.8.8'}],
+            'routes': [],
+            'shared': False}
+
+
+def _network(network_id):
+    return {'id': network_id, 'name': 'net', 'tenant_id': 'tenant-1',
+            'admin_state_up': True, 'status': 'ACTIVE', 'shared': False,
+            'subnets': [], 'provider:network_type': 'vxlan'}
+
+
+def _driver(subnet_count):
+    driver = huawei.HuaweiDriver()
+    rows = [_subnet_row('net-1', i) for i in range(subnet_count)]
+    driver.db_base_plugin_v2._get_subnets_by_network = \
+        lambda context, net_id: rows
+    driver.external_net_db._network_is_external = \
+        lambda context, net_id: False
+    return driver
+
+
+def _cases(subnet_count):
+    driver = _driver(subnet_count)
+    context = _Context()
+    network = _network('net-1')
+    return [
+        ('map_state_and_status',
+         lambda: driver._map_state_and_status(network)),
+        ('subnets_json',
+         lambda: driver._get_all_subnets_json_for_network('net-1', context)),
+        ('mapped_network',
+         lambda: driver._get_mapped_network_with_subnets(network, context)),
+    ]
+
+
+def _objects(func, calls):
+    """Return the objects, and their bytes, created and kept per call.
+
+    Only objects tracked by the garbage collector are seen: containers
+    such as the dicts and lists of the documents, not the strings in
+    them.
+    """
+    gc.collect()
+    before = gc.get_objects()
+    known = set(id(obj) for obj in before)
+    known.add(id(before))
+    keep = []
+    for i in range(calls):
+        keep.append(func())
+    gc.collect()
+    created = [obj for obj in gc.get_objects()
+               if id(obj) not in known and
+               obj is not keep and obj is not known]
+    count = len(created)
+    size = sum(sys.getsizeof(obj) for obj in created)
+    del created, keep, before
+    return {'objects_per_call': round(float(count) / calls, 1),
+            'object_bytes_per_call': int(size / calls)}
+
+
+def _allocations(func, calls):
+    """Return blocks and bytes kept per call and the transient peak."""
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    keep = []
+    before = tracemalloc.take_snapshot()
+    for i in range(calls):
+        keep.append(func())
+    after = tracemalloc.take_snapshot()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    del keep
+    tracemalloc.stop()
+    return {'blocks_per_call': round(float(blocks) / calls, 1),
+            'bytes_per_call': int(size / calls),
+            'peak_bytes': peak}
+
+
+def run(repeat, min_time):
+    results = {}
+    for subnet_count in SUBNET_COUNTS:
+        for name, func in _cases(subnet_count):
+            number = 1
+            while timeit.timeit(func, number=number) < min_time:
+                number *= 2
+            best = min(timeit.repeat(func, number=number, repeat=repeat))
+            key = '%s/%d' % (name, subnet_count)
+            results[key] = {'usec_per_call': round(best / number * 1e6, 3)}
+            results[key].update(_objects(func, min(number, 50)))
+            allocations = _allocations(func, min(number, 50))
+            if allocations:
+                results[key].update(allocations)
+    return results
+
+
+def compare(results, baseline, tolerance, time_tolerance):
+    """Return a list of (case, metric, baseline, current) regressions.
+
+    Timings vary with the load of the machine far more than object and
+    allocation counts, so they are allowed time_tolerance instead.
+    """
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            base = baseline.get(key, {}).get(metric)
+            allowed = time_tolerance if metric == 'usec_per_call' \
+                else tolerance
+            if base and value > base * (1 + allowed):
+                regressions.append((key, metric, base, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per timing run')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression of counts')
+    parser.add_argument('--time-tolerance', type=float, default=1.0,
+                        help='allowed relative regression of timings')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.min_time)
+    sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+    python = platform.python_version()
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': python, 'results': results}, f,
+                      indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['python'].split('.')[:2] != python.split('.')[:2]:
+        sys.stderr.write('baseline taken with Python %s, running %s: '
+                         'compare with care\n' % (baseline['python'],
+                                                   python))
+    regressions = compare(results, baseline['results'], args.tolerance,
+                          args.time_tolerance)
+    for key, metric, base, value in regressions:
+        sys.stderr.write('REGRESSION %s %s: %s -> %s\n'
+                         % (key, metric, base, value))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory benchmark of driver side resource state.
+
+Builds state for --networks networks and --ports ports, spread over
+--tenants tenants and --hosts hosts, in two ways: as a dict of Neutron
+resource dicts keyed by ID, and as a RecordTable of compact records.
+The result is the bytes per resource each keeps once the resource dicts
+it was built from are released. Memory is measured with tracemalloc
+when it is available, otherwise by walking the objects with getsizeof:
+
+    python bench_records.py --ports 100000 --networks 10000
+"""
+
+import argparse
+import gc
+import json
+import sys
+import uuid
+
+from neutron.plugins.ml2.drivers.huawei import records
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _network(index, tenant_id):
+    return {'id': str(uuid.uuid4()), 'name': 'net-%d' % index,
+            'tenant_id': tenant_id, 'state': 'UP', 'shared': False,
+            'router:external': False, 'subnets': [],
+            'provider:network_type': 'vxlan',
+            'provider:segmentation_id': 1000 + index,
+            'provider:physical_network': None}
+
+
+def _subnet(index, network):
+    return {'id': str(uuid.uuid4()), 'name': 'subnet-%d' % index,
+            'tenant_id': network['tenant_id'],
+            'network_id': network['id'], 'ip_version': 4,
+            'cidr': '10.%d.%d.0/24' % (index // 256 % 256, index % 256),
+            'gateway_ip': '10.%d.%d.1' % (index // 256 % 256, index % 256),
+            'allocation_pools': [], 'dns_nameservers': [],
+            'host_routes': [], 'enable_dhcp': True, 'shared': False,
+            'state': 'UP'}
+
+
+def _port(index, network, host):
+    return {'id': str(uuid.uuid4()), 'name': '',
+            'network_id': network['id'], 'tenant_id': network['tenant_id'],
+            'device_id': str(uuid.uuid4()), 'device_owner': 'compute:nova',
+            'mac_address': 'fa:16:3e:%02x:%02x:%02x' % (
+                index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff),
+            'fixed_ips': [{'subnet_id': network['subnets'][0],
+                           'ip_address': '10.0.%d.%d' % (index // 250 % 256,
+                                                         index % 250 + 2)}],
+            'admin_state_up': True, 'status': 'ACTIVE',
+            'binding:host_id': host, 'binding:vif_type': 'ovs'}
+
+
+def generate(networks, ports, tenants, hosts):
+    """Return network, subnet and port dicts, one subnet per network."""
+    # tenant and host names arrive as separate strings in every resource
+    network_dicts = [_network(i, 'tenant-%d' % (i % tenants))
+                     for i in range(networks)]
+    subnet_dicts = []
+    for i, network in enumerate(network_dicts):
+        subnet = _subnet(i, network)
+        network['subnets'] = [subnet['id']]
+        subnet_dicts.append(subnet)
+    port_dicts = [_port(i, network_dicts[i % networks],
+                        'compute-%d' % (i % hosts))
+                  for i in range(ports)]
+    return network_dicts, subnet_dicts, port_dicts
+
+
+def build_dicts(network_dicts, subnet_dicts, port_dicts):
+    return {'networks': dict((n['id'], dict(n)) for n in network_dicts),
+            'subnets': dict((s['id'], dict(s)) for s in subnet_dicts),
+            'ports': dict((p['id'], dict(p)) for p in port_dicts),
+            'attachments': dict((p['id'], {'port_id': p['id'],
+                                           'device_id': p['device_id'],
+                                           'host_id': p['binding:host_id'],
+                                           'segmentation_id': None})
+                                for p in port_dicts)}
+
+
+def build_records(network_dicts, subnet_dicts, port_dicts):
+    tables = {'networks': records.RecordTable(),
+              'subnets': records.RecordTable(),
+              'ports': records.RecordTable(),
+              'attachments': records.RecordTable('port_key')}
+    for network in network_dicts:
+        tables['networks'].add(records.NetworkRecord.from_document(network))
+    for subnet in subnet_dicts:
+        tables['subnets'].add(records.SubnetRecord.from_document(subnet))
+    for port in port_dicts:
+        tables['ports'].add(records.PortRecord.from_document(port))
+        tables['attachments'].add(records.AttachmentRecord.from_port(port))
+    return tables
+
+
+def _deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    elif isinstance(obj, records.RecordTable):
+        size += _deep_size(obj._records, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            size += _deep_size(getattr(obj, name), seen)
+    return size
+
+
+def measure(build, args):
+    """Return the bytes retained by build() once its sources are gone."""
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+    sources = generate(args.networks, args.ports, args.tenants, args.hosts)
+    state = build(*sources)
+    del sources
+    gc.collect()
+    if tracemalloc is not None:
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return size
+    return _deep_size(state, set())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--networks', type=int, default=10000)
+    parser.add_argument('--ports', type=int, default=100000)
+    parser.add_argument('--tenants', type=int, default=1000)
+    parser.add_argument('--hosts', type=int, default=500)
+    args = parser.parse_args()
+
+    resources = args.networks * 2 + args.ports * 2
+    results = {'config': vars(args),
+               'method': 'tracemalloc' if tracemalloc else 'getsizeof'}
+    for name, build in (('dicts', build_dicts), ('records', build_records)):
+        size = measure(build, args)
+        results[name] = {'bytes': size,
+                         'bytes_per_resource': round(float(size) / resources,
+                                                     1)}
+    results['ratio'] = round(float(results['dicts']['bytes']) /
+                             max(1, results['records']['bytes']), 2)
+    sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Router interface attachment throughput against a fake controller.
+
+Attaches --subnets interfaces to each of --routers routers from
+concurrent threads, the way a tenant template attaches its subnets, once
+with one controller request per interface and once through the
+interface batching of HuaweiL3RouterPlugin. Prints throughput, latency
+percentiles and the number of controller requests of both as JSON:
+
+    python bench_router_interfaces.py --routers 20 --subnets 25 \\
+        --threads 32 --latency 0.005
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+from neutron.plugins.ml2.drivers.huawei import batching
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import l3_router_huawei
+
+import fake_controller
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def interface_jobs(routers, subnets):
+    # router by router, as a template attaches all subnets of its router
+    jobs = []
+    for r in range(routers):
+        for s in range(subnets):
+            jobs.append(('tenant-%d' % (r % 4), 'router-%d' % r,
+                         {'id': 'port-%d-%d' % (r, s),
+                          'subnet_id': 'subnet-%d-%d' % (r, s),
+                          'network_id': 'net-%d-%d' % (r, s),
+                          'mac_address': 'fa:16:3e:00:%02x:%02x' % (r, s),
+                          'ip_address': '10.%d.%d.1' % (r, s)}))
+    return jobs
+
+
+def make_plugin(client, window, size):
+    # only the controller side of the plugin is exercised, no database
+    plugin = l3_router_huawei.HuaweiL3RouterPlugin.__new__(
+        l3_router_huawei.HuaweiL3RouterPlugin)
+    plugin.client_sdn = client
+    plugin.interface_batches = batching.BatchCollector(window, size)
+    return plugin
+
+
+def run_mode(client, jobs, threads, add):
+    latencies = []
+    lock = threading.Lock()
+    index = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if index[0] >= len(jobs):
+                    return
+                tenant_id, router_id, interface = jobs[index[0]]
+                index[0] += 1
+            start = time.time()
+            add(tenant_id, router_id, interface)
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return {'interfaces': len(latencies),
+            'seconds': round(elapsed, 3),
+            'throughput_ops_s': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--routers', type=int, default=20)
+    parser.add_argument('--subnets', type=int, default=25,
+                        help='interfaces attached per router')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='controller latency in seconds')
+    parser.add_argument('--window', type=float, default=0,
+                        help='router_batch_window')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='router_batch_size')
+    args = parser.parse_args()
+
+    controller = fake_controller.FakeController(latency=args.latency)
+    port = controller.start()
+    results = {'config': vars(args), 'modes': {}}
+    try:
+        client = clients.SdnClient('127.0.0.1', port, neutron_id='bench')
+        plugin = make_plugin(client, args.window, args.batch_size)
+        modes = [
+            ('single', client.rest_add_router_interface),
+            ('batched', lambda tenant_id, router_id, interface:
+                plugin.interface_batches.add((tenant_id, router_id),
+                                             interface,
+                                             plugin._send_interfaces)),
+        ]
+        for name, add in modes:
+            controller.store.clear()
+            for r in range(args.routers):
+                client.rest_create_router('tenant-%d' % (r % 4),
+                                          {'id': 'router-%d' % r})
+            controller.stats.clear()
+            result = run_mode(client, interface_jobs(args.routers,
+                                                     args.subnets),
+                              args.threads, add)
+            result['controller_requests'] = controller.stats['requests']
+            result['attached'] = len([k for k in controller.store
+                                      if '/interfaces/' in k])
+            results['modes'][name] = result
+    finally:
+        controller.stop()
+    sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
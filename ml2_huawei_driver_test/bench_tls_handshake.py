@@ -0,0 +1,161 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handshakes per second against a local TLS stub controller.
+
+Compares the old behaviour, a fresh context and connection per request,
+with ServerProxy on a shared SSL context with keep-alive connections.
+A self-signed certificate is generated with the
+openssl command unless --cert/--key are given.
+
+    python bench_tls_handshake.py --requests 500
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import os
+import shutil
+import SocketServer
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from neutron.plugins.ml2.drivers.huawei import clients
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        length = int(self.headers.get('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class TLSStubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cert_file, key_file):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _StubHandler)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        self.context.load_cert_chain(cert_file, key_file)
+        self.handshakes = 0
+
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        self.handshakes += 1
+        return self.context.wrap_socket(sock, server_side=True), addr
+
+
+def _self_signed(workdir):
+    cert_file = os.path.join(workdir, 'stub.crt')
+    key_file = os.path.join(workdir, 'stub.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                           '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                           '-keyout', key_file, '-out', cert_file],
+                          stdout=open(os.devnull, 'w'),
+                          stderr=subprocess.STDOUT)
+    return cert_file, key_file
+
+
+def _run_fresh(port, cert_file, requests):
+    for i in range(requests):
+        # what every call paid before: new context, CA load, handshake
+        context = ssl.create_default_context(cafile=cert_file)
+        context.check_hostname = False
+        conn = clients.TLSConnection('127.0.0.1', port, context, timeout=10)
+        conn.request('PUT', clients.BASE_URI + '/tenants/t/networks/n',
+                     '{}', {'Content-type': 'application/json'})
+        conn.getresponse().read()
+        conn.close()
+
+
+def _run_shared(port, cert_file, requests, pool_size):
+    client = clients.SdnClient('127.0.0.1', port, ssl=True,
+                               neutron_id='bench', ssl_ca_file=cert_file,
+                               pool_size=pool_size, single_flight=False)
+    client.servers[0].ssl_context.check_hostname = False
+    for i in range(requests):
+        client.rest_action('PUT', '/tenants/t/networks/n', {'network': {}})
+    proxy = client.servers[0]
+    proxy.close()
+    return proxy.tls_handshakes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--cert')
+    parser.add_argument('--key')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        cert_file, key_file = args.cert, args.key
+        if not cert_file:
+            cert_file, key_file = _self_signed(workdir)
+        server = TLSStubServer(cert_file, key_file)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        port = server.server_address[1]
+
+        results = {}
+        for mode in ('fresh', 'shared', 'shared_no_pool'):
+            server.handshakes = 0
+            start = time.time()
+            if mode == 'fresh':
+                _run_fresh(port, cert_file, args.requests)
+                client_handshakes = args.requests
+            else:
+                pool_size = args.pool_size if mode == 'shared' else 0
+                client_handshakes = _run_shared(port, cert_file,
+                                                args.requests, pool_size)
+            elapsed = time.time() - start
+            results[mode] = {
+                'requests': args.requests,
+                'seconds': round(elapsed, 4),
+                'requests_per_second': round(args.requests / elapsed, 1),
+                'server_handshakes': server.handshakes,
+                'handshakes_per_second': round(server.handshakes / elapsed,
+                                               1),
+                'client_handshakes': client_handshakes,
+            }
+        server.shutdown()
+        print(json.dumps(results, indent=2, sort_keys=True))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
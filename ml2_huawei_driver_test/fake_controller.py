@@ -0,0 +1,427 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process fake Huawei sdn controller for benchmarks and tests.
+
+Serves the /networkService/v1.1/tenants/... resources used by SdnClient
+from an in-memory store. Latency, error rate and capacity (maximum
+concurrent requests, 503 beyond it) are configurable so the driver can
+be measured against a slow or overloaded controller. Out of band changes
+registered with add_change are served on the long polled /changes feed.
+Router interfaces may be added one ({"interface": ...}) or several
+({"interfaces": [...]}) per request, as may floating IPs of an external
+network. Networks may be created (POST of {"networks": [...]}) and
+updated (PATCH) in bulk, with a result per network in the reply. Every
+request body byte is counted in stats['request_bytes'].
+
+Bodies are decoded by their Content-Type and replies encoded as the
+client Accepts, with any of the codecs given, all available by default.
+Other encodings are answered with 415. GET /capabilities reports the
+version, the codecs and, unless bulk=False, bulk support.
+
+Writes carrying a generation, see SdnClient.generations, are rejected
+with 409 when the resource has seen a newer one, including a newer
+deletion, so that reordered writes never leave stale state behind.
+
+    controller = FakeController(latency=0.005, capacity=8)
+    port = controller.start()
+    ...
+    controller.stop()
+"""
+
+import BaseHTTPServer
+import collections
+import random
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import codec
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        controller = self.server.controller
+        status, data, headers = controller.handle(self.command, self.path,
+                                                  body, self.headers)
+        reply_codec = controller.reply_codec(self.headers)
+        payload = b''
+        if data is not None:
+            payload = reply_codec.encode(data)
+            if isinstance(payload, type(u'')):
+                payload = payload.encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', reply_codec.content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # bursts from many client threads overflow the default backlog of 5
+    request_queue_size = 128
+
+
+class FakeController(object):
+    """Fake controller keeping resources in a dict keyed by path."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, capacity=0,
+                 base_uri=clients.BASE_URI, seed=None, max_changes=1000,
+                 codecs=None, bulk=True, version='1.1'):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.base_uri = base_uri
+        self.codecs = codecs or codec.available()
+        self.bulk = bulk
+        self.version = version
+        self.store = {}
+        # last write generation of each path, kept when it is deleted
+        self.generations = {}
+        self.stats = collections.Counter()
+        self.requests = []
+        self.record_requests = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.changes = []
+        self.change_seq = 0
+        self.max_changes = max_changes
+        self._inflight = 0
+        self._server = None
+        self.routes = []
+        self.add_route('POST', r'/tenants/[^/]+/networks', self._create)
+        self.add_route('POST', r'/tenants/[^/]+/networks/[^/]+/ports',
+                       self._create)
+        self.add_route('GET', r'/tenants/[^/]+/networks/[^/]+(/ports/[^/]+)?',
+                       self._get)
+        self.add_route('PUT', r'/tenants/[^/]+/networks/[^/]+(/ports/[^/]+)?',
+                       self._replace)
+        self.add_route('DELETE',
+                       r'/tenants/[^/]+/networks/[^/]+(/ports/[^/]+)?',
+                       self._delete)
+        self.add_route('PUT',
+                       r'/tenants/[^/]+/networks/[^/]+/ports/[^/]+/attachment',
+                       self._attach)
+        self.add_route('DELETE',
+                       r'/tenants/[^/]+/networks/[^/]+/ports/[^/]+/attachment',
+                       self._delete)
+        self.add_route('POST', r'/tenants/[^/]+/routers', self._create)
+        self.add_route('GET', r'/tenants/[^/]+/routers/[^/]+', self._get)
+        self.add_route('PUT', r'/tenants/[^/]+/routers/[^/]+', self._replace)
+        self.add_route('DELETE', r'/tenants/[^/]+/routers/[^/]+',
+                       self._delete)
+        self.add_route('POST', r'/tenants/[^/]+/routers/[^/]+/interfaces',
+                       self._add_interfaces)
+        self.add_route('DELETE',
+                       r'/tenants/[^/]+/routers/[^/]+/interfaces/[^/]+',
+                       self._delete)
+        self.add_route('PUT',
+                       r'/tenants/[^/]+/networks/[^/]+/floatingips/[^/]+',
+                       self._put_floatingip)
+        self.add_route('POST', r'/tenants/[^/]+/networks/[^/]+/floatingips',
+                       self._add_floatingips)
+        self.add_route('DELETE',
+                       r'/tenants/[^/]+/networks/[^/]+/floatingips/[^/]+',
+                       self._delete)
+        self.add_route('POST', r'/tenants/[^/]+/networks',
+                       self._create_networks)
+        self.add_route('PATCH', r'/tenants/[^/]+/networks',
+                       self._update_networks)
+        self.add_route('GET', r'/changes', self._changes)
+        self.add_route('GET', r'/capabilities', self._capabilities)
+
+    def add_change(self, kind, resource_id, tenant_id, network_id=None):
+        """Report an out of band change of a resource on the feed."""
+        change = {'type': kind, 'id': resource_id, 'tenant_id': tenant_id}
+        if network_id is not None:
+            change['network_id'] = network_id
+        with self._changed:
+            self.change_seq += 1
+            self.changes.append((self.change_seq, change))
+            del self.changes[:-self.max_changes]
+            self._changed.notify_all()
+
+    def add_route(self, method, pattern, func):
+        """Serve method on paths matching pattern with func.
+
+        func(path, body, query, headers) returns (status, data) and is
+        called with the store lock held. Later routes take precedence.
+        """
+        self.routes.insert(0, (method, re.compile('^%s$' % pattern), func))
+
+    def reply_codec(self, headers):
+        """Return the codec of a reply to a request with headers."""
+        accept = headers.get('accept') or ''
+        for name in self.codecs:
+            wire = codec.CODECS[name]
+            if name != codec.JSON and wire.content_type in accept:
+                return wire
+        return codec.CODECS[codec.JSON]
+
+    def start(self, port=0):
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.controller = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def handle(self, method, raw_path, body, headers):
+        path, _sep, query = raw_path.partition('?')
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[method] += 1
+            self.stats['request_bytes'] += len(body)
+            if self.record_requests:
+                self.requests.append((method, path, body))
+            if self.capacity and self._inflight >= self.capacity:
+                self.stats['rejected'] += 1
+                return 503, {'error': 'over capacity'}, None
+            self._inflight += 1
+            self.stats['max_inflight'] = max(self.stats['max_inflight'],
+                                             self._inflight)
+            fail = self._random.random() < self.error_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        try:
+            if delay:
+                time.sleep(delay)
+            if fail:
+                with self._lock:
+                    self.stats['injected_errors'] += 1
+                return 500, {'error': 'injected failure'}, None
+            return self._route(method, path, body, query, headers)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def _route(self, method, path, body, query, headers):
+        if not path.startswith(self.base_uri):
+            return 404, None, None
+        resource = path[len(self.base_uri):]
+        content_type = (headers.get('content-type') or
+                        codec.CODECS[codec.JSON].content_type)
+        content_type = content_type.split(';', 1)[0].strip().lower()
+        request_codec = codec.for_content_type(content_type)
+        if (request_codec.content_type != content_type or
+                request_codec.name not in self.codecs):
+            return 415, {'error': 'unsupported content type'}, None
+        try:
+            data = request_codec.decode(body) if body else None
+        except ValueError:
+            return 400, {'error': 'malformed body'}, None
+        for route_method, regex, func in self.routes:
+            if route_method == method and regex.match(resource):
+                with self._lock:
+                    result = func(resource, data, query, headers)
+                status, reply = result[:2]
+                extra = result[2] if len(result) > 2 else None
+                with self._lock:
+                    self.stats['status_%d' % status] += 1
+                return status, reply, extra
+        return 404, None, None
+
+    def _parent_exists(self, resource):
+        parent = resource.rsplit('/', 2)[0]
+        return parent.count('/') <= 2 or parent in self.store
+
+    def _stale(self, resource, generation):
+        """True if generation is older than the last write of resource."""
+        if generation is None:
+            return False
+        last = self.generations.get(resource)
+        if last is not None and int(generation) < last:
+            self.stats['stale'] += 1
+            return True
+        return False
+
+    def _applied(self, resource, generation):
+        if generation is not None:
+            self.generations[resource] = int(generation)
+
+    def _create(self, resource, data, query, headers):
+        if not data or len(data) != 1:
+            return 400, {'error': 'expected a single resource'}
+        kind, doc = list(data.items())[0]
+        if not self._parent_exists(resource + '/x'):
+            return 404, None
+        path = '%s/%s' % (resource, doc.get('id'))
+        generation = doc.get(clients.GENERATION_KEY)
+        if self._stale(path, generation):
+            return 409, {'error': 'stale generation'}
+        self.store[path] = doc
+        self._applied(path, generation)
+        return 201, data
+
+    def _create_networks(self, resource, data, query, headers):
+        if not data or 'networks' not in data:
+            return self._create(resource, data, query, headers)
+        results = []
+        for doc in data['networks']:
+            path = '%s/%s' % (resource, doc.get('id'))
+            generation = doc.get(clients.GENERATION_KEY)
+            if doc.get('id') is None:
+                results.append({'id': None, 'status': 400,
+                                'error': 'missing id'})
+            elif self._stale(path, generation):
+                results.append({'id': doc['id'], 'status': 409,
+                                'error': 'stale generation'})
+            else:
+                self.store[path] = doc
+                self._applied(path, generation)
+                results.append({'id': doc['id'], 'status': 201})
+        return 201, {'networks': results}
+
+    def _update_networks(self, resource, data, query, headers):
+        if not data or 'networks' not in data:
+            return 400, {'error': 'expected networks'}
+        results = []
+        for doc in data['networks']:
+            path = '%s/%s' % (resource, doc.get('id'))
+            generation = doc.get(clients.GENERATION_KEY)
+            if path not in self.store:
+                results.append({'id': doc.get('id'), 'status': 404,
+                                'error': 'no such network'})
+            elif self._stale(path, generation):
+                results.append({'id': doc['id'], 'status': 409,
+                                'error': 'stale generation'})
+            else:
+                self.store[path] = doc
+                self._applied(path, generation)
+                results.append({'id': doc['id'], 'status': 200})
+        return 200, {'networks': results}
+
+    def _get(self, resource, data, query, headers):
+        if resource not in self.store:
+            return 404, None
+        return 200, self.store[resource]
+
+    def _replace(self, resource, data, query, headers):
+        if resource not in self.store:
+            return 404, None
+        kind, doc = list(data.items())[0]
+        generation = doc.get(clients.GENERATION_KEY)
+        if self._stale(resource, generation):
+            return 409, {'error': 'stale generation'}
+        self.store[resource] = doc
+        self._applied(resource, generation)
+        return 200, data
+
+    def _attach(self, resource, data, query, headers):
+        if resource.rsplit('/', 1)[0] not in self.store:
+            return 404, None
+        generation = data['attachment'].get(clients.GENERATION_KEY)
+        if self._stale(resource, generation):
+            return 409, {'error': 'stale generation'}
+        self.store[resource] = data['attachment']
+        self._applied(resource, generation)
+        return 200, data
+
+    def _add_members(self, resource, data, single, many):
+        if resource.rsplit('/', 1)[0] not in self.store:
+            return 404, None
+        if data and many in data:
+            docs = data[many]
+        elif data and single in data:
+            docs = [data[single]]
+        else:
+            return 400, {'error': 'expected %s or %s' % (single, many)}
+        paths = ['%s/%s' % (resource, doc.get('id')) for doc in docs]
+        for path, doc in zip(paths, docs):
+            if self._stale(path, doc.get(clients.GENERATION_KEY)):
+                return 409, {'error': 'stale generation'}
+        for path, doc in zip(paths, docs):
+            self.store[path] = doc
+            self._applied(path, doc.get(clients.GENERATION_KEY))
+        return 201, data
+
+    def _add_interfaces(self, resource, data, query, headers):
+        return self._add_members(resource, data, 'interface', 'interfaces')
+
+    def _add_floatingips(self, resource, data, query, headers):
+        return self._add_members(resource, data, 'floatingip',
+                                 'floatingips')
+
+    def _put_floatingip(self, resource, data, query, headers):
+        # created or replaced
+        collection, floatingip_id = resource.rsplit('/', 1)
+        if not data or data.get('floatingip', {}).get('id') != floatingip_id:
+            return 400, {'error': 'expected floatingip ' + floatingip_id}
+        status, reply = self._add_members(collection, data, 'floatingip',
+                                          'floatingips')
+        return (200 if status == 201 else status), reply
+
+    def _changes(self, resource, data, query, headers):
+        # called with self._lock held, waiting on _changed releases it
+        params = dict(urlparse.parse_qsl(query))
+        wait = float(params.get('wait', 0))
+        if 'cursor' not in params:
+            return 200, {'cursor': str(self.change_seq), 'changes': []}
+        try:
+            cursor = int(params['cursor'])
+        except ValueError:
+            return 400, {'error': 'malformed cursor'}
+        trimmed = self.changes and cursor + 1 < self.changes[0][0]
+        if trimmed or cursor > self.change_seq:
+            return 200, {'cursor': str(self.change_seq), 'changes': [],
+                         'reset': True}
+        deadline = time.time() + wait
+        while self.change_seq <= cursor and time.time() < deadline:
+            self._changed.wait(deadline - time.time())
+        changes = [change for seq, change in self.changes if seq > cursor]
+        return 200, {'cursor': str(self.change_seq), 'changes': changes}
+
+    def _capabilities(self, resource, data, query, headers):
+        return 200, {'version': self.version, 'codecs': list(self.codecs),
+                     'bulk': self.bulk}
+
+    def _delete(self, resource, data, query, headers):
+        generation = headers.get(clients.GENERATION_HEADER)
+        if self._stale(resource, generation):
+            return 409, {'error': 'stale generation'}
+        # the tombstone rejects writes older than the deletion
+        self._applied(resource, generation)
+        if resource not in self.store:
+            return 404, None
+        prefix = resource + '/'
+        for key in [k for k in self.store
+                    if k == resource or k.startswith(prefix)]:
+            del self.store[key]
+        return 204, None
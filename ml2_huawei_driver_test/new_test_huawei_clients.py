@@ -0,0 +1,1446 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import multiprocessing
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+
+import mock
+from oslo.config import cfg
+
+from neutron.plugins.ml2.drivers.huawei import batching
+from neutron.plugins.ml2.drivers.huawei import changefeed
+from neutron.plugins.ml2.drivers.huawei import checkpoint
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import codec
+from neutron.plugins.ml2.drivers.huawei import config  # noqa
+from neutron.plugins.ml2.drivers.huawei import dispatcher
+from neutron.plugins.ml2.drivers.huawei import profiling
+from neutron.plugins.ml2.drivers.huawei import recorder
+from neutron.plugins.ml2.drivers.huawei import records
+from neutron.plugins.ml2.drivers.huawei import shared_cache
+from neutron.plugins.ml2.drivers.huawei import sharding
+from neutron.plugins.ml2.drivers.huawei import singleflight
+from neutron.plugins.ml2.drivers.huawei import sync
+from neutron.plugins.ml2.drivers.huawei import tracing
+
+from neutron.tests import base
+
+
+class PriorityDispatcherTestCase(base.BaseTestCase):
+    """
+        Test case for the controller call priority dispatcher
+    """
+
+    def test_call_returns_result(self):
+        disp = dispatcher.PriorityDispatcher()
+        ret = disp.call(dispatcher.PRIORITY_NORMAL, lambda a, b: a + b, 1, 2)
+        self.assertEqual(3, ret)
+        metrics = disp.get_metrics()
+        self.assertEqual(1, metrics['normal']['dispatched'])
+        self.assertEqual(0, metrics['running'])
+
+    def test_call_propagates_exception(self):
+        disp = dispatcher.PriorityDispatcher()
+
+        def fail():
+            raise ValueError("controller error")
+
+        self.assertRaises(ValueError, disp.call,
+                          dispatcher.PRIORITY_INTERACTIVE, fail)
+        self.assertEqual(0, disp.get_metrics()['running'])
+
+    def test_interactive_admitted_before_background(self):
+        disp = dispatcher.PriorityDispatcher(concurrency=1, aging_interval=0)
+        order = []
+        release = threading.Event()
+
+        def blocker():
+            release.wait()
+
+        holder = threading.Thread(
+            target=disp.call, args=(dispatcher.PRIORITY_NORMAL, blocker))
+        holder.start()
+        while disp.get_metrics()['running'] == 0:
+            time.sleep(0.01)
+
+        threads = []
+        for priority in (dispatcher.PRIORITY_BACKGROUND,
+                         dispatcher.PRIORITY_INTERACTIVE):
+            t = threading.Thread(target=disp.call,
+                                 args=(priority, order.append, priority))
+            t.start()
+            threads.append(t)
+        while (disp.get_metrics()['background']['depth'] +
+               disp.get_metrics()['interactive']['depth']) < 2:
+            time.sleep(0.01)
+
+        release.set()
+        for t in [holder] + threads:
+            t.join()
+        self.assertEqual([dispatcher.PRIORITY_INTERACTIVE,
+                          dispatcher.PRIORITY_BACKGROUND], order)
+
+    def test_wait_bounded_by_call_deadline(self):
+        disp = dispatcher.PriorityDispatcher(concurrency=1)
+        release = threading.Event()
+        holder = threading.Thread(
+            target=disp.call, args=(dispatcher.PRIORITY_NORMAL,
+                                    release.wait))
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        while disp.get_metrics()['running'] == 0:
+            time.sleep(0.01)
+
+        with clients.call_deadline(0.05):
+            self.assertRaises(clients.RemoteRestError, disp.call,
+                              dispatcher.PRIORITY_NORMAL, lambda: None)
+        metrics = disp.get_metrics()
+        self.assertEqual(1, metrics['normal']['expired'])
+        self.assertEqual(0, metrics['normal']['depth'])
+
+    def test_aged_background_is_promoted(self):
+        disp = dispatcher.PriorityDispatcher(aging_interval=1.0)
+        now = time.time()
+        background = [dispatcher.PRIORITY_BACKGROUND, 0, now - 5]
+        interactive = [dispatcher.PRIORITY_INTERACTIVE, 1, now]
+        disp._waiters = [interactive, background]
+        self.assertIs(background, disp._next_waiter())
+
+
+class ResourceLocksTestCase(base.BaseTestCase):
+    """
+        Test case for the per resource serialization of controller calls
+    """
+
+    def test_other_resources_called_concurrently(self):
+        client = clients.SdnClient("127.0.0.1", 1, single_flight=False)
+        entered = threading.Event()
+        release = threading.Event()
+
+        def _rest_call(action, resource, *args):
+            if resource == '/slow':
+                entered.set()
+                release.wait()
+            return 200, 'OK', None, None
+        client._rest_call = _rest_call
+        slow = threading.Thread(target=client.rest_call,
+                                args=('PUT', '/slow', {}, None, []))
+        slow.start()
+        self.addCleanup(slow.join)
+        self.addCleanup(release.set)
+        entered.wait()
+
+        self.assertEqual(200, client.rest_call('PUT', '/fast', {}, None,
+                                               [])[0])
+        self.assertEqual(['/slow'], list(client.resource_locks._locks))
+
+
+class SingleFlightTestCase(base.BaseTestCase):
+    """
+        Test case for single-flight request coalescing
+    """
+
+    def setUp(self):
+        super(SingleFlightTestCase, self).setUp()
+        self.flight = singleflight.SingleFlight()
+        self.sent = []
+        self.release = threading.Event()
+
+    def _blocking_send(self, data):
+        self.sent.append(data)
+        if len(self.sent) == 1:
+            self.release.wait()
+        return data
+
+    def _start(self, data, mode, results):
+        def run():
+            results.append(self.flight.call(("PUT", "/net-1"),
+                                            self._blocking_send, data, mode))
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    def _wait_for_users(self, count):
+        while True:
+            entry = self.flight._entries.get(("PUT", "/net-1"))
+            if entry is not None and entry.users >= count:
+                return
+            time.sleep(0.01)
+
+    def test_merge_sends_trailing_request_with_newest_data(self):
+        results = []
+        threads = [self._start("v1", singleflight.MODE_MERGE, results)]
+        self._wait_for_users(1)
+        for data in ("v2", "v3", "v4"):
+            threads.append(self._start(data, singleflight.MODE_MERGE,
+                                       results))
+            self._wait_for_users(len(threads))
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(["v1", "v4"], self.sent)
+        self.assertEqual(["v1", "v4", "v4", "v4"], sorted(results))
+        self.assertEqual({}, self.flight._entries)
+
+    def test_merge_into_trailing_request_not_yet_sent(self):
+        # the in-flight request finished, its trailing leader has not
+        # been woken up yet
+        entry = singleflight._Entry()
+        entry.pending = singleflight._Flight("v2")
+        entry.users = 1
+        self.flight._entries[("PUT", "/net-1")] = entry
+        results = []
+        thread = self._start("v3", singleflight.MODE_MERGE, results)
+        self._wait_for_users(2)
+
+        with self.flight._cond:
+            self.assertEqual("v3", entry.pending.data)
+            entry.pending.result = entry.pending.data
+            entry.pending.done = True
+            self.flight._cond.notify_all()
+        thread.join()
+
+        self.assertEqual([], self.sent)
+        self.assertEqual(["v3"], results)
+
+    def test_join_shares_in_flight_result(self):
+        results = []
+        threads = [self._start("v1", singleflight.MODE_JOIN, results)]
+        self._wait_for_users(1)
+        threads.append(self._start("v2", singleflight.MODE_JOIN, results))
+        self._wait_for_users(2)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(["v1"], self.sent)
+        self.assertEqual(["v1", "v1"], results)
+
+    def test_serial_sends_every_request(self):
+        results = []
+        threads = [self._start("v1", singleflight.MODE_SERIAL, results)]
+        self._wait_for_users(1)
+        threads.append(self._start("v2", singleflight.MODE_SERIAL, results))
+        self._wait_for_users(2)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(["v1", "v2"], self.sent)
+
+    def test_merged_before_dispatch_with_default_concurrency(self):
+        disp = dispatcher.PriorityDispatcher(
+            cfg.CONF.ml2_Huawei.dispatch_concurrency)
+        client = clients.SdnClient("127.0.0.1", 1, dispatcher=disp)
+        self.flight = client.single_flight
+
+        def rest_call(action, resource, data, *args):
+            return (200, 'OK', None, self._blocking_send(data['network']))
+        mock.patch.object(client, 'rest_call', side_effect=rest_call).start()
+        self.addCleanup(mock.patch.stopall)
+
+        def update(name):
+            client.rest_action('PUT', '/net-1', {'network': name})
+        threads = []
+        for name in ("v1", "v2", "v3", "v4"):
+            threads.append(threading.Thread(target=update, args=(name,)))
+            threads[-1].start()
+            self._wait_for_users(len(threads))
+        self.release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(["v1", "v4"], self.sent)
+        self.assertEqual(2, disp.get_metrics()['normal']['dispatched'])
+
+    def test_error_is_raised_in_merged_callers(self):
+        def fail(data):
+            raise ValueError(data)
+
+        self.assertRaises(ValueError, self.flight.call, ("PUT", "/net-1"),
+                          fail, "v1", singleflight.MODE_MERGE)
+        self.assertEqual({}, self.flight._entries)
+
+
+class TimeoutTestCase(base.BaseTestCase):
+    """
+        Test case for connect/read timeouts and call deadlines
+    """
+
+    def _proxy(self, latencies=None):
+        return clients.ServerProxy("127.0.0.1", 8800, False, None, "nid",
+                                   10, clients.BASE_URI, "test",
+                                   connect_timeout=2, latencies=latencies)
+
+    def test_nested_deadline_only_shortens(self):
+        self.assertIsNone(clients.current_deadline())
+        with clients.call_deadline(5):
+            outer = clients.current_deadline()
+            with clients.call_deadline(60):
+                self.assertEqual(outer, clients.current_deadline())
+            with clients.call_deadline(1):
+                self.assertTrue(clients.current_deadline() < outer)
+            self.assertEqual(outer, clients.current_deadline())
+        self.assertIsNone(clients.current_deadline())
+
+    def test_read_timeout_without_samples_uses_configured(self):
+        proxy = self._proxy(clients.LatencyTracker(min_samples=5))
+        self.assertEqual(10, proxy.read_timeout("PUT", "/tenants/t1"))
+
+    def test_adaptive_read_timeout_follows_latency(self):
+        latencies = clients.LatencyTracker(min_samples=5)
+        for i in range(10):
+            latencies.record("DELETE ports/*", 0.5)
+            latencies.record("PUT networks/*", 8.0)
+        proxy = self._proxy(latencies)
+        self.assertEqual(1.5, proxy.read_timeout(
+            "DELETE", "/tenants/t1/networks/n1/ports/p1"))
+        # bounded by the configured read timeout
+        self.assertEqual(10, proxy.read_timeout(
+            "PUT", "/tenants/t2/networks/n2"))
+        self.assertEqual(10, proxy.read_timeout(
+            "PUT", "/tenants/t1/networks/n1/ports/p1"))
+
+    def test_read_timeouts_counted_as_samples(self):
+        latencies = clients.LatencyTracker(min_samples=5)
+        for i in range(10):
+            latencies.record("PUT networks/*", 0.1)
+        proxy = self._proxy(latencies)
+        resource = "/tenants/t/networks/n"
+        self.assertEqual(1.0, proxy.read_timeout("PUT", resource))
+        timeouts = []
+        with mock.patch.object(clients.httplib, "HTTPConnection"):
+            with mock.patch.object(proxy, "_send",
+                                   side_effect=clients.socket.timeout()):
+                for i in range(3):
+                    proxy.rest_call("PUT", resource, {}, {})
+                    timeouts.append(proxy.read_timeout("PUT", resource))
+        # grows with every timeout, up to the configured read timeout
+        self.assertEqual([3.0, 9.0, 10], timeouts)
+
+    def test_expired_deadline_skips_request(self):
+        proxy = self._proxy()
+        with mock.patch.object(clients.httplib, "HTTPConnection") as conn:
+            ret = proxy.rest_call("PUT", "/tenants/t1/networks/n1", {}, {},
+                                  deadline=time.time() - 1)
+        self.assertEqual((0, None, None, None), ret)
+        self.assertFalse(conn.called)
+
+    def test_expired_deadline_stops_failover(self):
+        client = clients.SdnClient("127.0.0.1", 8800)
+        client.servers.append(client.server_proxy_for("127.0.0.2", 8800))
+        for server in client.servers:
+            server.rest_call = mock.MagicMock(return_value=(500, None, None,
+                                                            None))
+        with clients.call_deadline(5):
+            with mock.patch.object(clients.time, "time",
+                                   return_value=time.time() + 10):
+                ret = client.rest_call("PUT", "/tenants/t1/networks/n1", {},
+                                       None, [])
+        self.assertEqual((0, None, None, None), ret)
+        for server in client.servers:
+            self.assertFalse(server.rest_call.called)
+
+
+class _KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('content-length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def do_GET(self):
+        body = b'{"bulk": true}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _CountingServer(SocketServer.ThreadingMixIn,
+                      BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def get_request(self):
+        self.connections += 1
+        return BaseHTTPServer.HTTPServer.get_request(self)
+
+
+class ConnectionReuseTestCase(base.BaseTestCase):
+    """
+        Test case for keep-alive connection reuse and shared SSL contexts
+    """
+
+    def setUp(self):
+        super(ConnectionReuseTestCase, self).setUp()
+        self.server = _CountingServer(('127.0.0.1', 0), _KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.shutdown)
+
+    def _put_many(self, pool_size, count=3):
+        client = clients.SdnClient('127.0.0.1', self.server.server_port,
+                                   neutron_id='test', pool_size=pool_size)
+        self._put_many_with(client, count)
+
+    def _put_many_with(self, client, count):
+        for i in range(count):
+            resp = client.rest_action('PUT', '/tenants/t1/networks/n1',
+                                      {'network': {}})
+            self.assertEqual(200, resp[0])
+        client.servers[0].close()
+
+    def test_pooled_connection_is_reused(self):
+        self._put_many(pool_size=1)
+        self.assertEqual(1, self.server.connections)
+
+    def test_no_pool_opens_connection_per_request(self):
+        self._put_many(pool_size=0)
+        self.assertEqual(3, self.server.connections)
+
+    def test_prewarm_opens_pooled_connections(self):
+        client = clients.SdnClient('127.0.0.1', self.server.server_port,
+                                   neutron_id='test', pool_size=2)
+        server = client.servers[0]
+        self.assertEqual(2, server.prewarm(3))
+        self.assertEqual({'bulk': True}, server.capabilities)
+        self._put_many_with(client, count=2)
+        self.assertEqual(2, self.server.connections)
+
+    def test_pool_not_shared_after_fork(self):
+        client = clients.SdnClient('127.0.0.1', self.server.server_port,
+                                   neutron_id='test', pool_size=2)
+        server = client.servers[0]
+        server.prewarm(2)
+        inherited = list(server._idle)
+        with mock.patch.object(clients.os, 'getpid',
+                               return_value=os.getpid() + 1):
+            conn, reused = server._get_connection(1)
+        conn.close()
+        for idle in inherited:
+            idle.close()
+        self.assertFalse(reused)
+        self.assertNotIn(conn, inherited)
+        self.assertEqual([], server._idle)
+
+    def _send_on_reused(self, error):
+        proxy = clients.ServerProxy("127.0.0.1", 8800, False, None, "nid",
+                                    10, clients.BASE_URI, "test")
+        response = mock.Mock(status=200, will_close=True)
+        response.read.return_value = '{}'
+        response.getheader.return_value = 'application/json'
+        with mock.patch.object(proxy, '_get_connection',
+                               return_value=(mock.Mock(), True)):
+            with mock.patch.object(proxy, '_new_connection'):
+                with mock.patch.object(proxy, '_send',
+                                       side_effect=[error, response]) as send:
+                    ret = proxy.rest_call('POST', '/tenants/t1/networks',
+                                          {'network': {}}, {})
+        return ret[0], send.call_count
+
+    def test_dropped_keepalive_connection_sent_again(self):
+        self.assertEqual((200, 2),
+                         self._send_on_reused(clients.httplib.BadStatusLine(
+                             "''")))
+
+    def test_timeout_on_reused_connection_not_sent_again(self):
+        self.assertEqual((0, 1),
+                         self._send_on_reused(clients.socket.timeout()))
+
+    def test_ssl_context_is_shared(self):
+        first = clients.SdnClient('127.0.0.1', 1, ssl=True, ssl_verify=False)
+        second = clients.SdnClient('127.0.0.2', 1, ssl=True,
+                                   ssl_verify=False)
+        self.assertIs(first.ssl_context, second.ssl_context)
+        self.assertIs(first.ssl_context, first.servers[0].ssl_context)
+
+
+class _JsonOnlyHandler(_KeepAliveHandler):
+    def do_PUT(self):
+        if self.headers.get('content-type') != 'application/json':
+            self.rfile.read(int(self.headers.get('content-length') or 0))
+            self.send_response(415)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        _KeepAliveHandler.do_PUT(self)
+
+
+class CodecTestCase(base.BaseTestCase):
+    """
+        Test case for the wire codecs
+    """
+
+    def test_documents_round_trip(self):
+        document = {'network': {'id': 'n1', 'name': u'r\xe9seau',
+                                'subnets': [{'cidr': '10.0.0.0/24',
+                                             'enable_dhcp': True}],
+                                'router:external': False, 'mtu': None}}
+        for name in codec.available():
+            wire = codec.get_codec(name)
+            self.assertEqual(document, wire.decode(wire.encode(document)))
+            self.assertIs(wire, codec.for_content_type(
+                wire.content_type + '; charset=utf-8'))
+
+    def test_msgpack_sends_byte_strings_as_text(self):
+        if codec.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        wire = codec.get_codec(codec.MSGPACK)
+        # Python 2 str, as most mapped documents hold
+        document = wire.decode(wire.encode({b'id': b'n1'}))
+        self.assertEqual({u'id': u'n1'}, document)
+        self.assertIsInstance(document[u'id'], type(u''))
+
+    def test_unknown_content_type_taken_for_json(self):
+        self.assertEqual(codec.JSON, codec.for_content_type(None).name)
+        self.assertEqual(codec.JSON,
+                         codec.for_content_type('text/html').name)
+
+    def test_msgpack_falls_back_to_json_on_415(self):
+        if codec.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        server = _CountingServer(('127.0.0.1', 0), _JsonOnlyHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+        client = clients.SdnClient('127.0.0.1', server.server_port,
+                                   neutron_id='test', wire_codec='msgpack')
+        proxy = client.servers[0]
+        self.assertEqual(codec.MSGPACK, proxy.wire_codec.name)
+
+        resp = client.rest_action('PUT', '/tenants/t1/networks/n1',
+                                  {'network': {}})
+
+        self.assertEqual(200, resp[0])
+        self.assertEqual({}, resp[3])
+        self.assertEqual(codec.JSON, proxy.wire_codec.name)
+
+
+class CapabilitiesTestCase(base.BaseTestCase):
+    """
+        Test case for controller capability probing
+    """
+
+    def setUp(self):
+        super(CapabilitiesTestCase, self).setUp()
+        self.client = clients.SdnClient("127.0.0.1", 1, capabilities_ttl=60)
+        self.client.servers.append(
+            self.client.server_proxy_for("127.0.0.2", 1))
+        self.calls = []
+        self.addCleanup(mock.patch.stopall)
+
+    def _serve(self, server, capabilities, status=200):
+        def rest_call(action, resource, *args, **kwargs):
+            self.calls.append((server.server, resource))
+            if not status:
+                return 0, None, None, None
+            if resource == clients.CAPABILITIES_PATH:
+                return 200, 'OK', None, capabilities
+            return status, 'OK', None, None
+        mock.patch.object(server, 'rest_call', side_effect=rest_call).start()
+
+    def test_probed_once_per_ttl(self):
+        first, second = self.client.servers
+        self._serve(first, {'version': '1.1', 'bulk': False})
+        now = time.time()
+        for offset in (0, 30, 61):
+            with mock.patch.object(clients.time, 'time',
+                                   return_value=now + offset):
+                self.client.rest_action('PUT', '/tenants/t1', {})
+        self.assertEqual([('127.0.0.1', clients.CAPABILITIES_PATH),
+                          ('127.0.0.1', '/tenants/t1'),
+                          ('127.0.0.1', '/tenants/t1'),
+                          ('127.0.0.1', clients.CAPABILITIES_PATH),
+                          ('127.0.0.1', '/tenants/t1')], self.calls)
+        self.assertEqual({'version': '1.1', 'bulk': False},
+                         first.capabilities)
+
+    def test_probed_again_on_failover(self):
+        first, second = self.client.servers
+        self._serve(first, None, status=0)
+        self._serve(second, {'bulk': True})
+        second.capabilities_checked = time.time()
+        second.capabilities = {'bulk': False}
+
+        self.client.rest_action('PUT', '/tenants/t1', {})
+        self.client.rest_action('PUT', '/tenants/t1', {})
+
+        # the unreachable server is not sent the request it was probed for
+        self.assertEqual([('127.0.0.1', clients.CAPABILITIES_PATH),
+                          ('127.0.0.2', clients.CAPABILITIES_PATH),
+                          ('127.0.0.2', '/tenants/t1'),
+                          ('127.0.0.2', '/tenants/t1')], self.calls)
+        self.assertEqual({'bulk': True}, second.capabilities)
+
+    def test_bulk_sent_one_by_one_to_servers_without_capabilities(self):
+        first, second = self.client.servers
+        self.client.servers.remove(second)
+        probe = (404, 'Not Found', None, None)
+        mock.patch.object(first, 'rest_call', return_value=probe).start()
+        rest_call = mock.patch.object(self.client, 'rest_call',
+                                      return_value=(204, 'OK', None,
+                                                    None)).start()
+
+        self.client.rest_update_floatingips('t1', 'n1', [{'id': 'f1'},
+                                                         {'id': 'f2'}])
+
+        self.assertEqual({}, first.capabilities)
+        self.assertEqual(['/tenants/t1/networks/n1/floatingips/f1',
+                          '/tenants/t1/networks/n1/floatingips/f2'],
+                         [c[0][1] for c in rest_call.call_args_list])
+
+
+    def test_msgpack_not_sent_to_servers_without_capabilities(self):
+        if codec.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        client = clients.SdnClient("127.0.0.1", 1, wire_codec='msgpack')
+        proxy = client.servers[0]
+        mock.patch.object(proxy, 'rest_call',
+                          return_value=(404, 'Not Found', None,
+                                        None)).start()
+
+        self.assertTrue(proxy.probe())
+
+        self.assertEqual({}, proxy.capabilities)
+        self.assertEqual(codec.JSON, proxy.wire_codec.name)
+
+
+class BulkTestCase(base.BaseTestCase):
+    """
+        Test case for bulk network requests
+    """
+
+    def setUp(self):
+        super(BulkTestCase, self).setUp()
+        self.client = clients.SdnClient("127.0.0.1", 1)
+        self.client.servers[0].capabilities = {'bulk': True}
+        self.rest_call = mock.patch.object(self.client, 'rest_call').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_results_per_network(self):
+        self.rest_call.return_value = (
+            201, 'Created', None,
+            {'networks': [{'id': 'n1', 'status': 201},
+                          {'id': 'n2', 'status': 400, 'error': 'bad'}]})
+        results = self.client.rest_create_networks(
+            't1', [{'id': 'n1'}, {'id': 'n2'}])
+        self.assertEqual({'n1': None, 'n2': 'bad'}, results)
+        (action, resource, data), kwargs = [
+            (c[0][:3], None) for c in self.rest_call.call_args_list][0]
+        self.assertEqual(('POST', '/tenants/t1/networks'),
+                         (action, resource))
+        self.assertEqual(['n1', 'n2'], [n['id'] for n in data['networks']])
+
+    def test_sent_one_by_one_without_bulk_capability(self):
+        self.client.servers[0].capabilities = {'bulk': False}
+        self.rest_call.side_effect = [(200, 'OK', None, None),
+                                      (500, 'Error', 'down', None)]
+        results = self.client.rest_update_networks(
+            't1', [{'id': 'n1'}, {'id': 'n2'}])
+        self.assertEqual(['/tenants/t1/networks/n1',
+                          '/tenants/t1/networks/n2'],
+                         [c[0][1] for c in self.rest_call.call_args_list])
+        self.assertIsNone(results['n1'])
+        self.assertIsInstance(results['n2'], clients.RemoteRestError)
+
+    def test_sent_one_by_one_to_servers_never_probed(self):
+        self.client.servers[0].capabilities = None
+        self.rest_call.return_value = (201, 'Created', None, None)
+        results = self.client.rest_create_networks(
+            't1', [{'id': 'n1'}, {'id': 'n2'}])
+        self.assertEqual(2, self.rest_call.call_count)
+        self.assertEqual({'n1': None, 'n2': None}, results)
+
+
+class ShardingTestCase(base.BaseTestCase):
+    """
+        Test case for consistent-hash tenant sharding
+    """
+
+    def setUp(self):
+        super(ShardingTestCase, self).setUp()
+        self.tenants = ["tenant-%d" % i for i in range(2000)]
+
+    def test_parse_clusters(self):
+        clusters = sharding.parse_clusters(
+            ["east=10.0.0.1:8800|10.0.0.2:8800", "west=10.1.0.1:8801"])
+        self.assertEqual({"east": [("10.0.0.1", 8800), ("10.0.0.2", 8800)],
+                          "west": [("10.1.0.1", 8801)]}, clusters)
+
+    def test_adding_cluster_moves_small_fraction(self):
+        old_ring = sharding.HashRing(["c1", "c2", "c3"])
+        new_ring = sharding.HashRing(["c1", "c2", "c3", "c4"])
+        moves = sharding.rebalance(self.tenants, old_ring, new_ring)
+        # ideally a quarter of the tenants, all of them onto the new cluster
+        self.assertTrue(0.15 < len(moves) / float(len(self.tenants)) < 0.35)
+        self.assertEqual(set(["c4"]),
+                         set(new for old, new in moves.values()))
+
+    def test_requests_routed_to_tenant_cluster(self):
+        client = sharding.ShardedSdnClient(
+            {"east": [("10.0.0.1", 8800), ("10.0.0.2", 8800)],
+             "west": [("10.1.0.1", 8800)]})
+        for server in client.servers:
+            server.rest_call = mock.MagicMock(return_value=(200, "OK", "",
+                                                            None))
+        tenant_id = self.tenants[0]
+        cluster = client.cluster_for(tenant_id)
+        client.rest_create_network(tenant_id, {"id": "net-1"})
+
+        called = [s for s in client.servers if s.rest_call.called]
+        self.assertEqual(1, len(called))
+        self.assertIn(called[0], client.clusters[cluster])
+
+    def test_rebalance_plan_reports_moved_tenants(self):
+        client = sharding.ShardedSdnClient({"c1": [("10.0.0.1", 8800)],
+                                            "c2": [("10.0.0.2", 8800)]})
+        moves = client.rebalance_plan(self.tenants, ["c1", "c2", "c3"])
+        for tenant_id, (old, new) in moves.items():
+            self.assertEqual(client.cluster_for(tenant_id), old)
+            self.assertEqual("c3", new)
+
+
+class TrafficRecorderTestCase(base.BaseTestCase):
+    """
+        Test case for controller traffic recording
+    """
+
+    def setUp(self):
+        super(TrafficRecorderTestCase, self).setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, 'traffic')
+
+    def test_records_read_back_in_order(self):
+        rec = recorder.TrafficRecorder(self.path)
+        rec.record(100.0, 0.0125, 'PUT', '/tenants/t1/networks/n1', 512,
+                   200, '10.0.0.1:8800')
+        rec.record(101.0, 0.002, 'DELETE', '/tenants/t1/networks/n1', 2,
+                   0, '10.0.0.1:8800')
+        rec.close()
+        records = list(recorder.read_records(
+            recorder.recording_files(self.path)))
+        self.assertEqual(2, len(records))
+        self.assertEqual('PUT', records[0].method)
+        self.assertEqual(512, records[0].payload_bytes)
+        self.assertAlmostEqual(0.0125, records[0].duration)
+        self.assertEqual(0, records[1].status)
+
+    def test_rotation_keeps_configured_backups(self):
+        rec = recorder.TrafficRecorder(self.path, max_bytes=200, backups=2)
+        for i in range(50):
+            rec.record(float(i), 0.001, 'PUT', '/tenants/t1/networks/n%d' % i,
+                       10, 200, 'server')
+        rec.close()
+        files = recorder.recording_files(self.path)
+        self.assertEqual([self.path + '.2', self.path + '.1', self.path],
+                         files)
+        starts = [r.start for r in recorder.read_records(files)]
+        self.assertEqual(sorted(starts), starts)
+        self.assertEqual(49.0, starts[-1])
+
+    def test_workers_sharing_file_rotate_once(self):
+        workers = [recorder.TrafficRecorder(self.path, max_bytes=200,
+                                            backups=9) for i in range(2)]
+        for i in range(30):
+            workers[i % 2].record(float(i), 0.001, 'PUT',
+                                  '/tenants/t1/networks/n%d' % i, 10, 200,
+                                  'server')
+        for rec in workers:
+            rec.close()
+        files = recorder.recording_files(self.path)
+        starts = [r.start for r in recorder.read_records(files)]
+        self.assertEqual(30, len(starts))
+        # at most one line past max_bytes per worker
+        for path in files:
+            self.assertTrue(os.path.getsize(path) < 350)
+
+    def test_server_proxy_records_failed_call(self):
+        rec = mock.MagicMock()
+        proxy = clients.ServerProxy("127.0.0.1", 1, False, None, "nid", 1,
+                                    clients.BASE_URI, "test", recorder=rec)
+        ret = proxy.rest_call("PUT", "/tenants/t1/networks/n1", {"a": 1}, {})
+        self.assertEqual(0, ret[0])
+        args = rec.record.call_args[0]
+        self.assertEqual(("PUT", "/tenants/t1/networks/n1", 8, 0,
+                          "127.0.0.1:1"), args[2:])
+
+
+class RecordsTestCase(base.BaseTestCase):
+    """
+        Test case for compact resource records
+    """
+
+    def test_uuid_keys_round_trip(self):
+        port_id = "7c1c7b42-7c4f-4bd5-a2b4-5d0ea1b4a2f6"
+        key = records.uuid_key(port_id)
+        self.assertEqual(16, len(key))
+        self.assertEqual(port_id, records.key_to_id(key))
+        self.assertEqual("port-1",
+                         records.key_to_id(records.uuid_key("port-1")))
+
+    def test_sixteen_character_ids_kept(self):
+        self.assertEqual("net-0123456789ab",
+                         records.key_to_id(
+                             records.uuid_key("net-0123456789ab")))
+        self.assertEqual(b"0123456789abcdef",
+                         records.key_to_id(b"0123456789abcdef"))
+
+    def test_port_record_from_document(self):
+        port = {"id": "7c1c7b42-7c4f-4bd5-a2b4-5d0ea1b4a2f6",
+                "network_id": "net-1", "tenant_id": "tenant-1",
+                "device_id": "", "binding:host_id": "compute-1"}
+        record = records.PortRecord.from_document(port)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual("compute-1", record.host_id)
+        self.assertIsNone(record.device_key)
+        self.assertEqual(record, records.PortRecord.from_document(port))
+        port["binding:host_id"] = "compute-2"
+        self.assertNotEqual(record.fingerprint,
+                            records.PortRecord.from_document(port)
+                            .fingerprint)
+
+    def test_record_table_lookup_by_id(self):
+        table = records.RecordTable()
+        network = {"id": "7c1c7b42-7c4f-4bd5-a2b4-5d0ea1b4a2f6",
+                   "tenant_id": "tenant-1", "state": "DOWN"}
+        table.add(records.NetworkRecord.from_document(network))
+        self.assertIn(network["id"], table)
+        self.assertFalse(table.get(network["id"]).up)
+        self.assertEqual([network["id"]], list(table.ids()))
+        table.pop(network["id"])
+        self.assertEqual(0, len(table))
+
+
+class SyncCheckpointTestCase(base.BaseTestCase):
+    """
+        Test case for fingerprint based sync and its checkpoint
+    """
+
+    def setUp(self):
+        super(SyncCheckpointTestCase, self).setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, 'checkpoint.db')
+        self.networks = [
+            {"id": "7c1c7b42-7c4f-4bd5-a2b4-5d0ea1b4a2f%d" % i,
+             "tenant_id": "tenant-1", "state": "UP", "subnets": []}
+            for i in range(3)]
+        self.driver = mock.MagicMock()
+        self.driver.client_sdn.read_generation.return_value = None
+        self.driver.iter_mapped_networks.side_effect = \
+            lambda: iter(self.networks)
+
+    def _service(self):
+        return sync.SyncService(self.driver,
+                                checkpoint.Checkpoint(self.path), 0)
+
+    def test_checkpoint_round_trip(self):
+        service = self._service()
+        service.synchronize()
+        last_sync, networks = checkpoint.Checkpoint(self.path).load()
+        self.assertEqual(service.last_sync, last_sync)
+        self.assertEqual(sorted(service.networks.ids()),
+                         sorted(networks.ids()))
+        for record in networks:
+            self.assertEqual(record,
+                             service.networks.get(
+                                 records.key_to_id(record.key)))
+
+    def test_restart_pushes_only_changes(self):
+        self._service().synchronize()
+        client = self.driver.client_sdn
+        self.assertEqual(3, client.rest_create_network.call_count)
+
+        client.reset_mock()
+        self.networks[1]["state"] = "DOWN"
+        removed = self.networks.pop(2)
+        self.assertEqual(2, self._service().synchronize())
+        client.rest_update_network.assert_called_once_with(
+            "tenant-1", self.networks[1]["id"], self.networks[1], [404])
+        client.rest_delete_network.assert_called_once_with(
+            "tenant-1", removed["id"])
+        self.assertFalse(client.rest_create_network.called)
+
+    def test_failed_push_is_retried(self):
+        client = self.driver.client_sdn
+        client.rest_create_network.side_effect = \
+            clients.RemoteRestError("down")
+        client.rest_update_network.side_effect = \
+            clients.RemoteRestError("down")
+        service = self._service()
+        service.synchronize()
+        self.assertEqual(0, len(service.networks))
+        self.assertIsNone(service.last_sync)
+
+        client.rest_create_network.side_effect = None
+        client.rest_update_network.side_effect = None
+        self.assertEqual(3, service.synchronize())
+        self.assertEqual(0, service.synchronize())
+
+    def test_push_falls_back_only_when_controller_disagrees(self):
+        client = self.driver.client_sdn
+        client.rest_create_network.return_value = (409, 'Conflict', None,
+                                                   None)
+        service = self._service()
+        self.assertEqual(3, service.synchronize())
+        self.assertEqual(3, client.rest_update_network.call_count)
+        self.assertEqual(3, len(service.networks))
+
+        client.reset_mock()
+        self.networks[0]["state"] = "DOWN"
+        self.networks[1]["state"] = "DOWN"
+        client.rest_update_network.side_effect = [
+            clients.RemoteRestError("bad request", 400),
+            (404, 'Not Found', None, None)]
+        service.synchronize()
+        self.assertEqual(2, client.rest_update_network.call_count)
+        client.rest_create_network.assert_called_once_with(
+            "tenant-1", self.networks[1])
+
+    def test_postcommit_pushes_are_not_repeated(self):
+        client = self.driver.client_sdn
+        service = self._service()
+        service.synchronize()
+        client.reset_mock()
+        self.networks[0]["state"] = "DOWN"
+        service.pushed(self.networks[0]["id"])
+        self.assertEqual(0, service.synchronize())
+        self.assertFalse(client.rest_update_network.called)
+        self.assertFalse(service.networks.get(self.networks[0]["id"]).up)
+
+        service.deleted(self.networks.pop()["id"])
+        self.assertEqual(0, service.synchronize())
+        self.assertFalse(client.rest_delete_network.called)
+
+    def test_partitioned_sync_by_tenant(self):
+        for i, network in enumerate(self.networks):
+            network["tenant_id"] = "tenant-%d" % (i % 2)
+        by_tenant = lambda tenant_id=None: iter(
+            [n for n in self.networks if n["tenant_id"] == tenant_id])
+        self.driver.iter_mapped_networks.side_effect = by_tenant
+        self.driver.get_network_tenant_ids.return_value = ["tenant-0",
+                                                           "tenant-1"]
+        service = sync.SyncService(self.driver,
+                                   checkpoint.Checkpoint(self.path), 0,
+                                   workers=2, max_inflight=2)
+        self.addCleanup(service.stop)
+        client = self.driver.client_sdn
+
+        self.assertEqual(3, service.synchronize())
+        self.assertEqual(3, client.rest_create_network.call_count)
+        self.assertEqual(3, len(service.networks))
+        self.assertEqual(2, service.progress["tenants_done"])
+
+        removed = self.networks.pop()
+        self.driver.get_network_tenant_ids.return_value = ["tenant-1"]
+        self.networks[1]["state"] = "DOWN"
+        self.assertEqual(2, service.synchronize())
+        client.rest_delete_network.assert_called_once_with(
+            removed["tenant_id"], removed["id"])
+        client.rest_update_network.assert_called_once_with(
+            "tenant-1", self.networks[1]["id"], self.networks[1], [404])
+        self.assertEqual(0, service.synchronize())
+
+    def test_partitioned_sync_continues_past_unreadable_tenant(self):
+        def by_tenant(tenant_id=None):
+            if tenant_id == "tenant-0":
+                raise RuntimeError("db gone")
+            return iter(self.networks)
+        self.driver.iter_mapped_networks.side_effect = by_tenant
+        self.driver.get_network_tenant_ids.return_value = ["tenant-0",
+                                                           "tenant-1"]
+        service = sync.SyncService(self.driver, None, 0, workers=2)
+
+        self.assertEqual(3, service.synchronize())
+        self.assertEqual(3, len(service.networks))
+        self.assertEqual(1, service.progress["failed"])
+        self.assertIsNone(service.last_sync)
+
+    def test_unreadable_checkpoint_loads_empty(self):
+        with open(self.path, 'w') as f:
+            f.write('not a database')
+        last_sync, networks = checkpoint.Checkpoint(self.path).load()
+        self.assertIsNone(last_sync)
+        self.assertEqual(0, len(networks))
+
+
+class ChangeFeedTestCase(base.BaseTestCase):
+    """
+        Test case for change feed driven reconciliation
+    """
+
+    def setUp(self):
+        super(ChangeFeedTestCase, self).setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.store = checkpoint.Checkpoint(
+            os.path.join(self.workdir, 'checkpoint.db'))
+        self.client = mock.MagicMock()
+        self.client.feed_groups.return_value = {'default': ['server']}
+        self.reconcile = mock.MagicMock(return_value=0)
+        self.full_sync = mock.MagicMock()
+
+    def _feed(self):
+        service = sync.SyncService(mock.MagicMock(), self.store)
+        service.reconcile = self.reconcile
+        return changefeed.ChangeFeed(self.client, service, self.full_sync,
+                                     threading.Lock(), wait=1,
+                                     failure_limit=2)
+
+    def test_changes_reconciled_and_cursor_persisted(self):
+        changes = [{'type': 'network', 'id': 'net-1',
+                    'tenant_id': 'tenant-1'}]
+        self.client.rest_get_changes.return_value = {'cursor': '7',
+                                                     'changes': changes}
+        self._feed().poll('default')
+        self.reconcile.assert_called_once_with(changes)
+
+        self.client.rest_get_changes.reset_mock()
+        self._feed().poll('default')
+        self.client.rest_get_changes.assert_called_once_with(['server'],
+                                                             '7', 1)
+
+    def test_failed_reconcile_keeps_cursor(self):
+        self.client.rest_get_changes.return_value = {
+            'cursor': '7', 'changes': [{'type': 'network', 'id': 'n'}]}
+        self.reconcile.return_value = 1
+        feed = self._feed()
+        feed.poll('default')
+        self.assertIsNone(feed.cursors.get('default'))
+        self.assertEqual({}, self.store.load_cursors())
+
+    def test_reset_runs_full_sync(self):
+        self.client.rest_get_changes.return_value = {'cursor': '9',
+                                                     'changes': [],
+                                                     'reset': True}
+        feed = self._feed()
+        feed.poll('default')
+        self.full_sync.assert_called_once_with()
+        self.assertEqual('9', feed.cursors['default'])
+
+    def test_lost_feed_is_unhealthy_until_it_recovers(self):
+        feed = self._feed()
+        feed._threads.append(mock.Mock())
+        self.client.rest_get_changes.side_effect = \
+            clients.RemoteRestError("down")
+        feed.poll('default')
+        self.assertTrue(feed.healthy())
+        feed.poll('default')
+        self.assertFalse(feed.healthy())
+        self.client.rest_get_changes.side_effect = None
+        self.client.rest_get_changes.return_value = {'cursor': '1',
+                                                     'changes': []}
+        feed.poll('default')
+        self.assertTrue(feed.healthy())
+
+    def test_reconcile_pushes_reported_networks(self):
+        network = {"id": "net-1", "tenant_id": "tenant-1", "state": "UP"}
+        driver = mock.MagicMock()
+        driver.client_sdn.read_generation.return_value = None
+        driver.iter_mapped_networks.return_value = iter([network])
+        driver.client_sdn.rest_update_network.return_value = (
+            404, 'Not Found', None, None)
+        service = sync.SyncService(driver)
+        failed = service.reconcile([
+            {'type': 'port', 'id': 'port-1', 'network_id': 'net-1',
+             'tenant_id': 'tenant-1'},
+            {'type': 'network', 'id': 'net-2', 'tenant_id': 'tenant-1'}])
+        self.assertEqual(0, failed)
+        driver.iter_mapped_networks.assert_called_once_with(
+            network_ids=mock.ANY)
+        driver.client_sdn.rest_create_network.assert_called_once_with(
+            "tenant-1", network)
+        driver.client_sdn.rest_delete_network.assert_called_once_with(
+            "tenant-1", "net-2")
+        self.assertIn("net-1", service.networks)
+
+
+    def test_reconcile_creates_only_missing_networks(self):
+        network = {"id": "net-1", "tenant_id": "tenant-1", "state": "UP"}
+        driver = mock.MagicMock()
+        driver.iter_mapped_networks.return_value = iter([network])
+        driver.client_sdn.rest_update_network.side_effect = \
+            clients.RemoteRestError("timed out", 0)
+        service = sync.SyncService(driver)
+        self.assertEqual(1, service.reconcile([
+            {'type': 'network', 'id': 'net-1', 'tenant_id': 'tenant-1'}]))
+        self.assertFalse(driver.client_sdn.rest_create_network.called)
+        self.assertNotIn("net-1", service.networks)
+
+    def test_cursor_saved_with_reconciled_networks(self):
+        network = {"id": "7c1c7b42-7c4f-4bd5-a2b4-5d0ea1b4a2f6",
+                   "tenant_id": "tenant-1", "state": "UP"}
+        service = sync.SyncService(mock.MagicMock(), self.store,
+                                   checkpoint_interval=300)
+        service._record(records.NetworkRecord.from_document(network))
+        service.save_cursor('default', '7')
+
+        self.assertIsNone(service.last_checkpoint)
+        self.assertEqual({'default': '7'}, self.store.load_cursors())
+        self.assertIn(network["id"], self.store.load()[1])
+        service._forget(network["id"])
+        service.save_cursor('default', '8')
+        self.assertNotIn(network["id"], self.store.load()[1])
+        self.assertEqual({'default': '8'},
+                         sync.SyncService(None, self.store).cursors)
+
+
+class TracingTestCase(base.BaseTestCase):
+    """
+        Test case for request tracing
+    """
+
+    def setUp(self):
+        super(TracingTestCase, self).setUp()
+        self.exporter = tracing.InMemoryExporter(capacity=2)
+        tracing.add_exporter(self.exporter)
+        self.addCleanup(tracing.remove_exporter, self.exporter)
+
+    def test_request_id_sent_and_http_span_recorded(self):
+        proxy = clients.ServerProxy("127.0.0.1", 1, False, None, "nid", 1,
+                                    clients.BASE_URI, "test")
+        headers = {"X-Test": "1"}
+        with tracing.trace("op", "req-1"):
+            proxy.rest_call("PUT", "/tenants/t1/networks/n1", {}, headers)
+        self.assertEqual("req-1", headers[tracing.REQUEST_ID_HEADER])
+        trace, = self.exporter.find("req-1")
+        span, = trace.spans
+        self.assertEqual("http", span.name)
+        self.assertEqual(0, span.tags["status"])
+
+    def test_nested_spans_and_slowest(self):
+        with tracing.trace("fast"):
+            pass
+        with tracing.trace("slow", "req-2"):
+            with tracing.span("outer"):
+                with tracing.span("inner"):
+                    time.sleep(0.01)
+            with tracing.trace("nested"):
+                pass
+        trace, = self.exporter.slowest(1)
+        self.assertEqual("req-2", trace.request_id)
+        self.assertEqual([("inner", 1), ("outer", 0), ("nested", 0)],
+                         [(s.name, s.depth) for s in trace.spans])
+
+    def test_no_exporter_only_propagates_request_id(self):
+        tracing.remove_exporter(self.exporter)
+        with tracing.trace("op"):
+            self.assertTrue(tracing.current_request_id().startswith("req-"))
+            with tracing.span("db"):
+                pass
+        self.assertEqual(0, len(self.exporter.traces))
+
+
+class DiagnosticsTestCase(base.BaseTestCase):
+    """
+        Test case for the slow call log and the sampling profiler
+    """
+
+    def _call(self, duration, resource):
+        return clients.SlowCall(0.0, duration, 'PUT', resource, 0, None,
+                                200, 0, {}, None)
+
+    def test_slow_call_log_keeps_slowest(self):
+        log = clients.SlowCallLog(size=2, threshold=0.1)
+        for duration, resource in [(0.2, 'a'), (0.05, 'b'), (0.5, 'c'),
+                                   (0.3, 'd')]:
+            log.record(self._call(duration, resource))
+        self.assertEqual(['c', 'd'], [c.resource for c in log.calls()])
+
+    def test_failed_call_recorded_with_phases(self):
+        client = clients.SdnClient("127.0.0.1", 1, timeout=1,
+                                   slow_call_log_size=5)
+        client.rest_action('PUT', '/tenants/t1/networks/n1', {},
+                           ignore_codes=[0])
+        call, = client.slow_calls.calls()
+        self.assertEqual('/tenants/t1/networks/n1', call.resource)
+        self.assertEqual(0, call.status)
+        self.assertEqual('127.0.0.1:1', call.server)
+        self.assertIn('lock_wait', call.phases)
+        self.assertIn('connect', call.phases)
+
+    def test_profiler_samples_slow_operation_only(self):
+        profiler = profiling.SamplingProfiler(threshold=0.05,
+                                              interval=0.005)
+        with profiler.profile('fast'):
+            pass
+        with profiler.profile('slow', 'req-1'):
+            time.sleep(0.2)
+        profile, = profiler.profiles
+        self.assertEqual(('slow', 'req-1'),
+                         (profile.name, profile.request_id))
+        self.assertTrue(profile.samples > 0)
+        stack = profile.stacks[0][0]
+        self.assertIn('test_profiler_samples_slow_operation_only', stack)
+
+    def test_profiler_stop_joins_sampler(self):
+        profiler = profiling.SamplingProfiler(threshold=10, interval=0.005)
+        with profiler.profile('op'):
+            sampler = profiler._sampler
+        self.assertTrue(sampler.is_alive())
+        profiler.stop()
+        self.assertFalse(sampler.is_alive())
+        with profiler.profile('op'):
+            self.assertIsNone(profiler._sampler)
+
+
+class BatchCollectorTestCase(base.BaseTestCase):
+    """
+        Test case for batching of controller requests
+    """
+
+    def _add_concurrently(self, collector, items, flush):
+        results = {}
+
+        def add(key, item):
+            try:
+                results[item] = collector.add(key, item, flush)
+            except Exception as e:
+                results[item] = e
+        threads = [threading.Thread(target=add, args=item) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_items_of_a_key_flushed_together(self):
+        collector = batching.BatchCollector(window=0.2)
+        flushes = []
+
+        def flush(key, items):
+            flushes.append((key, sorted(items)))
+            return len(items)
+        results = self._add_concurrently(
+            collector, [('r1', 1), ('r1', 2), ('r2', 3), ('r1', 4)], flush)
+        self.assertEqual([('r1', [1, 2, 4]), ('r2', [3])], sorted(flushes))
+        self.assertEqual({1: 3, 2: 3, 3: 1, 4: 3}, results)
+
+    def test_full_batch_flushed_before_window(self):
+        collector = batching.BatchCollector(window=10, size=2)
+        start = time.time()
+        results = self._add_concurrently(
+            collector, [('r1', 1), ('r1', 2)], lambda key, items: items)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(2, len(results[1]))
+
+    def test_batches_of_a_key_flushed_in_order(self):
+        collector = batching.BatchCollector(window=0, size=1)
+        first_flushing = threading.Event()
+        release = threading.Event()
+        flushes = []
+
+        def flush(key, items):
+            if items == [1]:
+                first_flushing.set()
+                release.wait(5)
+            flushes.append(items)
+        first = threading.Thread(target=collector.add, args=('r1', 1, flush))
+        first.start()
+        first_flushing.wait(5)
+        second = threading.Thread(target=collector.add,
+                                  args=('r1', 2, flush))
+        second.start()
+        second.join(0.2)
+        self.assertEqual([], flushes)
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual([[1], [2]], flushes)
+
+    def test_items_grouped_while_a_flush_is_in_flight(self):
+        collector = batching.BatchCollector(window=0)
+        first_flushing = threading.Event()
+        release = threading.Event()
+        flushes = []
+
+        def flush(key, items):
+            if items == [1]:
+                first_flushing.set()
+                release.wait(5)
+            flushes.append(sorted(items))
+        first = threading.Thread(target=collector.add, args=('r1', 1, flush))
+        first.start()
+        first_flushing.wait(5)
+        others = [threading.Thread(target=collector.add,
+                                   args=('r1', item, flush))
+                  for item in (2, 3)]
+        for thread in others:
+            thread.start()
+        while len(getattr(collector._open.get('r1'), 'items', ())) < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in [first] + others:
+            thread.join()
+        self.assertEqual([[1], [2, 3]], flushes)
+
+    def test_flush_error_raised_in_every_caller(self):
+        collector = batching.BatchCollector(window=0.2)
+
+        def flush(key, items):
+            raise clients.RemoteRestError("error")
+        results = self._add_concurrently(collector, [('r1', 1), ('r1', 2)],
+                                         flush)
+        self.assertTrue(all(isinstance(e, clients.RemoteRestError)
+                            for e in results.values()))
+
+
+def _put_in_shared_cache(path, resource_id, value):
+    cache = shared_cache.SharedCache(path, slots=64)
+    version = cache.get(resource_id)[1]
+    cache.put(resource_id, value, version)
+
+
+class SharedCacheTestCase(base.BaseTestCase):
+    """
+        Test case for the cache shared by the API workers
+    """
+
+    def setUp(self):
+        super(SharedCacheTestCase, self).setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, 'cache')
+
+    def test_value_put_by_other_process_is_seen(self):
+        cache = shared_cache.SharedCache(self.path, slots=64)
+        self.assertEqual(None, cache.get('net-1')[0])
+        worker = multiprocessing.Process(
+            target=_put_in_shared_cache, args=(self.path, 'net-1', b'\x01t1'))
+        worker.start()
+        worker.join()
+        self.assertEqual(b'\x01t1', cache.get('net-1')[0])
+        cache.invalidate('net-1')
+        self.assertEqual(None, cache.get('net-1')[0])
+
+    def _test_stale_put_rejected(self, cache):
+        value, version = cache.get('net-1')
+        cache.invalidate('net-1')
+        self.assertFalse(cache.put('net-1', b'stale', version))
+        self.assertEqual(None, cache.get('net-1')[0])
+        value, version = cache.get('net-1')
+        self.assertTrue(cache.put('net-1', b'fresh', version))
+        self.assertEqual(b'fresh', cache.get('net-1')[0])
+
+    def test_stale_put_rejected(self):
+        self._test_stale_put_rejected(
+            shared_cache.SharedCache(self.path, slots=64))
+
+    def test_entries_expire_across_restart(self):
+        cache = shared_cache.SharedCache(self.path, slots=64, ttl=30)
+        cache.put('net-1', b'\x00t1', cache.get('net-1')[1])
+        cache.close()
+        cache = shared_cache.SharedCache(self.path, slots=64, ttl=30)
+        self.assertEqual(b'\x00t1', cache.get('net-1')[0])
+        with mock.patch.object(shared_cache.time, "time",
+                               return_value=time.time() + 31):
+            self.assertEqual(None, cache.get('net-1')[0])
+
+    def test_falls_back_to_local_cache(self):
+        cache = shared_cache.create_cache(
+            os.path.join(self.workdir, 'missing', 'cache'), slots=64)
+        self.assertIsInstance(cache, shared_cache.LocalCache)
+        self._test_stale_put_rejected(cache)
+
+
+class GenerationTestCase(base.BaseTestCase):
+    """
+        Test case for the write generations of the controller client
+    """
+
+    def setUp(self):
+        super(GenerationTestCase, self).setUp()
+        self.client = clients.SdnClient("127.0.0.1", 1, generations=True)
+        self.client.servers[0].capabilities = {'bulk': True}
+        self.rest_call = mock.patch.object(
+            self.client, 'rest_call',
+            return_value=(200, 'OK', None, None)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_clock_increases_when_time_stalls_or_steps_back(self):
+        now = [2.0]
+        clock = clients.GenerationClock(clock=lambda: now[0])
+        first = clock.next()
+        second = clock.next()
+        now[0] = 1.0
+        third = clock.next()
+        now[0] = 3.0
+        self.assertEqual([2000000, 2000001, 2000002, 3000000],
+                         [first, second, third, clock.next()])
+
+    def test_writes_carry_increasing_generations(self):
+        network = {'id': 'n1', 'name': 'net'}
+        self.client.rest_update_network('t1', 'n1', network)
+        self.client.rest_add_router_interfaces('t1', 'r1', [{'id': 'p1'},
+                                                            {'id': 'p2'}])
+        self.client.rest_delete_network('t1', 'n1')
+        update, add, delete = [c[0] for c in self.rest_call.call_args_list]
+        self.assertNotIn(clients.GENERATION_KEY, network)
+        first, second = [i[clients.GENERATION_KEY]
+                         for i in add[2]['interfaces']]
+        self.assertEqual(first, second)
+        self.assertTrue(update[2]['network'][clients.GENERATION_KEY] <
+                        first <
+                        int(delete[3][clients.GENERATION_HEADER]))
+
+    def test_documents_keep_generation_of_their_read(self):
+        old = clients.with_generation({'id': 'n1', 'name': 'old'},
+                                      self.client.read_generation())
+        new = clients.with_generation({'id': 'n1', 'name': 'new'},
+                                      self.client.read_generation())
+        # the document read first is sent last
+        self.client.rest_update_network('t1', 'n1', new)
+        self.client.rest_update_network('t1', 'n1', old)
+        sent = [c[0][2]['network'] for c in self.rest_call.call_args_list]
+        self.assertEqual([new, old], sent)
+        self.assertTrue(old[clients.GENERATION_KEY] <
+                        new[clients.GENERATION_KEY])
+
+    def test_merged_update_keeps_newest_read(self):
+        old = {'network': {'id': 'n1', clients.GENERATION_KEY: 1}}
+        new = {'network': {'id': 'n1', clients.GENERATION_KEY: 2}}
+        self.assertEqual((new, None),
+                         clients._newest_request((new, None), (old, None)))
+        self.assertEqual((new, None),
+                         clients._newest_request((old, None), (new, None)))
+
+    def test_generations_off_by_default(self):
+        client = clients.SdnClient("127.0.0.1", 1)
+        self.assertIsNone(client.read_generation())
+        opt = [o for o in clients.restproxy_opts
+               if o.name == 'resource_generations'][0]
+        self.assertFalse(opt.default)
+
+    def test_stale_write_is_not_an_error(self):
+        self.rest_call.return_value = (clients.STALE_GENERATION, 'Conflict',
+                                       None, None)
+        self.client.rest_update_port('t1', 'n1', {'id': 'p1'}, 'p1')
+        self.assertEqual(1, self.rest_call.call_count)
@@ -14,11 +14,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
+
 import mock
 
+from neutron.extensions import l3
 from neutron.plugins.ml2.drivers.huawei import clients as client
+from neutron.plugins.ml2.drivers.huawei import dispatcher
 from neutron.plugins.ml2.drivers.huawei import exceptions as ml2_exc
+from neutron.plugins.ml2.drivers.huawei import l3_router_huawei
 from neutron.plugins.ml2.drivers.huawei import mechanism_huawei as huawei
+from neutron.plugins.ml2.drivers.huawei import profiling
+from neutron.plugins.ml2.drivers.huawei import tracing
+from neutron.services.l3_router import l3_router_plugin
 
 from neutron.tests import base
 
@@ -32,6 +41,19 @@ class HuaweiDriverTestCase(base.BaseTestCase):
         super(HuaweiDriverTestCase, self).setUp()
         self.drv = huawei.HuaweiDriver()
         self.drv.client_sdn = mock.MagicMock()
+        self.drv.client_sdn.read_generation.return_value = None
+
+    def test_initialize_builds_client_and_prewarms(self):
+        drv = huawei.HuaweiDriver()
+        self.assertNotIn('db_base_plugin_v2', drv.__dict__)
+        self.assertIsNone(drv.client_sdn)
+        with mock.patch.object(huawei, 'create_client') as create_client:
+            drv.initialize()
+        for thread in threading.enumerate():
+            if thread.name == 'huawei-prewarm':
+                thread.join()
+        self.assertIs(create_client.return_value, drv.client_sdn)
+        drv.client_sdn.prewarm.assert_called_once_with(2)
 
     def test_create_network_on_valid_config(self):
         tenant_id = "tenant-1"
@@ -143,6 +165,26 @@ class HuaweiDriverTestCase(base.BaseTestCase):
         self.drv.client_sdn.rest_delete_network. \
             assert_called_once_with(tenant_id, network_id)
 
+    def test_delete_network_sends_cascaded_deletes(self):
+        network_context = self._get_network_context("tenant-1", "net-1",
+                                                    10001)
+        port_context = self._get_port_context("tenant-1", "net-1", "dhcp",
+                                              network_context)
+        subnet_context = self._get_subnet_context("tenant-1", "net-1")
+        self.drv.db_base_plugin_v2.get_network = mock.MagicMock(
+            return_value=network_context.current)
+        self.drv._get_mapped_network_with_subnets = mock.MagicMock()
+
+        # the order of Ml2Plugin.delete_network
+        self.drv.delete_port_postcommit(port_context)
+        self.drv.delete_subnet_postcommit(subnet_context)
+        self.drv.delete_network_postcommit(network_context)
+
+        self.assertEqual(["rest_delete_port", "rest_unplug_interface",
+                          "rest_update_network", "rest_delete_network"],
+                         [c[0] for c in self.drv.client_sdn.method_calls
+                          if c[0].startswith("rest_")])
+
     def test_delete_network_on_controller_fail(self):
         tenant_id = "tenant-1"
         network_id = "net-1"
@@ -182,6 +224,93 @@ class HuaweiDriverTestCase(base.BaseTestCase):
         self.drv.client_sdn.rest_plug_interface. \
             assert_called_once_with(tenant_id, network_id, port_info, vm_id)
 
+    def test_create_port_dispatched_as_interactive(self):
+        tenant_id = "tenant-1"
+        network_id = "net-1"
+        segmentation_id = 10001
+        vm_id = "vm-1"
+        network_context = self._get_network_context(tenant_id,
+                                                    network_id,
+                                                    segmentation_id)
+        port_context = self._get_port_context(tenant_id,
+                                              network_id,
+                                              vm_id,
+                                              network_context)
+        self.drv.db_base_plugin_v2._get_network = mock.MagicMock()
+        self.drv.db_base_plugin_v2._get_network.return_value = \
+            network_context.current
+
+        priorities = []
+        for method in ('rest_create_port', 'rest_plug_interface'):
+            getattr(self.drv.client_sdn, method).side_effect = \
+                lambda *args: priorities.append(
+                    dispatcher.current_priority())
+
+        self.drv.create_port_postcommit(port_context)
+
+        self.assertEqual([dispatcher.PRIORITY_INTERACTIVE] * 2, priorities)
+
+    def test_create_port_traced_with_request_id(self):
+        network_context = self._get_network_context("tenant-1", "net-1",
+                                                    10001)
+        port_context = self._get_port_context("tenant-1", "net-1", "vm-1",
+                                              network_context)
+        port_context._plugin_context = mock.Mock(request_id="req-42")
+        self.drv.db_base_plugin_v2._get_network = mock.MagicMock()
+        self.drv.db_base_plugin_v2._get_network.return_value = \
+            network_context.current
+        exporter = tracing.InMemoryExporter()
+        tracing.add_exporter(exporter)
+        self.addCleanup(tracing.remove_exporter, exporter)
+        request_ids = []
+        self.drv.client_sdn.rest_create_port.side_effect = \
+            lambda *args: request_ids.append(tracing.current_request_id())
+
+        self.drv.create_port_postcommit(port_context)
+
+        self.assertEqual(["req-42"], request_ids)
+        trace, = exporter.find("req-42")
+        self.assertEqual("create_port_postcommit", trace.name)
+        # dispatch_wait is recorded by the client, mocked here
+        self.assertEqual(["db"], [span.name for span in trace.spans])
+        self.assertIsNone(tracing.current_request_id())
+
+    def test_network_meta_cached_until_network_update(self):
+        network_context = self._get_network_context("tenant-1", "net-1",
+                                                    10001)
+        port_context = self._get_port_context("tenant-1", "net-1", "vm-1",
+                                              network_context)
+        network_context.current["name"] = "net"
+        self.drv.db_base_plugin_v2._get_network = mock.MagicMock(
+            return_value=network_context.current)
+
+        self.drv.create_port_postcommit(port_context)
+        self.drv.create_port_postcommit(port_context)
+        self.assertEqual(1, self.drv.db_base_plugin_v2._get_network.call_count)
+        self.drv.client_sdn.rest_create_port.assert_called_with(
+            {"id": "net-1", "tenant_id": "tenant-1"}, port_context.current)
+
+        self.drv.update_network_postcommit(network_context)
+        self.drv.create_port_postcommit(port_context)
+        self.assertEqual(2, self.drv.db_base_plugin_v2._get_network.call_count)
+
+    def test_dump_diagnostics(self):
+        self.drv.client_sdn.slow_calls = client.SlowCallLog()
+        self.drv.client_sdn.slow_calls.record(client.SlowCall(
+            0.0, 1.5, 'PUT', '/tenants/t1/networks/n1', 10, '10.0.0.1:8800',
+            200, 1, {'response': 1.4}, 'req-1'))
+        self.drv.profiler = profiling.SamplingProfiler()
+        self.drv.profiler.profiles.append(profiling.Profile(
+            'create_port_postcommit', 'req-1', 0.0, 1.5, 3,
+            [('a:f:1;b:g:2', 3)]))
+
+        diagnostics = self.drv.dump_diagnostics()
+
+        call, = diagnostics['slow_calls']
+        self.assertEqual(('PUT', 1), (call['method'], call['retries']))
+        profile, = diagnostics['profiles']
+        self.assertEqual('create_port_postcommit', profile['name'])
+
     def test_create_port_on_controller_fail(self):
         tenant_id = "tenant-1"
         network_id = "net-1"
@@ -372,6 +501,26 @@ class HuaweiDriverTestCase(base.BaseTestCase):
         self.drv.client_sdn.rest_update_network.\
             assert_called_once_with(tenant_id, network_id, net_info)
 
+    def test_update_subnet_dispatched_without_sync_lock(self):
+        subnet_context = self._get_subnet_context('tenant-1', 'net-1')
+        self.drv.db_base_plugin_v2.get_network = mock.MagicMock(
+            return_value={'id': 'net-1', 'tenant_id': 'tenant-1'})
+        self.drv._get_mapped_network_with_subnets = mock.MagicMock(
+            return_value={'id': 'net-1'})
+        locked = []
+
+        def call(*args):
+            # a held lock cannot be acquired again without blocking
+            acquired = self.drv.sdn_sync_lock.acquire(False)
+            if acquired:
+                self.drv.sdn_sync_lock.release()
+            locked.append(not acquired)
+        self.drv.client_sdn.rest_update_network.side_effect = call
+
+        self.drv.update_subnet_postcommit(subnet_context)
+
+        self.assertEqual([False], locked)
+
     def test_update_subnet_on_controller_fail(self):
         tenant_id = "tenant-1"
         network_id = "net-1"
@@ -453,6 +602,149 @@ class HuaweiDriverTestCase(base.BaseTestCase):
                           self.drv.delete_subnet_postcommit,
                           subnet_context)
 
+    def test_mapped_network_with_subnets(self):
+        network = {'id': 'net-1', 'tenant_id': 'tenant-1',
+                   'admin_state_up': False, 'status': 'ACTIVE'}
+        subnets = [{'id': 'subnet-1', 'gateway_ip': None},
+                   {'id': 'subnet-2', 'gateway_ip': '10.0.1.1'}]
+        self.drv.db_base_plugin_v2 = mock.MagicMock()
+        self.drv.db_base_plugin_v2._get_subnets_by_network.return_value = \
+            subnets
+        self.drv.db_base_plugin_v2._make_subnet_dict.side_effect = dict
+        self.drv.external_net_db = mock.MagicMock()
+        self.drv.external_net_db._network_is_external.return_value = False
+
+        mapped = self.drv._get_mapped_network_with_subnets(network,
+                                                          mock.MagicMock())
+
+        self.assertEqual('DOWN', mapped['state'])
+        self.assertNotIn('status', mapped)
+        self.assertEqual('10.0.1.1', mapped['gateway'])
+        self.assertEqual(['UP', 'UP'],
+                         [s['state'] for s in mapped['subnets']])
+        self.assertEqual({'id': 'net-1', 'tenant_id': 'tenant-1',
+                          'admin_state_up': False, 'status': 'ACTIVE'},
+                         network)
+
+    def test_iter_mapped_networks_in_chunks(self):
+        networks = dict(('net-%d' % i, {'id': 'net-%d' % i,
+                                         'tenant_id': 'tenant-1',
+                                         'admin_state_up': True,
+                                         'status': 'ACTIVE'})
+                        for i in range(3))
+        subnets = [{'id': 'subnet-1', 'network_id': 'net-0',
+                    'gateway_ip': '10.0.0.1'},
+                   {'id': 'subnet-2', 'network_id': 'net-2',
+                    'gateway_ip': None}]
+
+        def fetch(context, network_ids, tenant_id=None):
+            return ([networks[i] for i in network_ids],
+                    [s for s in subnets if s['network_id'] in network_ids],
+                    set(['net-2']) & set(network_ids))
+
+        self.drv._fetch_network_chunk = mock.MagicMock(side_effect=fetch)
+        self.drv.db_base_plugin_v2 = mock.MagicMock()
+        self.drv.db_base_plugin_v2._make_subnet_dict.side_effect = dict
+        self.drv.db_base_plugin_v2._make_network_dict.side_effect = \
+            lambda network, process_extensions=True: dict(network)
+
+        docs = list(self.drv.iter_mapped_networks(
+            network_ids=['net-2', 'net-0', 'net-1'], context=mock.Mock(),
+            chunk_size=2))
+
+        self.assertEqual(2, self.drv._fetch_network_chunk.call_count)
+        self.assertEqual(['net-0', 'net-1', 'net-2'],
+                         [doc['id'] for doc in docs])
+        self.assertEqual(['subnet-1'],
+                         [s['id'] for s in docs[0]['subnets']])
+        self.assertEqual('10.0.0.1', docs[0]['gateway'])
+        self.assertEqual([], docs[1]['subnets'])
+        self.assertEqual('', docs[2]['gateway'])
+        self.assertEqual([False, False, True],
+                         [doc['router:external'] for doc in docs])
+        self.assertEqual(['UP'] * 3, [doc['state'] for doc in docs])
+
+    def _postcommit_concurrently(self, postcommit, contexts):
+        errors = {}
+
+        def run(context):
+            try:
+                postcommit(context)
+            except ml2_exc.MechanismDriverError as e:
+                errors[context.current['id']] = e
+        threads = [threading.Thread(target=run, args=(context,))
+                   for context in contexts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrently_created_networks_sent_in_one_request(self):
+        self.drv.create_batches.window = 0.5
+        self.drv._get_mapped_network_with_subnets = mock.MagicMock(
+            side_effect=lambda network: dict(network, state='UP'))
+        client_sdn = self.drv.client_sdn
+        client_sdn.rest_create_networks.return_value = {
+            'net-0': None, 'net-1': 'rejected', 'net-2': None}
+        # ML2 runs the precommit and postcommit of a network before the
+        # next one, so only concurrent requests are collected
+        contexts = [self._get_network_context("tenant-1", "net-%d" % i,
+                                              10001 + i) for i in range(3)]
+
+        errors = self._postcommit_concurrently(
+            self.drv.create_network_postcommit, contexts)
+
+        self.assertEqual(['net-1'], list(errors))
+        self.assertFalse(client_sdn.rest_create_network.called)
+        (tenant_id, networks), kwargs = \
+            client_sdn.rest_create_networks.call_args
+        self.assertEqual(1, client_sdn.rest_create_networks.call_count)
+        self.assertEqual('tenant-1', tenant_id)
+        self.assertEqual(['net-0', 'net-1', 'net-2'],
+                         sorted(network['id'] for network in networks))
+
+    def test_sequential_networks_sent_on_their_own_by_default(self):
+        self.assertEqual(0, self.drv.create_batches.window)
+        self.drv._get_mapped_network_with_subnets = mock.MagicMock(
+            side_effect=lambda network: dict(network))
+        for i in range(2):
+            self.drv.create_network_postcommit(self._get_network_context(
+                "tenant-1", "net-%d" % i, 10001 + i))
+
+        client_sdn = self.drv.client_sdn
+        self.assertEqual(2, client_sdn.rest_create_network.call_count)
+        self.assertFalse(client_sdn.rest_create_networks.called)
+
+    def test_concurrently_created_subnets_update_each_network_once(self):
+        self.drv.create_batches.window = 0.5
+        self.drv.db_base_plugin_v2.get_network = mock.MagicMock(
+            side_effect=lambda ctx, net_id: {'id': net_id,
+                                             'tenant_id': 'tenant-1'})
+        self.drv._get_mapped_network_with_subnets = mock.MagicMock(
+            side_effect=lambda network, context: dict(network))
+        client_sdn = self.drv.client_sdn
+        client_sdn.rest_update_networks.return_value = {'net-1': None,
+                                                        'net-2': None}
+        contexts = []
+        for subnet_id, net_id in [('subnet-1', 'net-1'),
+                                  ('subnet-2', 'net-1'),
+                                  ('subnet-3', 'net-2')]:
+            context = self._get_subnet_context("tenant-1", net_id)
+            context.current['id'] = subnet_id
+            contexts.append(context)
+
+        errors = self._postcommit_concurrently(
+            self.drv.create_subnet_postcommit, contexts)
+
+        self.assertEqual({}, errors)
+        self.assertFalse(client_sdn.rest_update_network.called)
+        (tenant_id, networks), kwargs = \
+            client_sdn.rest_update_networks.call_args
+        self.assertEqual(1, client_sdn.rest_update_networks.call_count)
+        self.assertEqual(['net-1', 'net-2'],
+                         sorted(network['id'] for network in networks))
+
     def _get_network_context(self, tenant_id, net_id, seg_id):
         network = {"id": net_id,
                    "tenant_id": tenant_id}
@@ -481,6 +773,275 @@ class HuaweiDriverTestCase(base.BaseTestCase):
         return FakeSubnetContext(subnet, subnet)
 
 
+class HuaweiL3RouterPluginTestCase(base.BaseTestCase):
+    """
+        Test case for the Huawei L3 router service plugin
+    """
+
+    def setUp(self):
+        super(HuaweiL3RouterPluginTestCase, self).setUp()
+        for name in ('__init__', 'create_router', 'update_router',
+                     'delete_router', 'get_router', 'add_router_interface',
+                     'remove_router_interface', 'update_floatingip',
+                     'get_floatingip', 'delete_floatingip',
+                     'get_floatingips', 'disassociate_floatingips'):
+            patcher = mock.patch.object(l3_router_plugin.L3RouterPlugin,
+                                        name, create=True)
+            self.addCleanup(patcher.stop)
+            setattr(self, 'parent_' + name.strip('_'), patcher.start())
+        self.parent_init.return_value = None
+        self.plugin = l3_router_huawei.HuaweiL3RouterPlugin()
+        self.plugin.client_sdn = mock.MagicMock()
+        core_plugin = mock.patch.object(l3_router_huawei.HuaweiL3RouterPlugin,
+                                        '_core_plugin', create=True)
+        self.addCleanup(core_plugin.stop)
+        self.core_plugin = core_plugin.start()
+        self.core_plugin.get_port.side_effect = lambda ctx, port_id: {
+            'id': port_id, 'network_id': 'net-1',
+            'mac_address': 'fa:16:3e:00:00:01',
+            'fixed_ips': [{'ip_address': '10.0.0.1'}]}
+        self.core_plugin.get_network.return_value = {'id': 'ext-net',
+                                                     'tenant_id': 'admin'}
+        self.parent_get_router.return_value = {
+            'id': 'router-1', 'tenant_id': 'tenant-1', 'name': 'r1',
+            'admin_state_up': True, 'status': 'ACTIVE'}
+        self.context = mock.MagicMock(request_id='req-1')
+
+    def test_create_router_rolled_back_on_controller_fail(self):
+        self.parent_create_router.return_value = {
+            'id': 'router-1', 'tenant_id': 'tenant-1',
+            'admin_state_up': True, 'status': 'ACTIVE'}
+        self.plugin.client_sdn.rest_create_router.side_effect = \
+            client.RemoteRestError("error")
+
+        self.assertRaises(client.RemoteRestError, self.plugin.create_router,
+                          self.context, {'router': {}})
+
+        self.plugin.client_sdn.rest_create_router.assert_called_once_with(
+            'tenant-1', {'id': 'router-1', 'tenant_id': 'tenant-1',
+                         'state': 'UP'})
+        self.parent_delete_router.assert_called_once_with(self.context,
+                                                          'router-1')
+
+    def test_update_router_restored_on_controller_fail(self):
+        self.parent_update_router.return_value = dict(
+            self.parent_get_router.return_value, name='r2')
+        self.plugin.client_sdn.rest_update_router.side_effect = \
+            client.RemoteRestError("error")
+
+        self.assertRaises(client.RemoteRestError, self.plugin.update_router,
+                          self.context, 'router-1', {'router': {'name': 'r2'}})
+
+        self.parent_update_router.assert_called_with(
+            self.context, 'router-1', {'router': {'name': 'r1'}})
+
+    def test_delete_router_restored_on_controller_fail(self):
+        self.parent_get_router.return_value[l3.EXTERNAL_GW_INFO] = {
+            'network_id': 'ext-net'}
+        self.plugin.client_sdn.rest_delete_router.side_effect = \
+            client.RemoteRestError("error")
+        self.plugin._update_router_gw_info = mock.Mock()
+
+        with mock.patch.object(l3_router_huawei.l3_db, 'Router',
+                               dict, create=True):
+            self.assertRaises(client.RemoteRestError,
+                              self.plugin.delete_router,
+                              self.context, 'router-1')
+
+        self.parent_delete_router.assert_called_once_with(self.context,
+                                                          'router-1')
+        restored, = self.context.session.add.call_args[0]
+        self.assertEqual(('router-1', 'r1'),
+                         (restored['id'], restored['name']))
+        self.plugin._update_router_gw_info.assert_called_once_with(
+            self.context, 'router-1', {'network_id': 'ext-net'})
+
+    def test_controller_calls_admitted_by_dispatcher(self):
+        plugin = l3_router_huawei.HuaweiL3RouterPlugin()
+        self.assertIsNotNone(plugin.dispatcher)
+        self.assertIs(plugin.dispatcher, plugin.client_sdn.dispatcher)
+
+    def test_interface_removal_restored_on_controller_fail(self):
+        self.parent_get_router.return_value['tenant_id'] = 'tenant-2'
+        self.parent_remove_router_interface.return_value = {
+            'id': 'router-1', 'tenant_id': 'tenant-1',
+            'port_id': 'port-1', 'subnet_id': 'subnet-1'}
+        self.plugin.client_sdn.rest_remove_router_interface.side_effect = \
+            client.RemoteRestError("error")
+
+        self.assertRaises(client.RemoteRestError,
+                          self.plugin.remove_router_interface,
+                          self.context, 'router-1', {'port_id': 'port-1'})
+
+        self.plugin.client_sdn.rest_remove_router_interface.\
+            assert_called_once_with('tenant-2', 'router-1', 'port-1')
+        self.parent_add_router_interface.assert_called_once_with(
+            self.context, 'router-1', {'subnet_id': 'subnet-1'})
+
+    def test_concurrent_interfaces_sent_in_one_request(self):
+        self.plugin.interface_batches.window = 0.5
+        # subnets of another tenant, sent under the router's tenant
+        self.parent_add_router_interface.side_effect = \
+            lambda ctx, router_id, info: {
+                'id': router_id, 'tenant_id': 'tenant-2',
+                'port_id': 'port-' + info['subnet_id'],
+                'subnet_id': info['subnet_id']}
+        threads = [threading.Thread(
+            target=self.plugin.add_router_interface,
+            args=(self.context, 'router-1', {'subnet_id': 'subnet-%d' % i}))
+            for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        client_sdn = self.plugin.client_sdn
+        self.assertFalse(client_sdn.rest_add_router_interface.called)
+        (tenant_id, router_id, interfaces), kwargs = \
+            client_sdn.rest_add_router_interfaces.call_args
+        self.assertEqual(('tenant-1', 'router-1'), (tenant_id, router_id))
+        self.assertEqual(['port-subnet-0', 'port-subnet-1', 'port-subnet-2'],
+                         sorted(intf['id'] for intf in interfaces))
+
+    def _floatingip(self, fip_id, port_id=None):
+        return {'id': fip_id, 'tenant_id': 'tenant-1',
+                'floating_network_id': 'ext-net', 'port_id': port_id,
+                'floating_ip_address': '172.24.4.%d' % int(fip_id[4:]),
+                'fixed_ip_address': port_id and '10.0.0.1',
+                'router_id': port_id and 'router-1', 'status': 'DOWN'}
+
+    def test_floatingip_associations_sent_per_network(self):
+        self.plugin.floatingip_batches.window = 0.5
+        self.parent_update_floatingip.side_effect = \
+            lambda ctx, fip_id, body: self._floatingip(
+                fip_id, body['floatingip']['port_id'])
+        threads = [threading.Thread(
+            target=self.plugin.update_floatingip,
+            args=(self.context, 'fip-%d' % i,
+                  {'floatingip': {'port_id': 'port-%d' % i}}))
+            for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        client_sdn = self.plugin.client_sdn
+        self.assertFalse(client_sdn.rest_update_network.called)
+        (tenant_id, network_id, floatingips), kwargs = \
+            client_sdn.rest_update_floatingips.call_args
+        self.assertEqual(('admin', 'ext-net'), (tenant_id, network_id))
+        self.assertEqual(['port-0', 'port-1', 'port-2'],
+                         sorted(fip['port_id'] for fip in floatingips))
+        self.assertNotIn('status', floatingips[0])
+        self.assertEqual(1, self.core_plugin.get_network.call_count)
+
+    def test_delete_overrides_pending_update(self):
+        self.plugin.floatingip_batches.window = 0.5
+        self.parent_update_floatingip.side_effect = \
+            lambda ctx, fip_id, body: self._floatingip(
+                fip_id, body['floatingip']['port_id'])
+        self.parent_get_floatingip.return_value = self._floatingip('fip-1')
+        update = threading.Thread(
+            target=self.plugin.update_floatingip,
+            args=(self.context, 'fip-1',
+                  {'floatingip': {'port_id': 'port-1'}}))
+        update.start()
+        while not self.plugin.floatingip_batches._open:
+            time.sleep(0.01)
+        self.plugin.delete_floatingip(self.context, 'fip-1')
+        update.join()
+
+        client_sdn = self.plugin.client_sdn
+        self.assertFalse(client_sdn.rest_update_floatingip.called)
+        client_sdn.rest_delete_floatingip.assert_called_once_with(
+            'admin', 'ext-net', 'fip-1')
+
+    def test_floatingip_update_restored_on_controller_fail(self):
+        self.plugin.floatingip_batches.window = 0
+        self.parent_get_floatingip.return_value = self._floatingip(
+            'fip-1', 'port-1')
+        self.parent_update_floatingip.side_effect = \
+            lambda ctx, fip_id, body: self._floatingip(
+                fip_id, body['floatingip']['port_id'])
+        self.plugin.client_sdn.rest_update_floatingip.side_effect = \
+            client.RemoteRestError("error")
+
+        self.assertRaises(client.RemoteRestError,
+                          self.plugin.update_floatingip, self.context,
+                          'fip-1', {'floatingip': {'port_id': 'port-2'}})
+
+        self.parent_update_floatingip.assert_called_with(
+            self.context, 'fip-1', {'floatingip': {'port_id': 'port-1'}})
+
+    def test_floatingip_kept_on_controller_delete_fail(self):
+        self.plugin.floatingip_batches.window = 0
+        self.parent_get_floatingip.return_value = self._floatingip('fip-1')
+        self.plugin.client_sdn.rest_delete_floatingip.side_effect = \
+            client.RemoteRestError("error")
+        transaction = self.context.session.begin.return_value
+
+        self.assertRaises(client.RemoteRestError,
+                          self.plugin.delete_floatingip, self.context,
+                          'fip-1')
+
+        self.assertFalse(self.parent_delete_floatingip.called)
+        exc_type = transaction.__exit__.call_args[0][0]
+        self.assertIs(client.RemoteRestError, exc_type)
+
+    def test_disassociate_pushed_after_commit(self):
+        self.plugin.floatingip_batches.window = 0
+        self.parent_get_floatingips.return_value = [
+            self._floatingip('fip-1', 'port-1')]
+        listeners = {}
+        with mock.patch.object(l3_router_huawei.event, 'listen',
+                               lambda session, name, fn:
+                               listeners.setdefault(name, fn)):
+            self.plugin.disassociate_floatingips(self.context, 'port-1')
+
+        client_sdn = self.plugin.client_sdn
+        self.assertFalse(client_sdn.rest_update_floatingip.called)
+        listeners['after_commit'](self.context.session)
+        listeners['after_commit'](self.context.session)
+        self.assertEqual(1, client_sdn.rest_update_floatingip.call_count)
+
+    def test_commit_listeners_registered_once_per_session(self):
+        self.plugin.floatingip_batches.window = 0
+        self.parent_get_floatingips.side_effect = \
+            lambda ctx, filters: [self._floatingip(
+                'fip-' + filters['port_id'][0][5:], filters['port_id'][0])]
+        listen = mock.Mock()
+        with mock.patch.object(l3_router_huawei.event, 'listen', listen):
+            self.plugin.disassociate_floatingips(self.context, 'port-1')
+            l3_router_huawei._rolled_back(self.context.session)
+            self.plugin.disassociate_floatingips(self.context, 'port-2')
+            self.plugin.disassociate_floatingips(self.context, 'port-3')
+            l3_router_huawei._committed(self.context.session)
+
+        self.assertEqual(['after_commit', 'after_rollback'],
+                         sorted(c[0][1] for c in listen.call_args_list))
+        pushed = [c[0][2]['id'] for c in
+                  self.plugin.client_sdn.rest_update_floatingip.call_args_list]
+        self.assertEqual(['fip-2', 'fip-3'], pushed)
+
+    def test_disassociate_sends_cleared_floatingip(self):
+        self.plugin.floatingip_batches.window = 0
+        self.context.session.transaction = None
+        self.parent_get_floatingips.return_value = [
+            self._floatingip('fip-1', 'port-1')]
+        self.plugin.client_sdn.rest_update_floatingip.side_effect = \
+            client.RemoteRestError("error")
+
+        self.plugin.disassociate_floatingips(self.context, 'port-1')
+
+        self.parent_disassociate_floatingips.assert_called_once_with(
+            self.context, 'port-1')
+        (tenant_id, network_id, floatingip), kwargs = \
+            self.plugin.client_sdn.rest_update_floatingip.call_args
+        self.assertEqual(('fip-1', None, None),
+                         (floatingip['id'], floatingip['port_id'],
+                          floatingip['router_id']))
+
+
 class FakeNetworkContext(object):
     """To generate network context for testing purposes only."""
 
@@ -0,0 +1,367 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright (c) 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replay a recorded controller traffic through HuaweiDriver.
+
+Reads a recording written with RESTCLIENT traffic_record_file (rotated
+parts included) and replays it against a local FakeController through
+the postcommits of HuaweiDriver, with Neutron state in a throw-away
+sqlite database, so that mapping, batching and dispatching are part of
+what is measured. Network and port requests are turned back into the
+driver operation that sent them:
+
+    POST   networks       create_network_postcommit
+    PUT    networks/*     update_network_postcommit
+    DELETE networks/*     delete_network_postcommit
+    POST   ports          create_port_postcommit (and its attachment)
+    DELETE ports/*        delete_port_postcommit (and its attachment)
+
+Other requests (routers, floating IPs, bulk updates, the change feed)
+are sent through the SdnClient of the driver as they were recorded,
+with payloads of the recorded size. Retries of a failed request on the
+next server are folded into it. The fake controller answers every
+request with its recorded status: recorded successes are served by the
+fake controller, errors are returned as they were and requests that got
+no response are answered with 503.
+
+Operations are issued at their original pace, accelerated by --speed,
+or as fast as possible with --speed 0. The JSON report compares
+replayed with recorded latencies and errors per operation, so two
+builds can be compared on the same workload:
+
+    python replay_traffic.py /var/log/neutron/huawei-traffic --speed 10
+"""
+
+import argparse
+import collections
+import functools
+import json
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from neutron import context as qcontext
+from neutron.plugins.ml2.drivers.huawei import clients
+from neutron.plugins.ml2.drivers.huawei import recorder
+
+import bench_driver_load
+import fake_controller
+
+
+NETWORKS_RE = re.compile(r'^/tenants/([^/]+)/networks$')
+NETWORK_RE = re.compile(r'^/tenants/([^/]+)/networks/([^/]+)$')
+PORTS_RE = re.compile(r'^/tenants/([^/]+)/networks/([^/]+)/ports$')
+PORT_RE = re.compile(r'^/tenants/([^/]+)/networks/([^/]+)/ports/([^/]+)'
+                     r'(/attachment)?$')
+
+# status served for a recorded request that got no response
+NO_RESPONSE_STATUS = 503
+
+
+class RecordedResponses(object):
+    """Answer the requests of a recording with their recorded status.
+
+    Statuses are queued per method and resource in recording order. A
+    recorded success of a driver operation is served by the routes the
+    controller had before, so that the driver gets the documents it
+    expects; requests sent as recorded, with made up payloads, only get
+    the status. Requests nothing was recorded for, such as the ports a
+    replayed create names, are served by the routes too.
+    """
+
+    def __init__(self, controller):
+        self.routes = list(controller.routes)
+        self.statuses = {}
+        for method in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
+            controller.add_route(method, r'/.*',
+                                 functools.partial(self._answer, method))
+
+    def expect(self, method, resource, status, serve=True):
+        key = (method, resource.split('?', 1)[0])
+        self.statuses.setdefault(key, collections.deque()).append(
+            (status, serve))
+
+    def _answer(self, method, resource, data, query, headers):
+        # called with the store lock held
+        statuses = self.statuses.get((method, resource))
+        status, serve = statuses.popleft() if statuses else (None, True)
+        if status is not None and status not in clients.SUCCESS_CODES:
+            if not status:
+                status = NO_RESPONSE_STATUS
+            return status, {'error': 'recorded failure'}
+        if not serve:
+            return status, None
+        for route_method, regex, func in self.routes:
+            if route_method == method and regex.match(resource):
+                return func(resource, data, query, headers)
+        return 404, None
+
+
+class Operation(object):
+    """One driver operation, or raw request, of a recording."""
+
+    def __init__(self, name, record, func, args, raw=False):
+        self.name = name
+        self.raw = raw
+        self.start = record.start
+        self.func = func
+        self.args = args
+        self.records = [record]
+
+    @property
+    def recorded_duration(self):
+        return sum(record.duration for record in self.records)
+
+    @property
+    def recorded_error(self):
+        return self.records[-1].status not in clients.SUCCESS_CODES
+
+
+def _payload(size):
+    """Return data whose JSON encoding is close to size bytes."""
+    overhead = len(json.dumps({'replay': ''}))
+    return {'replay': 'x' * max(0, size - overhead)}
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def pct(percent):
+        index = min(len(values) - 1,
+                    int(round(percent / 100.0 * (len(values) - 1))))
+        return round(values[index] * 1000, 3)
+    return {'count': len(values), 'p50_ms': pct(50), 'p95_ms': pct(95),
+            'p99_ms': pct(99), 'max_ms': round(values[-1] * 1000, 3)}
+
+
+class Replay(object):
+    """Turn records into driver operations against one fake controller."""
+
+    def __init__(self, driver, controller, responses):
+        self.driver = driver
+        self.plugin = driver.db_base_plugin_v2
+        self.context = qcontext.get_admin_context()
+        self.controller = controller
+        self.responses = responses
+        self.networks = {}
+
+    def network(self, tenant_id, network_id=None):
+        """Return a network known to Neutron and to the controller."""
+        network = self.networks.get(network_id)
+        if network is None:
+            body = {'name': 'replay', 'admin_state_up': True,
+                    'shared': False, 'tenant_id': tenant_id}
+            if network_id is not None:
+                body['id'] = network_id
+            network = self.plugin.create_network(self.context,
+                                                  {'network': body})
+            self.networks[network['id']] = network
+            # requests recorded after the network was created expect it
+            # on the controller, whatever the replay does with the create
+            path = clients.NETWORKS_PATH % (tenant_id, network['id'])
+            self.controller.store[path] = {'id': network['id'],
+                                           'tenant_id': tenant_id}
+        return network
+
+    def port(self, network, port_id=None):
+        return {'id': port_id or str(uuid.uuid4()),
+                'name': '',
+                'network_id': network['id'],
+                'tenant_id': network['tenant_id'],
+                'device_id': str(uuid.uuid4()),
+                'device_owner': 'compute:nova',
+                'mac_address': 'fa:16:3e:00:00:01',
+                'admin_state_up': True,
+                'binding:host_id': 'replay'}
+
+    def operations(self, records):
+        """Return the operations of records, in recording order."""
+        operations = []
+        last = {}
+        # port creates waiting for the attachment naming their port
+        creating = {}
+        for record in records:
+            key = (record.method, record.resource)
+            previous = last.get(key)
+            if (previous is not None and previous.recorded_error and
+                    previous.records[-1].server != record.server):
+                # the client failed over to the next server
+                previous.records.append(record)
+                operation = previous
+            else:
+                operation = self._operation(record, creating)
+                if operation is not None:
+                    last[key] = operation
+                    operations.append(operation)
+            self.responses.expect(record.method, record.resource,
+                                  record.status,
+                                  serve=operation is None or
+                                  not operation.raw)
+        return operations
+
+    def _postcommit(self, name, record, current, original=None):
+        context = bench_driver_load.ResourceContext(current, original)
+        return Operation(name, record,
+                         getattr(self.driver, name + '_postcommit'),
+                         (context,))
+
+    def _operation(self, record, creating):
+        resource = record.resource.split('?', 1)[0]
+        method = record.method
+        match = NETWORKS_RE.match(resource)
+        if match and method == 'POST':
+            return self._postcommit('create_network', record,
+                                    self.network(match.group(1)))
+        match = NETWORK_RE.match(resource)
+        if match and method in ('PUT', 'DELETE'):
+            network = self.network(*match.groups())
+            if method == 'DELETE':
+                return self._postcommit('delete_network', record, network)
+            original = dict(network, name=network['name'] + '-old')
+            return self._postcommit('update_network', record, network,
+                                    original)
+        match = PORTS_RE.match(resource)
+        if match and method == 'POST':
+            port = self.port(self.network(*match.groups()))
+            creating.setdefault(port['network_id'], []).append(port)
+            return self._postcommit('create_port', record, port)
+        match = PORT_RE.match(resource)
+        if match and method in ('PUT', 'DELETE'):
+            tenant_id, network_id, port_id, attachment = match.groups()
+            network = self.network(tenant_id, network_id)
+            if attachment and method == 'PUT':
+                pending = creating.get(network_id)
+                if pending:
+                    # the create replays with the recorded port id
+                    pending.pop(0)['id'] = port_id
+                    return None
+            elif attachment:
+                # sent by the delete_port_postcommit of the port
+                return None
+            elif method == 'DELETE':
+                return self._postcommit('delete_port', record,
+                                        self.port(network, port_id))
+        return Operation(clients.operation_kind(method, resource), record,
+                         self.driver.client_sdn.rest_action,
+                         (method, record.resource,
+                          _payload(record.payload_bytes)), raw=True)
+
+
+def replay(operations, speed, concurrency):
+    """Run operations, return per operation latencies and errors."""
+    slots = threading.Semaphore(concurrency)
+    lock = threading.Lock()
+    replayed = {}
+    errors = collections.Counter()
+    threads = []
+
+    def run(operation):
+        try:
+            start = time.time()
+            try:
+                operation.func(*operation.args)
+            except Exception:
+                with lock:
+                    errors[operation.name] += 1
+            elapsed = time.time() - start
+            with lock:
+                replayed.setdefault(operation.name, []).append(elapsed)
+        finally:
+            slots.release()
+
+    first = None
+    begin = time.time()
+    for operation in operations:
+        if first is None:
+            first = operation.start
+        if speed > 0:
+            delay = ((operation.start - first) / speed -
+                     (time.time() - begin))
+            if delay > 0:
+                time.sleep(delay)
+        slots.acquire()
+        t = threading.Thread(target=run, args=(operation,))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return replayed, errors, time.time() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time acceleration, 0 = as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='max operations outstanding at once')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='fake controller latency in seconds')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    files = recorder.recording_files(args.recording)
+    if not files:
+        parser.error('no recording at %s' % args.recording)
+
+    workdir = tempfile.mkdtemp(prefix='huawei-replay-')
+    controller = fake_controller.FakeController(latency=args.latency)
+    responses = RecordedResponses(controller)
+    port = controller.start()
+    try:
+        driver = bench_driver_load.setup_driver(workdir, port)
+        operations = Replay(driver, controller, responses).operations(
+            recorder.read_records(files))
+        replayed, errors, elapsed = replay(operations, args.speed,
+                                           args.concurrency)
+    finally:
+        controller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    recorded = {}
+    recorded_errors = collections.Counter()
+    for operation in operations:
+        recorded.setdefault(operation.name, []).append(
+            operation.recorded_duration)
+        if operation.recorded_error:
+            recorded_errors[operation.name] += 1
+    total = sum(len(v) for v in replayed.values())
+    results = {'files': files,
+               'speed': args.speed,
+               'operations': total,
+               'seconds': round(elapsed, 3),
+               'throughput_ops': round(total / elapsed, 2) if elapsed else 0,
+               'by_operation': dict(
+                   (name, {'replayed': _summary(replayed.get(name, [])),
+                           'recorded': _summary(values),
+                           'replayed_errors': errors[name],
+                           'recorded_errors': recorded_errors[name]})
+                   for name, values in recorded.items())}
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()